@@ -1,34 +1,165 @@
-from wachat import WAChat
+import argparse
 import os
+import sys
+import time
+import wabatch
+import waexport
+import waprofile
+
+# Runs a set of WAChat queries over many exports:
+#   python main.py exports/ --jobs 4 --out-dir results \
+#       --query getMembers \
+#       --query getMembers_givenYearAndMonth_dailyInfo:2016,3
+# writes results/<export>.json per chat and results/summary.json.
+# With --format csv (or npz, parquet) every query result is written as a
+# flat table to results/<export>/<query>.csv instead, see waexport.
+# --texts csv streams every member's texts to results/<export>/texts.csv.
 
 
 def main():
-    fileName = "whatsapp_2016_04_01.txt" if len(os.sys.argv) < 2 else os.sys.argv[1]
-    myChat = WAChat(fileName)
-    # myChat.plotMembersSpokenLines(plotTitle="July 2015", fromMonth=7,
-                                  # fromYear=2015)
-
-    # print myChat.getMemberMonthlyFrequencies()
-    # names = myChat.getMembers().keys()
-    # for name in names:
-    #     myChat.plotOverHoursMemberSpokenLines(name)
-    # for name in names:
-    #     myChat.plotGivenYearOverMonthFrequencies(name)
-    # print myChat.getMembers()
-    March_2016  = myChat.getMembers_givenYearAndMonth_dailyInfo(2016, 3)
-    # print myChat.getMembers_givenYear_monthlyInfo(2012)
-    # print myChat.getMembers_givenYearAndMonthAndDay_hourlyInfo(2013, 7, 20)
-    # print myChat.getMemberAllYearsOverMonthFrequencies()
-    # txtSeparated = myChat.getMessagesSeperatedByUsers()
-    # import csv
-    # writer = csv.writer(open('txtSeparated.csv', 'wb'))
-    # writer.writerow(['name', 'text'])
-    # for key, value in txtSeparated.items():
-    #     writer.writerow([key, value])
-        # print key
-    import json
-    with open('March_2016.json', 'w') as fp:
-        json.dump(March_2016, fp)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="*",
+                        default=["whatsapp_2016_04_01.txt"],
+                        help="export files, or directories of them")
+    parser.add_argument("--pattern", default="*.txt",
+                        help="exports to pick from directories")
+    parser.add_argument("--query", dest="queries", action="append",
+                        help="WAChat query to run on every chat, as name or "
+                        "name:arg,arg,key=value (repeatable); one of "
+                        + ", ".join(wabatch.QUERIES))
+    parser.add_argument("--out-dir", dest="outDir", default="results",
+                        help="where per-chat results and summary.json go")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="chats processed at once, each in its own "
+                        "process")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="processes used to parse each export "
+                        "(only with --jobs 1)")
+    parser.add_argument("--cache-dir", dest="cacheDir", default=None,
+                        help="directory for parsed chat snapshots")
+    parser.add_argument("--stream", action="store_true",
+                        help="aggregate each export in one constant memory "
+                        "pass; only " + ", ".join(wabatch.STREAM_QUERIES))
+    parser.add_argument("--keep-unicode", dest="keepUnicode",
+                        action="store_true",
+                        help="keep names and texts in UTF-8 instead of "
+                        "stripping them to ASCII")
+    parser.add_argument("--charts", action="store_true",
+                        help="render every chart of each chat to "
+                        "<out-dir>/<export>/")
+    parser.add_argument("--render-workers", dest="renderWorkers", type=int,
+                        default=1,
+                        help="processes drawing the charts of a chat "
+                        "(only with --jobs 1)")
+    parser.add_argument("--format", dest="tableFormat", default="json",
+                        choices=("json",) + waexport.FORMATS,
+                        help="write query results as tables of this format "
+                        "to <out-dir>/<export>/ instead of into the JSON "
+                        "result")
+    parser.add_argument("--export-store", dest="exportStore",
+                        action="store_true",
+                        help="also write the messages and activity tables "
+                        "of each chat (needs a table --format)")
+    parser.add_argument("--texts", default=None,
+                        choices=sorted(wabatch.TEXTS_NAMES),
+                        help="stream every member's texts to "
+                        "<out-dir>/<export>/texts.csv, or to one file per "
+                        "member in <out-dir>/<export>/texts/")
+    parser.add_argument("--profile", action="store_true",
+                        help="include per-stage timings in every result "
+                        "and print them for single chats")
+    args = parser.parse_args()
+
+    queries = args.queries or list(wabatch.DEFAULT_QUERIES)
+    for spec in queries:
+        try:
+            name = wabatch.parseQuery(spec)[0]
+        except ValueError as error:
+            parser.error(str(error))
+        if args.stream and name not in wabatch.STREAM_QUERIES:
+            parser.error("%s is not available with --stream" % name)
+    if args.stream:
+        try:
+            wabatch.streamKeywords(queries)
+        except ValueError as error:
+            parser.error(str(error))
+    if args.jobs > 1 and (args.workers > 1 or args.renderWorkers > 1):
+        # Pool processes cannot start pools of their own
+        parser.error("--workers and --render-workers need --jobs 1")
+    if args.stream and args.charts:
+        parser.error("--charts is not available with --stream")
+    if args.exportStore and args.tableFormat == "json":
+        parser.error("--export-store needs --format csv, npz or parquet")
+    if args.stream and args.exportStore:
+        parser.error("--export-store is not available with --stream")
+    if args.stream and args.texts:
+        parser.error("--texts is not available with --stream")
+    if args.tableFormat == "parquet":
+        try:
+            waexport.importPyarrow()
+        except ImportError as error:
+            parser.error(str(error))
+    fileNames = wabatch.exportFiles(args.paths, args.pattern)
+    if not fileNames:
+        parser.error("no exports found")
+    if not os.path.isdir(args.outDir):
+        os.makedirs(args.outDir)
+    outputNames = wabatch.outputNames(fileNames)
+    chatDirs = dict((fileName, os.path.join(args.outDir,
+                                            os.path.splitext(name)[0]))
+                    for fileName, name in outputNames.iteritems())
+    chartsDirs = chatDirs if args.charts else None
+    tablesDirs = chatDirs if args.tableFormat != "json" else None
+    if args.stream:
+        chatOptions = {'stream': True, 'keepUnicode': args.keepUnicode}
+    else:
+        chatOptions = {'workers': args.workers, 'cacheDir': args.cacheDir,
+                       'profile': args.profile,
+                       'keepUnicode': args.keepUnicode}
+
+    started = time.time()
+    linesDone = [0]
+
+    def progress(done, total, result):
+        if result['status'] == 'ok':
+            linesDone[0] += result['linesRead']
+            status = '%d messages in %.2fs' % (result['messages'],
+                                                result['seconds'])
+        else:
+            status = 'FAILED: %s' % result['error'].strip().splitlines()[-1]
+        elapsed = time.time() - started
+        sys.stderr.write("[%d/%d] %s: %s (%.0f lines/s overall)\n"
+                         % (done, total, result['file'], status,
+                            linesDone[0] / elapsed if elapsed else 0.0))
+
+    summaries = []
+    for result in wabatch.runBatch(fileNames, queries, args.jobs,
+                                   chatOptions, progress, chartsDirs,
+                                   args.renderWorkers, tablesDirs,
+                                   args.tableFormat, args.exportStore,
+                                   chatDirs, args.texts):
+        result['output'] = outputNames[result['file']]
+        wabatch.writeResult(result, os.path.join(args.outDir,
+                                                 result['output']))
+        if args.profile and len(fileNames) == 1 and 'profile' in result:
+            for line in waprofile.formatReport(result['profile']):
+                sys.stderr.write(line + '\n')
+        # Only the summary fields are kept for the rest of the batch
+        result.pop('queries')
+        result.pop('profile', None)
+        summaries.append(result)
+
+    summary = wabatch.summarize(summaries, time.time() - started)
+    summary['queries'] = queries
+    wabatch.writeResult(summary, os.path.join(args.outDir,
+                                              wabatch.SUMMARY_NAME))
+    sys.stderr.write("%d chats (%d failed), %d messages in %.2fs, "
+                     "%.0f lines/s\n"
+                     % (summary['files'], summary['failed'],
+                        summary['messages'], summary['seconds'],
+                        summary['linesPerSecond']))
+    if summary['failed']:
+        sys.exit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,123 @@
+from datetime import datetime
+import random
+import unittest
+import numpy as np
+from waanalytics import ConversationAnalytics
+from wastore import MessageStoreBuilder, dateToTimestamp
+
+MEMBERS = ['Al', 'Bo', 'Cy', 'Di']
+GAP = 600
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    return (values[(len(values) - 1) // 2] + values[middle]) / 2.0
+
+
+class AnalyticsTest(unittest.TestCase):
+
+    def setUp(self):
+        # Distinct timestamps a few seconds to an hour apart, appended out
+        # of order
+        rng = random.Random(7)
+        timestamp = dateToTimestamp(datetime(2016, 3, 20))
+        self.messages = []
+        for i in range(400):
+            timestamp += rng.choice((5, 30, 120, 400, 900, 3600))
+            self.messages.append((timestamp, rng.choice(MEMBERS)))
+        shuffled = list(self.messages)
+        rng.shuffle(shuffled)
+        builder = MessageStoreBuilder()
+        for timestamp, user in shuffled:
+            builder.append(timestamp, user, 'text')
+        self.store = builder.build()
+
+    def loopSessions(self, messages):
+        # [[(timestamp, user)]] per session, one message at a time
+        sessions = []
+        previous = None
+        for timestamp, user in messages:
+            if previous is None or timestamp - previous > GAP:
+                sessions.append([])
+            sessions[-1].append((timestamp, user))
+            previous = timestamp
+        return sessions
+
+    def loopReplies(self, messages):
+        # [(replied after, replier, latency)], one message at a time
+        return [(before[1], after[1], after[0] - before[0])
+                for before, after in zip(messages, messages[1:])
+                if before[1] != after[1] and after[0] - before[0] <= GAP]
+
+    def testSessions(self):
+        analytics = ConversationAnalytics(self.store)
+        sessions = analytics.sessions(GAP)
+        expected = self.loopSessions(self.messages)
+        members = self.store.members
+        self.assertEqual(sessions['start'].tolist(),
+                         [session[0][0] for session in expected])
+        self.assertEqual(sessions['end'].tolist(),
+                         [session[-1][0] for session in expected])
+        self.assertEqual(sessions['messages'].tolist(),
+                         [len(session) for session in expected])
+        self.assertEqual(sessions['members'].tolist(),
+                         [len(set(user for timestamp, user in session))
+                          for session in expected])
+        self.assertEqual([members[code] for code in sessions['starter']],
+                         [session[0][1] for session in expected])
+        summary = analytics.sessionSummary(GAP)
+        self.assertEqual(summary['sessions'], len(expected))
+        for member in MEMBERS:
+            self.assertEqual(summary['started'][member],
+                             sum(session[0][1] == member
+                                 for session in expected))
+            self.assertEqual(summary['participated'][member],
+                             sum(any(user == member
+                                     for timestamp, user in session)
+                                 for session in expected))
+
+    def testReplies(self):
+        analytics = ConversationAnalytics(self.store)
+        replies = self.loopReplies(self.messages)
+        self.assertEqual(
+            analytics.replyLatencies(GAP),
+            dict((member, median([latency for before, replier, latency
+                                  in replies if replier == member]))
+                 for member in set(replier for before, replier, latency
+                                   in replies)))
+        expected = dict()
+        for before, replier, latency in replies:
+            counts = expected.setdefault(replier, dict())
+            counts[before] = counts.get(before, 0) + 1
+        self.assertEqual(analytics.repliedAfter(GAP), expected)
+        self.assertEqual(int(analytics.repliedAfterMatrix(GAP).sum()),
+                         len(replies))
+
+    def testWindow(self):
+        start = datetime(2016, 3, 22)
+        end = datetime(2016, 3, 24)
+        analytics = ConversationAnalytics(self.store, start, end)
+        inside = [(timestamp, user) for timestamp, user in self.messages
+                  if dateToTimestamp(start) <= timestamp <
+                  dateToTimestamp(end)]
+        self.assertEqual(len(analytics), len(inside))
+        self.assertEqual(analytics.sessions(GAP)['messages'].tolist(),
+                         [len(session)
+                          for session in self.loopSessions(inside)])
+        self.assertEqual(int(analytics.repliedAfterMatrix(GAP).sum()),
+                         len(self.loopReplies(inside)))
+
+    def testEmptyWindow(self):
+        analytics = ConversationAnalytics(self.store, datetime(2010, 1, 1),
+                                          datetime(2010, 1, 2))
+        self.assertEqual(len(analytics), 0)
+        self.assertEqual(analytics.sessionSummary(GAP)['sessions'], 0)
+        self.assertEqual(analytics.replyLatencies(GAP), {})
+        self.assertEqual(analytics.repliedAfter(GAP), {})
+        self.assertTrue(isinstance(analytics.sessions(GAP)['start'],
+                                   np.ndarray))
+
+
+if __name__ == '__main__':
+    unittest.main()
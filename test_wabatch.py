@@ -0,0 +1,101 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+import wabatch
+
+EXPORT = ('2/27/12, 10:30:13 PM: Alice: hello cat\n'
+          '2/27/12, 11:35:08 PM: Bob: dog\n'
+          '2/28/12, 12:09:27 AM: Alice: cat and dog\n')
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix='wabatch')
+        self.fileName = os.path.join(self.workDir, 'chat.txt')
+        with open(self.fileName, 'w') as outfile:
+            outfile.write(EXPORT)
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def runChat(self, querySpecs, chatOptions=None, outDir=None,
+                texts=None):
+        result = wabatch.runChat((self.fileName, querySpecs,
+                                  chatOptions or {}, None, 1, None,
+                                  'csv', False, outDir, texts))
+        self.assertEqual(result['status'], 'ok', result.get('error'))
+        return result
+
+    def testOnlyNumericParametersBecomeNumbers(self):
+        self.assertEqual(
+            wabatch.parseQuery('getMembers_givenYearAndMonth_dailyInfo:'
+                               '2012,2,2012'),
+            ('getMembers_givenYearAndMonth_dailyInfo', [2012, 2, '2012'],
+             {}))
+        self.assertEqual(
+            wabatch.parseQuery('getKeywordsDailyFrequencies:2016|cat,'
+                               'substring=0'),
+            ('getKeywordsDailyFrequencies', [['2016', 'cat']],
+             {'substring': 0}))
+        self.assertEqual(wabatch.parseQuery('getTopWords:3,2016,bigrams=1'),
+                         ('getTopWords', [3, '2016'], {'bigrams': 1}))
+        spec = 'getMemberDailyFrequencies:2012'
+        self.assertEqual(self.runChat([spec])['queries'][spec],
+                         {'Alice': [0], 'Bob': [0]})
+
+    def testStreamingAnswersAsLoading(self):
+        specs = ['getMembers', 'getMemberHourlyFrequencies',
+                 'getKeywordsDailyFrequencies:cat',
+                 'getMemberDailyFrequencies',
+                 'getMemberDailyFrequencies:2012']
+        loaded = self.runChat(specs)['queries']
+        self.assertEqual(loaded['getKeywordsDailyFrequencies:cat'],
+                         {'cat': {'Alice': [2], 'Bob': [0]}})
+        self.assertEqual(self.runChat(specs, {'stream': True})['queries'],
+                         loaded)
+
+    def testUnknownQuery(self):
+        self.assertRaises(ValueError, wabatch.parseQuery, 'getNothing')
+
+    def testTexts(self):
+        outDir = os.path.join(self.workDir, 'out')
+        result = self.runChat([], outDir=outDir, texts='csv')
+        with open(os.path.join(outDir, result['texts']), 'rb') as infile:
+            rows = list(csv.reader(infile))
+        self.assertEqual(rows, [['name', 'text'],
+                                ['Alice', ' hello cat cat and dog'],
+                                ['Bob', ' dog']])
+        result = self.runChat([], outDir=outDir, texts='files')
+        self.assertEqual(sorted(os.listdir(os.path.join(outDir,
+                                                        result['texts']))),
+                         ['Alice.txt', 'Bob.txt'])
+
+    def testFailureIsReported(self):
+        result = wabatch.runChat((os.path.join(self.workDir, 'missing.txt'),
+                                  ['getMembers'], {}, None, 1, None,
+                                  'csv', False, None, None))
+        self.assertEqual(result['status'], 'error')
+        self.assertTrue('IOError' in result['error'])
+
+    def testOutputNames(self):
+        fileNames = ['a/chat.txt', 'b/chat.txt', 'summary.txt', 'we ird.txt']
+        self.assertEqual(wabatch.outputNames(fileNames),
+                         {'a/chat.txt': 'chat.json',
+                          'b/chat.txt': 'chat-2.json',
+                          'summary.txt': 'summary-2.json',
+                          'we ird.txt': 'we_ird.json'})
+
+    def testTableFileNames(self):
+        self.assertEqual(
+            wabatch.tableFileNames(['getMembers:2012', 'getMembers|2012',
+                                    'messages', 'texts'], 'csv'),
+            {'getMembers:2012': 'getMembers_2012.csv',
+             'getMembers|2012': 'getMembers_2012-2.csv',
+             'messages': 'messages-2.csv', 'texts': 'texts-2.csv'})
+
+
+if __name__ == '__main__':
+    unittest.main()
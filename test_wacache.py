@@ -0,0 +1,63 @@
+import unittest
+import numpy as np
+from wacache import LRUCache, approximateSize, copyResult
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def testHitsAndMisses(self):
+        cache = LRUCache(maxEntries=2)
+        self.assertEqual(cache.get('a'), None)
+        cache.put('a', {'Al': 1})
+        self.assertEqual(cache.get('a'), {'Al': 1})
+        self.assertEqual(cache.get('b', 0), 0)
+        self.assertEqual(cache.stats(), {'entries': 1, 'bytes': 0,
+                                         'hits': 1, 'misses': 2,
+                                         'evictions': 0})
+
+    def testLeastRecentlyUsedIsEvicted(self):
+        cache = LRUCache(maxEntries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        # Using 'a' makes 'b' the oldest
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertTrue('a' in cache and 'c' in cache)
+        self.assertFalse('b' in cache)
+        # Putting a key again replaces its value without evicting
+        cache.put('c', 4)
+        self.assertEqual((len(cache), cache.get('c')), (2, 4))
+        self.assertEqual(cache.evictions, 1)
+
+    def testByteLimit(self):
+        small = np.zeros(10)
+        cache = LRUCache(maxEntries=10, maxBytes=2 * small.nbytes)
+        cache.put('a', small)
+        cache.put('b', small.copy())
+        self.assertEqual(cache.bytes, 2 * small.nbytes)
+        cache.put('c', small.copy())
+        self.assertEqual(sorted(key for key in 'abc' if key in cache),
+                         ['b', 'c'])
+        self.assertEqual(cache.bytes, 2 * small.nbytes)
+        # A value larger than the whole cache is not kept
+        cache.put('d', np.zeros(100))
+        self.assertFalse('d' in cache)
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual((len(cache), cache.bytes), (0, 0))
+
+    def testApproximateSize(self):
+        self.assertTrue(approximateSize({'Al': [1, 2, 3]}) >
+                        approximateSize({'Al': [1]}))
+        self.assertEqual(approximateSize(np.zeros(4)), 32)
+
+    def testCopyResult(self):
+        result = {'Al': [1, 2], 'Bo': {2012: [3]}}
+        copy = copyResult(result)
+        copy['Al'].append(3)
+        copy['Bo'][2012][0] = 0
+        self.assertEqual(result, {'Al': [1, 2], 'Bo': {2012: [3]}})
+
+
+if __name__ == '__main__':
+    unittest.main()
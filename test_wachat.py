@@ -0,0 +1,518 @@
+from datetime import datetime
+import codecs
+import csv
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from wachat import WAChat, isMessageInFrame
+import wasnapshot
+from waparse import ChatParser, Normalizer, partialLine
+from wastore import Message, MessageStoreBuilder, dateToTimestamp
+
+EXPORT = ('2/27/12, 10:30:13 PM: Al: hello\n'
+          '2/27/12, 11:35:08 PM: Bo: hi\n')
+# A BOM, a continuation line, an ERROR user, a group event without a
+# second ': ', ': ' inside a text and a non-ASCII text
+MIXED_EXPORT = (codecs.BOM_UTF8 +
+                '2/27/12, 10:30:13 PM: Alice: hello: world\n'
+                'and a continuation line\n'
+                '2/27/12, 10:31:00 PM: ERROR: dropped\n'
+                '2/27/12, 10:32:00 PM: Alice added Bob\n'
+                '2/28/12, 9:05:12 AM: Bob: caf\xc3\xa9 time  \r\n'
+                '3/1/12, 12:00:00 PM: Bob: noon')
+
+# Messages on February 29 of two leap years, and a stray line from 1970
+LEAP_EXPORT = ('1/1/70, 1:00:00 AM: Zed: stray\n'
+               '2/29/12, 10:30:13 PM: Al: leap\n'
+               '3/1/12, 11:35:08 PM: Bo: hi\n'
+               '2/29/16, 9:00:00 AM: Al: again\n')
+
+
+class ChatFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix='wachat')
+        self.cacheDir = os.path.join(self.workDir, 'cache')
+        self.fileName = os.path.join(self.workDir, 'chat.txt')
+        self.writeExport(EXPORT)
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def writeExport(self, text, mode='w'):
+        with open(self.fileName, mode) as outfile:
+            outfile.write(text)
+
+
+class ParseTest(ChatFileTest):
+
+    def testMessageList(self):
+        self.writeExport(MIXED_EXPORT)
+        chat = WAChat(self.fileName)
+        self.assertEqual(list(chat.messageList), [
+            Message(datetime(2012, 2, 27, 22, 30, 13), 'Alice', 'helloworld'),
+            Message(datetime(2012, 2, 28, 9, 5, 12), 'Bob', 'cafe time'),
+            Message(datetime(2012, 3, 1, 12, 0, 0), 'Bob', 'noon')])
+        self.assertEqual(chat.messageList[-1].text, 'noon')
+        self.assertEqual(chat.parser.linesRead, 6)
+
+    def testQueries(self):
+        self.writeExport(MIXED_EXPORT)
+        chat = WAChat(self.fileName)
+        self.assertEqual(chat.getMembers(), {'Alice': 1, 'Bob': 2})
+        self.assertEqual(chat.getMembers(fromMonth=3), {'Bob': 1})
+        self.assertEqual(chat.getMessagesSeperatedByUsers(),
+                         {'Alice': ' helloworld', 'Bob': ' cafe time noon'})
+        hourly = chat.getMemberHourlyFrequencies()
+        self.assertEqual([hour for hour, count in enumerate(hourly['Bob'])
+                          if count], [9, 12])
+        # 24 hour steps from the first message; 2012 has a February 29
+        self.assertEqual(chat.getMemberDailyFrequencies('time'),
+                         {'Alice': [0, 0, 0], 'Bob': [1, 0, 0]})
+
+    def testEarlierMessagesExtendTheDays(self):
+        # A clock jump in the export: the day axis reaches back to the
+        # earliest message
+        self.writeExport(EXPORT + '2/25/12, 9:00:00 AM: Bo: earlier\n')
+        self.assertEqual(WAChat(self.fileName).getMemberDailyFrequencies(),
+                         {'Al': [0, 0, 0, 1], 'Bo': [1, 0, 0, 1]})
+
+    def testParseLineAgrees(self):
+        # The per-line parser and the block parser read the export the
+        # same way
+        self.writeExport(MIXED_EXPORT)
+        chat = WAChat(self.fileName)
+        parser = ChatParser()
+        records = [parser.parseLine(line)
+                   for line in MIXED_EXPORT.splitlines(True)]
+        self.assertEqual([(chat.store.timestamps[i], message.user,
+                           message.text)
+                          for i, message in enumerate(chat.messageList)],
+                         [record for record in records if record])
+        builder = parser.parseInto(MIXED_EXPORT.splitlines(True),
+                                   MessageStoreBuilder())
+        self.assertEqual(builder.build().timestamps.tolist(),
+                         chat.store.timestamps.tolist())
+
+    def testProfiledParse(self):
+        # Profiling times the stages of the same block parser
+        self.writeExport(MIXED_EXPORT)
+        chat = WAChat(self.fileName, profile=True)
+        self.assertEqual(list(chat.messageList),
+                         list(WAChat(self.fileName).messageList))
+        stats = chat.profileStats()
+        self.assertEqual(stats['counters']['linesRead'], 6)
+        self.assertEqual(stats['counters']['messagesKept'], 3)
+        self.assertEqual(stats['counters']['errorUsersDropped'], 1)
+        self.assertEqual(stats['counters']['linesSkipped'], 2)
+        for name in ('io', 'prefix', 'normalize', 'append'):
+            self.assertTrue(name in stats['stages'], name)
+
+    def testKeepUnicode(self):
+        self.writeExport(MIXED_EXPORT + '\n3/1/12, 1:00:00 PM: Zo\xc3\xab: '
+                         'na\xc3\xafve\n')
+        chat = WAChat(self.fileName)
+        self.assertEqual(chat.getMembers(), {'Alice': 1, 'Bob': 2, 'Zoe': 1})
+        self.assertEqual(chat.messageList[-1].text, 'naive')
+        chat = WAChat(self.fileName, keepUnicode=True)
+        self.assertEqual(chat.getMembers(),
+                         {'Alice': 1, 'Bob': 2, 'Zo\xc3\xab': 1})
+        self.assertEqual([message.text for message in chat.messageList],
+                         ['helloworld', 'caf\xc3\xa9 time', 'noon',
+                          'na\xc3\xafve'])
+
+    def testNormalizer(self):
+        normalizer = Normalizer()
+        # ASCII fields are returned as they are, without a round trip
+        text = 'plain text'
+        self.assertTrue(normalizer.text(text) is text)
+        self.assertEqual(normalizer.text('caf\xc3\xa9'), 'cafe')
+        user = normalizer.user('Zo\xc3\xab')
+        self.assertEqual(user, 'Zoe')
+        self.assertTrue(normalizer.user('Zo\xc3\xab') is user)
+        keeping = Normalizer(keepUnicode=True)
+        self.assertEqual(keeping.text('caf\xc3\xa9'), 'caf\xc3\xa9')
+        self.assertEqual(keeping.user('Zo\xc3\xab'), 'Zo\xc3\xab')
+
+
+class ActivityCubeTest(ChatFileTest):
+
+    def setUp(self):
+        ChatFileTest.setUp(self)
+        self.writeExport(LEAP_EXPORT)
+
+    def testLeapDays(self):
+        chat = WAChat(self.fileName)
+        daily = chat.getMembers_givenYearAndMonth_dailyInfo(2012, 2, 'Al')
+        self.assertEqual(sorted(daily['Al']), range(1, 30))
+        self.assertEqual(daily['Al'][29], 1)
+        self.assertEqual(chat.getMembers_givenYear_monthlyInfo(2016, 'Al'),
+                         {'Al': {1: 0, 2: 1}})
+        self.assertEqual(chat.getMembers(fromMonth=2, untilMonth=2,
+                                         fromDay=29, untilDay=29),
+                         {'Al': 2})
+        self.assertEqual(chat.getMemberMonthlyFrequencies(),
+                         {'Al': [0, 2] + [0] * 10, 'Bo': [0, 0, 1] + [0] * 9})
+
+    def testOnlyYearsWithMessagesHaveCells(self):
+        # The 1970 line does not add the 41 years up to 2012
+        cube = WAChat(self.fileName).store.activityCube()
+        self.assertEqual(cube.years.tolist(), [1970, 2012, 2016])
+        self.assertEqual(cube.counts.shape[:2], (3, 3))
+        years = WAChat(self.fileName).getMemberAllYearsOverMonthFrequencies(
+            'Zed')['Zed']
+        self.assertEqual(sorted(years), range(1970, 2017))
+        self.assertEqual(sum(years[1970].values()), 1)
+        self.assertEqual(sum(sum(months.values())
+                             for months in years.values()), 1)
+
+    def testUnfilteredMembersAreCountedWithoutTheCube(self):
+        chat = WAChat(self.fileName)
+        self.assertEqual(chat.getMembers(fromYear=1970),
+                         {'Al': 2, 'Bo': 1, 'Zed': 1})
+        self.assertTrue(chat.store._activityCube is None)
+        self.assertEqual(chat.getMembers(), {'Al': 2, 'Bo': 1})
+
+    def testNewYearsAndMembersOnRefresh(self):
+        chat = WAChat(self.fileName)
+        chat.store.activityCube()
+        self.writeExport('1/1/17, 9:00:00 AM: Cy: new year\n', 'a')
+        self.assertEqual(chat.refresh(), (1, False))
+        self.assertEqual(chat.store.activityCube().years.tolist(),
+                         [1970, 2012, 2016, 2017])
+        self.assertEqual(chat.getMembers(fromYear=2016),
+                         {'Al': 1, 'Cy': 1})
+
+
+class UnsortedStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        # Messages spread over a few years, appended out of order
+        rng = random.Random(3)
+        start = dateToTimestamp(datetime(2011, 11, 1))
+        end = dateToTimestamp(datetime(2014, 3, 1))
+        builder = MessageStoreBuilder()
+        for i in range(600):
+            builder.append(rng.randrange(start, end),
+                           rng.choice(('Al', 'Bo', 'Cy')), 'text')
+        self.store = builder.build()
+        self.messages = [self.store.getMessage(i)
+                         for i in range(len(self.store))]
+
+    def testGroupCounts(self):
+        indices = self.store.frameIndices(fromYear=2012, untilYear=2013)
+        counts = self.store.groupCounts([('month', 1, 12),
+                                         ('hour', 6, 17)], indices)
+        self.assertEqual(counts.shape, (3, 12, 12))
+        expected = np.zeros_like(counts)
+        for message in self.messages:
+            if (2012 <= message.date.year <= 2013 and
+                    6 <= message.date.hour <= 17):
+                expected[self.store.memberCodes[message.user],
+                         message.date.month - 1,
+                         message.date.hour - 6] += 1
+        self.assertEqual(counts.tolist(), expected.tolist())
+
+    def testFrameIndices(self):
+        frames = [(0, 23, 1, 31, 1, 12, 2009, 2020),
+                  (0, 23, 1, 31, 1, 12, 2012, 2012),
+                  (0, 23, 1, 31, 2, 2, 2012, 2013),
+                  (0, 23, 29, 29, 2, 2, 2012, 2012),
+                  (9, 17, 10, 20, 3, 11, 2012, 2013),
+                  (0, 23, 1, 31, 1, 12, 2015, 2016),
+                  (0, 23, 1, 31, 7, 3, 2012, 2013)]
+        for frame in frames:
+            self.assertEqual(self.store.frameIndices(*frame).tolist(),
+                             [i for i, message in enumerate(self.messages)
+                              if isMessageInFrame(message, *frame)],
+                             frame)
+
+    def testIndicesBetween(self):
+        start = dateToTimestamp(datetime(2012, 2, 27, 10))
+        end = dateToTimestamp(datetime(2013, 1, 1))
+        indices = self.store.indicesBetween(start, end)
+        timestamps = self.store.timestamps[indices].tolist()
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(sorted(indices.tolist()),
+                         [i for i, timestamp
+                          in enumerate(self.store.timestamps.tolist())
+                          if start <= timestamp < end])
+        # What getMembersBetween answers
+        expected = dict()
+        for i in indices.tolist():
+            user = self.messages[i].user
+            expected[user] = expected.get(user, 0) + 1
+        self.assertEqual(self.store.memberCounts(indices), expected)
+
+
+class KeywordTest(ChatFileTest):
+
+    def testKeywordTimelines(self):
+        self.writeExport(MIXED_EXPORT)
+        chat = WAChat(self.fileName)
+        self.assertEqual(chat.getMemberDailyFrequencies('O'),
+                         {'Alice': [1, 0, 0], 'Bob': [0, 0, 1]})
+        self.assertEqual(chat.getMemberDailyFrequencies('o', False),
+                         {'Alice': [0, 0, 0], 'Bob': [0, 0, 0]})
+        keywords = ['o', 'time', 'cafe', 'absent']
+        self.assertEqual(chat.getKeywordsDailyFrequencies(keywords),
+                         dict((keyword,
+                               chat.getMemberDailyFrequencies(keyword))
+                              for keyword in keywords))
+
+    def testSingleKeywordString(self):
+        self.writeExport(MIXED_EXPORT)
+        chat = WAChat(self.fileName)
+        for substring in (True, False):
+            self.assertEqual(
+                chat.getKeywordsDailyFrequencies('time', substring),
+                {'time': chat.getMemberDailyFrequencies('time', substring)})
+
+
+class TextExportTest(ChatFileTest):
+
+    def testSameAsGetMessagesSeperatedByUsers(self):
+        self.writeExport(MIXED_EXPORT +
+                         '\n3/1/12, 1:00:00 PM: Al "x": a "b"\n')
+        chat = WAChat(self.fileName)
+        outName = os.path.join(self.workDir, 'texts.csv')
+        self.assertEqual(chat.writeMessagesSeperatedByUsers(outName), 3)
+        with open(outName, 'rb') as infile:
+            rows = list(csv.reader(infile))
+        self.assertEqual(rows[0], ['name', 'text'])
+        self.assertEqual(dict(rows[1:]), chat.getMessagesSeperatedByUsers())
+
+    def testClashingFileNames(self):
+        # 'Al Bo' and 'Al_Bo' sanitize to the same name, and 'Al_Bo-2' is
+        # the name the first clash would take
+        self.writeExport('2/27/12, 10:30:13 PM: Al Bo: one\n'
+                         '2/27/12, 10:31:13 PM: Al_Bo-2: two\n'
+                         '2/27/12, 10:32:13 PM: Al_Bo: three\n')
+        chat = WAChat(self.fileName)
+        outDir = os.path.join(self.workDir, 'texts')
+        self.assertEqual(chat.writeMessagesSeperatedByUsers(outDir, True), 3)
+        texts = dict()
+        for fileName in os.listdir(outDir):
+            with open(os.path.join(outDir, fileName), 'rb') as infile:
+                texts[infile.read()] = fileName
+        self.assertEqual(sorted(texts), [' one', ' three', ' two'])
+        self.assertEqual(len(set(texts.values())), 3)
+
+
+class ParallelParseTest(ChatFileTest):
+
+    def columns(self, builder):
+        store = builder.build()
+        return (store.timestamps.tolist(), store.members,
+                store.userCodes.tolist(), store.textBuffer.tostring(),
+                store.textOffsets.tolist())
+
+    def testSameColumnsAsSerial(self):
+        with open(self.fileName, 'w') as outfile:
+            for i in xrange(3000):
+                outfile.write('%d/%d/12, %d:%02d:%02d %s: M%d: text %d\n'
+                              % (i // 300 + 1, i % 28 + 1, i % 12 + 1,
+                                 i % 60, i % 59, 'AP'[i % 2] + 'M', i % 5,
+                                 i))
+                if i % 7 == 0:
+                    outfile.write('more of text %d\n' % i)
+            outfile.write(MIXED_EXPORT)
+        serial = self.columns(ChatParser().parseFile(self.fileName,
+                                                     MessageStoreBuilder()))
+        for workers, chunkBytes in ((2, 1000), (3, 4096), (4, 1 << 20)):
+            parser = ChatParser()
+            parallel = self.columns(parser.parseFileParallel(
+                self.fileName, MessageStoreBuilder(), workers, chunkBytes))
+            self.assertEqual(parallel, serial, (workers, chunkBytes))
+        self.assertEqual(list(WAChat(self.fileName, workers=2).messageList),
+                         list(WAChat(self.fileName).messageList))
+
+
+class QueryCacheTest(ChatFileTest):
+
+    def testResultsAreCachedAndCopied(self):
+        chat = WAChat(self.fileName)
+        members = chat.getMembers()
+        members['Al'] = 10
+        self.assertEqual(chat.getMembers(), {'Al': 1, 'Bo': 1})
+        self.assertEqual(chat.queryCache.hits, 1)
+        self.assertEqual(chat.queryCache.misses, 1)
+        # Same frame written differently, same entry
+        chat.getMembers(fromHour=-1, untilDay=40)
+        self.assertEqual(chat.queryCache.hits, 2)
+
+    def testAppendAndRefreshDropTheCache(self):
+        chat = WAChat(self.fileName)
+        self.assertEqual(chat.getMembers(), {'Al': 1, 'Bo': 1})
+        chat.append(['2/28/12, 9:00:00 AM: Bo: appended\n'])
+        self.assertEqual(chat.getMembers(), {'Al': 1, 'Bo': 2})
+        self.writeExport(EXPORT + '2/28/12, 9:00:00 AM: Cy: exported\n')
+        self.assertEqual(chat.refresh(), (1, False))
+        self.assertEqual(chat.getMembers(), {'Al': 1, 'Bo': 2, 'Cy': 1})
+        self.assertEqual(chat.queryCache.hits, 0)
+
+    def testEntryLimit(self):
+        chat = WAChat(self.fileName, queryCacheEntries=1)
+        chat.getMembers()
+        chat.getMembers(fromMonth=2)
+        chat.getMembers()
+        self.assertEqual(chat.queryCache.hits, 0)
+        self.assertEqual(chat.queryCache.evictions, 2)
+
+
+class SnapshotTest(ChatFileTest):
+
+    def assertSameChat(self, chat):
+        self.assertEqual(list(chat.messageList),
+                         list(WAChat(self.fileName).messageList))
+
+    def testSnapshotReload(self):
+        WAChat(self.fileName, cacheDir=self.cacheDir)
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.assertTrue(isinstance(chat.store.timestamps, np.memmap))
+        self.assertSameChat(chat)
+
+    def testChangedExportIsParsedAgain(self):
+        WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.writeExport(EXPORT.replace('hello', 'HELLO'))
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.assertEqual(chat.messageList[0].text, 'HELLO')
+        self.assertSameChat(chat)
+
+    def testSnapshotWithoutIngestStateIsParsedAgain(self):
+        chat = WAChat(self.fileName)
+        wasnapshot.saveSnapshot(chat.store, self.fileName, self.cacheDir)
+        self.writeExport('2/28/12, 10:00:00 AM: Al: again\n', 'a')
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.assertFalse(isinstance(chat.store.timestamps, np.memmap))
+        self.assertSameChat(chat)
+        self.assertEqual(chat.refresh(), (0, False))
+
+    def testOlderSnapshotVersionIsParsedAgain(self):
+        WAChat(self.fileName, cacheDir=self.cacheDir)
+        path = wasnapshot.snapshotPath(self.fileName, self.cacheDir)
+        header = wasnapshot.readHeader(path)
+        header['version'] = wasnapshot.SNAPSHOT_VERSION - 1
+        wasnapshot.writeHeader(path, header)
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.assertFalse(isinstance(chat.store.timestamps, np.memmap))
+        self.assertEqual(wasnapshot.readHeader(path)['version'],
+                         wasnapshot.SNAPSHOT_VERSION)
+
+    def testOtherNormalizationIsParsedAgain(self):
+        self.writeExport(MIXED_EXPORT)
+        WAChat(self.fileName, cacheDir=self.cacheDir)
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir,
+                      keepUnicode=True)
+        self.assertEqual(chat.messageList[1].text, 'caf\xc3\xa9 time')
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.assertEqual(chat.messageList[1].text, 'cafe time')
+
+
+class RefreshTest(ChatFileTest):
+
+    def assertSameChat(self, chat):
+        self.assertEqual(list(chat.messageList),
+                         list(WAChat(self.fileName).messageList))
+
+    def testNothingToRefresh(self):
+        WAChat(self.fileName, cacheDir=self.cacheDir)
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.assertEqual(chat.refresh(), (0, False))
+        self.assertSameChat(chat)
+
+    def testRefreshParsesTheAppendedLines(self):
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.writeExport('2/28/12, 10:00:00 AM: Al: again\n'
+                         'still again\n'
+                         '2/28/12, 10:01:00 AM: Cy: new\n', 'a')
+        self.assertEqual(chat.refresh(), (2, False))
+        self.assertSameChat(chat)
+        self.assertEqual(chat.getMembers(), {'Al': 2, 'Bo': 1, 'Cy': 1})
+        # The refreshed snapshot is what the next load starts from
+        reloaded = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.assertTrue(isinstance(reloaded.store.timestamps, np.memmap))
+        self.assertSameChat(reloaded)
+
+    def testSnapshotBroughtUpToDateOnLoad(self):
+        WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.writeExport('2/28/12, 10:00:00 AM: Al: again\n', 'a')
+        self.assertSameChat(WAChat(self.fileName, cacheDir=self.cacheDir))
+
+    def testRebuildWhenThePrefixChanges(self):
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.writeExport(EXPORT.replace('hello', 'HELLO') +
+                         '2/28/12, 10:00:00 AM: Al: again\n')
+        self.assertEqual(chat.refresh(), (3, True))
+        self.assertSameChat(chat)
+        self.assertEqual(chat.messageList[0].text, 'HELLO')
+        self.assertSameChat(WAChat(self.fileName, cacheDir=self.cacheDir))
+
+    def testRebuildWhenTheExportShrinks(self):
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.writeExport(EXPORT.splitlines(True)[0])
+        self.assertEqual(chat.refresh(), (1, True))
+        self.assertSameChat(chat)
+
+    def testRebuildWhenAppendedMessagesAreOlder(self):
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.writeExport('2/1/12, 10:00:00 AM: Al: older\n', 'a')
+        self.assertEqual(chat.refresh(), (3, True))
+        self.assertSameChat(chat)
+
+    def testAppendedMessagesAreNotSnapshotted(self):
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        chat.append(['2/28/12, 9:00:00 AM: Ghost: x\n'])
+        self.writeExport('2/28/12, 10:00:00 AM: Al: again\n', 'a')
+        self.assertEqual(chat.refresh(), (1, False))
+        self.assertEqual(chat.getMembers(), {'Al': 2, 'Bo': 1, 'Ghost': 1})
+        self.assertEqual(
+            WAChat(self.fileName, cacheDir=self.cacheDir).getMembers(),
+            WAChat(self.fileName).getMembers())
+
+    def testPartialLastLineIsReadAgain(self):
+        # The export was read while its last line was being written
+        self.writeExport(EXPORT + '2/28/12, 12:30:00 AM: Bo: hi the')
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.assertEqual(chat.messageList[-1].text, 'hi the')
+        self.assertEqual(chat.refresh(), (0, False))
+        self.assertSameChat(chat)
+        self.writeExport('re all\n2/28/12, 1:00:00 AM: Cy: x\n', 'a')
+        self.assertEqual(chat.refresh(), (1, False))
+        self.assertSameChat(chat)
+        self.assertEqual(chat.messageList[-2].text, 'hi there all')
+        self.assertEqual(chat.getMembers(), {'Al': 1, 'Bo': 2, 'Cy': 1})
+        self.assertEqual(chat.getMemberHourlyFrequencies()['Bo'][0], 1)
+        self.assertSameChat(WAChat(self.fileName, cacheDir=self.cacheDir))
+
+    def testPartialLine(self):
+        longLine = '2/28/12, 12:30:00 AM: Bo: ' + 'x' * 10000
+        self.writeExport(EXPORT + longLine)
+        self.assertEqual(partialLine(self.fileName, len(EXPORT)), '')
+        self.assertEqual(partialLine(self.fileName, len(EXPORT) + 3), '2/2')
+        self.assertEqual(partialLine(self.fileName,
+                                     len(EXPORT) + len(longLine)), longLine)
+        self.writeExport(longLine)
+        self.assertEqual(partialLine(self.fileName, len(longLine)), longLine)
+
+    def testPartialLastLineOfASnapshot(self):
+        self.writeExport(EXPORT + '2/28/12, 12:30:00 AM: Bo: hi the')
+        WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.writeExport('re all\n', 'a')
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        self.assertEqual(chat.messageList[-1].text, 'hi there all')
+        self.assertSameChat(chat)
+
+    def testExportOlderThanAppendedMessagesIsReloaded(self):
+        chat = WAChat(self.fileName, cacheDir=self.cacheDir)
+        chat.append(['2/29/12, 9:00:00 AM: Ghost: x\n'])
+        self.writeExport('2/28/12, 10:00:00 AM: Al: again\n', 'a')
+        self.assertEqual(chat.refresh(), (3, True))
+        self.assertSameChat(chat)
+
+
+if __name__ == '__main__':
+    unittest.main()
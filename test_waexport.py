@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import wabatch
+import waexport
+from wachat import WAChat
+
+EXPORT = ('2/27/12, 10:30:13 PM: Alice: hello cat\n'
+          '2/27/12, 11:35:08 PM: Bob: dog\n'
+          '2/28/12, 12:09:27 AM: Alice: cat and dog\n')
+
+
+class ResultTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix='waexport')
+        self.fileName = os.path.join(self.workDir, 'chat.txt')
+        with open(self.fileName, 'w') as outfile:
+            outfile.write(EXPORT)
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def testNoneResultIsAnEmptyTable(self):
+        for fileFormat in ('csv', 'npz'):
+            fileName = os.path.join(self.workDir, 'none.' + fileFormat)
+            columns = waexport.QUERY_COLUMNS[
+                'getMembers_givenYearAndMonth_dailyInfo']
+            self.assertEqual(waexport.writeResult(None, fileName, columns), 0)
+            table = waexport.loadTable(fileName)
+            self.assertEqual(list(table), list(columns))
+            self.assertEqual([len(column) for column in table.values()],
+                             [0] * len(columns))
+
+    def testBatchWritesTablesOfNoneAnswers(self):
+        # A year outside the chat gets None from the breakdowns; the other
+        # queries of the chat must still be written
+        tablesDir = os.path.join(self.workDir, 'tables')
+        querySpecs = ['getMembers_givenYearAndMonth_dailyInfo:2019,3',
+                      'getMembers']
+        result = wabatch.runChat((self.fileName, querySpecs, {}, None, 1,
+                                  tablesDir, 'csv', False, None, None))
+        self.assertEqual(result['status'], 'ok', result.get('error'))
+        names = wabatch.tableFileNames(querySpecs, 'csv')
+        empty = waexport.loadTable(os.path.join(tablesDir,
+                                                names[querySpecs[0]]))
+        self.assertEqual(len(empty['member']), 0)
+        members = waexport.loadTable(os.path.join(tablesDir,
+                                                  names['getMembers']))
+        self.assertEqual(dict(zip(members['member'], members['count'])),
+                         {'Alice': 2, 'Bob': 1})
+
+    def testActivityTableInChunks(self):
+        chat = WAChat(self.fileName)
+        chunks = list(waexport.activityChunks(chat.store.activityCube(),
+                                              chat.store.members, 1))
+        self.assertEqual(len(chunks), 2)
+        rows = sorted(zip(*[np.concatenate([chunk[name] for chunk in chunks])
+                            .tolist() for name in chunks[0]]))
+        self.assertEqual(rows, [('Alice', 2012, 2, 27, 22, 1),
+                                ('Alice', 2012, 2, 28, 0, 1),
+                                ('Bob', 2012, 2, 27, 23, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
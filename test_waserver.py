@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib2
+import waserver
+
+EXPORT = ('2/27/12, 10:30:13 PM: Alice: hello cat\n'
+          '2/27/12, 11:35:08 PM: Bob: dog\n'
+          '2/28/12, 12:09:27 AM: Alice: cat and dog\n')
+
+
+class QuietHandler(waserver.QueryHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp(prefix='waserver')
+        fileName = os.path.join(self.workDir, 'chat.txt')
+        with open(fileName, 'w') as outfile:
+            outfile.write(EXPORT)
+        self.registry = waserver.ChatRegistry()
+        self.registry.add(fileName)
+        self.server = waserver.makeServer(self.registry, port=0)
+        self.server.RequestHandlerClass = QuietHandler
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        shutil.rmtree(self.workDir)
+
+    def get(self, path):
+        # (status, JSON body) of a GET request
+        url = 'http://127.0.0.1:%d%s' % (self.server.server_port, path)
+        try:
+            response = urllib2.urlopen(url)
+        except urllib2.HTTPError as error:
+            response = error
+        return response.getcode(), json.loads(response.read())
+
+    def testQuery(self):
+        status, body = self.get('/chats/chat/getMembers?fromHour=0')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['result'], {'Alice': 2, 'Bob': 1})
+        self.assertEqual(body['arguments'], {'fromHour': 0})
+        # Only numeric parameters are converted
+        status, body = self.get('/chats/chat/getMemberDailyFrequencies'
+                                '?keyword=2016')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['result'], {'Alice': [0], 'Bob': [0]})
+
+    def testBadNumericParameters(self):
+        for query in ('getMembers?fromHour=x', 'getMembers?fromYear=1|2',
+                      'getMembers?year=2012'):
+            status, body = self.get('/chats/chat/' + query)
+            self.assertEqual(status, 400, query)
+            self.assertTrue(body['error'].startswith(('TypeError',
+                                                      'ValueError')))
+
+    def testChangeIsReloadedOnceTheExportStaysTheSame(self):
+        chat = self.registry.chats['chat']
+        self.assertEqual(chat.refreshIfChanged(), None)
+        with open(chat.fileName, 'a') as outfile:
+            outfile.write('2/28/12, 1:00:00 AM: Bob: hi the')
+        # Still being written as far as the server can tell
+        self.assertEqual(chat.refreshIfChanged(), None)
+        with open(chat.fileName, 'a') as outfile:
+            outfile.write('re\n')
+        self.assertEqual(chat.refreshIfChanged(), None)
+        self.assertEqual(len(chat.chat.store), 3)
+        self.assertEqual(chat.refreshIfChanged(), (1, False))
+        self.assertEqual(chat.chat.messageList[-1].text, 'hi there')
+        self.assertEqual(chat.reloads, 1)
+        self.assertEqual(chat.refreshIfChanged(), None)
+
+    def testUnknownResources(self):
+        self.assertEqual(self.get('/chats/other')[0], 404)
+        self.assertEqual(self.get('/chats/chat/getNothing')[0], 404)
+        status, body = self.get('/chats')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['chat']['messages'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
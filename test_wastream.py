@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+from wastream import StreamingChat
+from waparse import ChatParser
+from wachat import WAChat
+
+# Bo's second line is dated two days before the first message
+EXPORT = ['2/27/12, 10:30:13 PM: Al: cat\n',
+          '2/25/12, 9:00:00 AM: Bo: clock jump\n',
+          '2/28/12, 11:35:08 PM: Bo: cat\n']
+
+
+class StreamingChatTest(unittest.TestCase):
+
+    def consume(self, batchSize):
+        chat = StreamingChat(['cat'])
+        parser = ChatParser()
+        records = [parser.parseLine(line) for line in EXPORT]
+        for low in range(0, len(records), batchSize):
+            chat.consume(records[low:low + batchSize])
+        return chat
+
+    def testEarlierMessagesExtendTheDays(self):
+        for batchSize in (1, 3):
+            chat = self.consume(batchSize)
+            self.assertEqual(chat.getMembers(), {'Al': 1, 'Bo': 2})
+            self.assertEqual(chat.getMemberHourlyFrequencies()['Bo'][9], 1)
+            # Days are 24 hour steps from 10:30:13 PM on 2/27, so 2/25
+            # 9 AM falls 3 steps before it
+            self.assertEqual(chat.getMemberDailyFrequencies(),
+                             {'Al': [0, 0, 0, 1, 0], 'Bo': [1, 0, 0, 0, 1]})
+            self.assertEqual(chat.getMemberDailyFrequencies('cat'),
+                             {'Al': [0, 0, 0, 1, 0], 'Bo': [0, 0, 0, 0, 1]})
+
+    def testSameDaysAsWAChat(self):
+        workDir = tempfile.mkdtemp(prefix='wastream')
+        try:
+            fileName = os.path.join(workDir, 'chat.txt')
+            with open(fileName, 'w') as outfile:
+                outfile.writelines(EXPORT)
+            chat = WAChat(fileName)
+            streamed = self.consume(3)
+            self.assertEqual(chat.getMemberDailyFrequencies(),
+                             streamed.getMemberDailyFrequencies())
+            self.assertEqual(chat.getMemberDailyFrequencies('cat'),
+                             streamed.getMemberDailyFrequencies('cat'))
+        finally:
+            shutil.rmtree(workDir)
+
+    def testSingleKeywordString(self):
+        chat = self.consume(3)
+        self.assertEqual(chat.getKeywordsDailyFrequencies('cat'),
+                         {'cat': chat.getMemberDailyFrequencies('cat')})
+        self.assertRaises(KeyError, chat.getMemberDailyFrequencies, 'dog')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+from collections import Counter
+from datetime import datetime
+import random
+import unittest
+import numpy as np
+from wastore import MessageStoreBuilder
+from wavocab import TopKSummary, VocabularyIndex, _countChunk, tokenize
+
+WORDS = ['cat', 'dog', 'see', 'you', 'the', 'a', 'tea', 'why', 'ok', 'no',
+         'yes', 'later', 'home', 'sun', 'rain', 'bus']
+
+
+class TopKSummaryTest(unittest.TestCase):
+
+    def setUp(self):
+        # A skewed stream: word i is about twice as frequent as word i + 1
+        rng = random.Random(20)
+        self.parts = [[WORDS[min(int(rng.expovariate(0.7)), len(WORDS) - 1)]
+                       for i in range(500)] for part in range(4)]
+
+    def assertWithinError(self, summary, exact):
+        self.assertTrue(len(summary.counts) <= summary.k)
+        for term, count in exact.iteritems():
+            estimate = summary.counts.get(term, 0)
+            self.assertTrue(count - summary.error <= estimate <= count,
+                            (term, count, estimate, summary.error))
+        # The error is at most what the summary had to forget
+        self.assertTrue(summary.error <=
+                        sum(exact.values()) // (summary.k + 1))
+
+    def testMergeKeepsTheErrorBound(self):
+        exact = Counter()
+        merged = TopKSummary(5)
+        for part in self.parts:
+            counts = Counter(part)
+            exact.update(counts)
+            summary = TopKSummary(5).update(counts)
+            self.assertWithinError(summary, counts)
+            merged.merge(summary)
+        self.assertWithinError(merged, exact)
+        self.assertTrue(merged.error > 0)
+        # The frequent head survives in order
+        self.assertEqual([term for term, count in merged.mostCommon(2)],
+                         [term for term, count in exact.most_common(2)])
+
+    def testExactWhileSmall(self):
+        counts = Counter(self.parts[0][:3])
+        summary = TopKSummary(len(WORDS)).update(counts)
+        self.assertEqual(summary.error, 0)
+        self.assertEqual(summary.counts, dict(counts))
+
+    def testChunkIsSummarizedAsItIsCounted(self):
+        # One bucket whose vocabulary is far larger than topK
+        texts = [' '.join(part[i:i + 5]) + ' w%d' % i
+                 for part in self.parts for i in range(0, len(part), 5)]
+        offsets = np.cumsum([0] + [len(text) for text in texts]).tolist()
+        buckets = np.zeros(len(texts), dtype=np.int64)
+        task = (''.join(texts), offsets, buckets, None)
+        exact = _countChunk(task)[0][0]
+        words, bigrams = _countChunk(task[:3] + (5,))[0]
+        self.assertWithinError(words, exact)
+        self.assertTrue(words.error > 0)
+        self.assertTrue(len(bigrams.counts) <= 5)
+
+
+class VocabularyIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(21)
+        builder = MessageStoreBuilder()
+        self.messages = []
+        for i in range(300):
+            date = datetime(2015 + i % 2, i % 12 + 1, 1 + i % 28, 12)
+            user = rng.choice(('Al', 'Bo', 'Cy'))
+            text = ' '.join(rng.choice(WORDS[:8])
+                            for word in range(rng.randint(0, 6)))
+            builder.appendMessage(date, user, text)
+            self.messages.append((date, user, text))
+        self.store = builder.build()
+
+    def count(self, memberName=None, bigrams=False, fromMonth=1,
+              untilMonth=12, fromYear=2009, untilYear=2020):
+        # Counter of the terms in the frame, one message at a time
+        total = Counter()
+        for date, user, text in self.messages:
+            if ((memberName is None or user == memberName) and
+                    fromMonth <= date.month <= untilMonth and
+                    fromYear <= date.year <= untilYear):
+                words = tokenize(text)
+                if bigrams:
+                    words = [' '.join(pair)
+                             for pair in zip(words, words[1:])]
+                total.update(words)
+        return total
+
+    def assertSameCounts(self, top, exact):
+        self.assertEqual(dict(top), dict(exact))
+
+    def testExactCounts(self):
+        index = VocabularyIndex(self.store, chunkMessages=70)
+        self.assertSameCounts(index.topWords(100), self.count())
+        self.assertSameCounts(index.topBigrams(100, 'Bo'),
+                              self.count('Bo', True))
+        self.assertSameCounts(index.topWords(100, 'Cy', 3, 7, 2016, 2016),
+                              self.count('Cy', False, 3, 7, 2016, 2016))
+        self.assertEqual(index.topWords(5, 'Nobody'), [])
+
+    def testTopKCountsWithinTheError(self):
+        index = VocabularyIndex(self.store, topK=4, chunkMessages=70)
+        exact = self.count()
+        top = index.topWords(10)
+        self.assertTrue(len(top) <= 4)
+        for word, count in top:
+            self.assertTrue(count <= exact[word])
+        # Room for every word: the summaries are exact
+        index = VocabularyIndex(self.store, topK=64, chunkMessages=70)
+        self.assertSameCounts(index.topWords(100), exact)
+
+
+if __name__ == '__main__':
+    unittest.main()
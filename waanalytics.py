@@ -0,0 +1,139 @@
+import numpy as np
+from wastore import dateToTimestamp
+
+# Silence after which the next message starts a new session
+DEFAULT_GAP = 3600
+_NO_LIMIT = np.iinfo(np.int64)
+
+
+def _groupMedians(groups, values, numberOfGroups):
+    # Median of values per group id (NaN for empty groups), from one
+    # lexsort instead of a loop over groups
+    order = np.lexsort((values, groups))
+    groups = groups[order]
+    values = values[order].astype(np.float64)
+    counts = np.bincount(groups, minlength=numberOfGroups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    medians = np.full(numberOfGroups, np.nan)
+    present = counts > 0
+    low = starts[present] + (counts[present] - 1) // 2
+    high = starts[present] + counts[present] // 2
+    medians[present] = (values[low] + values[high]) / 2
+    return medians
+
+
+class ConversationAnalytics(object):
+    # Interaction metrics of the messages with start <= date < end (both
+    # optional datetimes), computed on the chronological timestamp and
+    # member code arrays of a MessageStore with diffs, masks and
+    # bincounts. The window is found by bisection on the time index, so
+    # a windowed report only touches the messages inside it.
+    #   session: run of messages with no silence longer than gap seconds
+    #   reply:   message following, within the same session, a message
+    #            of another member; its latency is the time in between
+
+    def __init__(self, store, start=None, end=None):
+        self.store = store
+        self.start = start
+        self.end = end
+        indices = store.indicesBetween(
+            _NO_LIMIT.min if start is None else dateToTimestamp(start),
+            _NO_LIMIT.max if end is None else dateToTimestamp(end))
+        self.timestamps = store.timestamps[indices]
+        self.userCodes = store.userCodes[indices].astype(np.int64)
+        self.numberOfMembers = len(store.members)
+        # Seconds since the previous message in the window
+        self.gaps = np.diff(self.timestamps)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _memberDict(self, values, keep):
+        members = self.store.members
+        return dict((members[code], value) for code, value
+                    in enumerate(values.tolist()) if keep[code])
+
+    def sessionIds(self, gap=DEFAULT_GAP):
+        # Session number of every message in the window
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([[0], np.cumsum(self.gaps > gap)])
+
+    def _sessionPairs(self, ids):
+        # Distinct session * numberOfMembers + member code values, one per
+        # member taking part in a session
+        return np.unique(ids * self.numberOfMembers + self.userCodes)
+
+    def _sessions(self, gap, pairs):
+        if not len(self):
+            firsts = lasts = np.zeros(0, dtype=np.int64)
+        else:
+            boundaries = np.flatnonzero(self.gaps > gap) + 1
+            firsts = np.concatenate([[0], boundaries])
+            lasts = np.concatenate([boundaries - 1, [len(self) - 1]])
+        return {'start': self.timestamps[firsts],
+                'end': self.timestamps[lasts],
+                'messages': lasts - firsts + 1,
+                'members': np.bincount(pairs // max(self.numberOfMembers, 1),
+                                       minlength=len(firsts)),
+                'starter': self.userCodes[firsts]}
+
+    def sessions(self, gap=DEFAULT_GAP):
+        # Per session arrays: start and end timestamps, number of
+        # messages and of distinct members, and the code of the member
+        # who started it
+        return self._sessions(gap, self._sessionPairs(self.sessionIds(gap)))
+
+    def sessionSummary(self, gap=DEFAULT_GAP):
+        # Number of sessions, their median duration (seconds) and size,
+        # and per member how many sessions they started and took part in
+        pairs = self._sessionPairs(self.sessionIds(gap))
+        sessions = self._sessions(gap, pairs)
+        numberOfSessions = len(sessions['start'])
+        participated = np.bincount(pairs % max(self.numberOfMembers, 1),
+                                   minlength=self.numberOfMembers)
+        started = np.bincount(sessions['starter'],
+                              minlength=self.numberOfMembers)
+        return {'sessions': numberOfSessions,
+                'gapSeconds': gap,
+                'medianSeconds': (float(np.median(sessions['end'] -
+                                                  sessions['start']))
+                                  if numberOfSessions else None),
+                'medianMessages': (float(np.median(sessions['messages']))
+                                   if numberOfSessions else None),
+                'started': self._memberDict(started, participated > 0),
+                'participated': self._memberDict(participated,
+                                                 participated > 0)}
+
+    def _replies(self, gap):
+        # Mask over messages 1..n-1 of the window marking replies
+        return ((self.userCodes[1:] != self.userCodes[:-1]) &
+                (self.gaps <= gap))
+
+    def replyLatencies(self, gap=DEFAULT_GAP):
+        # {member: median seconds between the message they replied to and
+        # their reply}, for members with at least one reply
+        replies = self._replies(gap)
+        repliers = self.userCodes[1:][replies]
+        medians = _groupMedians(repliers, self.gaps[replies],
+                                self.numberOfMembers)
+        return self._memberDict(medians, ~np.isnan(medians))
+
+    def repliedAfterMatrix(self, gap=DEFAULT_GAP):
+        # members x members counts; [a, b] is how often b replied right
+        # after a message of a
+        replies = self._replies(gap)
+        size = self.numberOfMembers
+        return np.bincount(self.userCodes[:-1][replies] * size +
+                           self.userCodes[1:][replies],
+                           minlength=size * size).reshape(size, size)
+
+    def repliedAfter(self, gap=DEFAULT_GAP):
+        # {member: {member they replied after: count}}, nonzero counts only
+        matrix = self.repliedAfterMatrix(gap)
+        members = self.store.members
+        result = dict()
+        for previous, replier in zip(*np.nonzero(matrix)):
+            result.setdefault(members[replier], dict())[
+                members[previous]] = int(matrix[previous, replier])
+        return result
@@ -0,0 +1,298 @@
+from multiprocessing import Pool
+from StringIO import StringIO
+import glob
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from wafiles import uniqueFileName
+
+# WAChat methods a batch may run; all of them return JSON-able results
+QUERIES = ('getMembers', 'getMemberDailyFrequencies',
+           'getKeywordsDailyFrequencies', 'getMemberHourlyFrequencies',
+           'getMemberMonthlyFrequencies',
+           'getMemberAllYearsOverMonthFrequencies',
+           'getMembers_givenYear_monthlyInfo',
+           'getMembers_givenYearAndMonth_dailyInfo',
+           'getMembers_givenYearAndMonthAndDay_hourlyInfo',
+           'getMessagesSeperatedByUsers', 'statisticalGroupInfo',
+           'getTopWords')
+# Their parameters in order, naming the positional arguments of a spec
+QUERY_PARAMETERS = {
+    'getMembers': ('fromHour', 'untilHour', 'fromDay', 'untilDay',
+                   'fromMonth', 'untilMonth', 'fromYear', 'untilYear'),
+    'getMemberDailyFrequencies': ('keyword', 'substring'),
+    'getKeywordsDailyFrequencies': ('keywords', 'substring'),
+    'getMemberHourlyFrequencies': (),
+    'getMemberMonthlyFrequencies': (),
+    'getMemberAllYearsOverMonthFrequencies': ('memberName',),
+    'getMembers_givenYear_monthlyInfo': ('year', 'memberName'),
+    'getMembers_givenYearAndMonth_dailyInfo': ('year', 'month',
+                                               'memberName'),
+    'getMembers_givenYearAndMonthAndDay_hourlyInfo': ('year', 'month', 'day',
+                                                      'memberName'),
+    'getMessagesSeperatedByUsers': ('fromHour', 'untilHour', 'fromDay',
+                                    'untilDay', 'fromMonth', 'untilMonth',
+                                    'fromYear', 'untilYear'),
+    'statisticalGroupInfo': ('statInfo',),
+    'getTopWords': ('n', 'memberName', 'bigrams', 'fromMonth', 'untilMonth',
+                    'fromYear', 'untilYear')}
+# Query parameters taking numbers (or 0/1 flags); all others are passed
+# as text, so that e.g. a keyword 2016 looks for "2016"
+NUMERIC_PARAMETER = re.compile(r'(year|month|day|hour|n|substring|'
+                               r'bigrams|(from|until)[A-Z]\w*)$')
+# The ones StreamingChat answers too
+STREAM_QUERIES = ('getMembers', 'getMemberDailyFrequencies',
+                  'getKeywordsDailyFrequencies', 'getMemberHourlyFrequencies',
+                  'getMemberMonthlyFrequencies')
+DEFAULT_QUERIES = ('getMembers', 'getMemberMonthlyFrequencies',
+                   'getMemberHourlyFrequencies')
+SUMMARY_NAME = 'summary.json'
+# Where runChat's texts option writes every member's texts in a chat's
+# directory: one (name, text) CSV, or a directory of <member>.txt files
+TEXTS_NAMES = {'csv': 'texts.csv', 'files': 'texts'}
+
+
+def queryValue(value, numeric=True):
+    # '2016' -> 2016, 'cat' -> 'cat', 'a|b' -> ['a', 'b']; numeric=False
+    # keeps numbers as text too
+    if '|' in value:
+        return [queryValue(item, numeric) for item in value.split('|')]
+    if not numeric:
+        return value
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def parseQuery(spec):
+    # 'name' or 'name:arg,arg,key=value' -> (name, args, kwargs), e.g.
+    # 'getMembers_givenYearAndMonth_dailyInfo:2016,3' or
+    # 'getKeywordsDailyFrequencies:cat|dog,substring=0'. Only the
+    # arguments of parameters NUMERIC_PARAMETER matches become numbers.
+    name, _, arguments = spec.partition(':')
+    if name not in QUERIES:
+        raise ValueError("unknown query %r, expected one of %s"
+                         % (name, ', '.join(QUERIES)))
+    parameters = QUERY_PARAMETERS[name]
+    args = []
+    kwargs = dict()
+    for argument in arguments.split(',') if arguments else ():
+        key, equals, value = argument.partition('=')
+        if equals:
+            kwargs[key] = queryValue(value, isNumericParameter(key))
+        else:
+            key = (parameters[len(args)] if len(args) < len(parameters)
+                   else None)
+            args.append(queryValue(argument, isNumericParameter(key)))
+    return name, args, kwargs
+
+
+def isNumericParameter(name):
+    return name is not None and NUMERIC_PARAMETER.match(name) is not None
+
+
+def streamKeywords(querySpecs):
+    # (keywords, substring) a StreamingChat has to count to answer the
+    # keyword queries among querySpecs
+    keywords = []
+    modes = set()
+    for spec in querySpecs:
+        name, args, kwargs = parseQuery(spec)
+        if name not in ('getMemberDailyFrequencies',
+                        'getKeywordsDailyFrequencies'):
+            continue
+        words = args[0] if args else kwargs.get('keyword',
+                                                kwargs.get('keywords'))
+        if not words:
+            continue
+        keywords.extend(words if isinstance(words, list) else [words])
+        modes.add(bool(args[1] if len(args) > 1
+                       else kwargs.get('substring', 1)))
+    if len(modes) > 1:
+        raise ValueError("streamed keyword queries must all use the same "
+                         "substring mode")
+    substring = modes.pop() if modes else True
+    return [str(keyword) for keyword in keywords], substring
+
+
+def exportFiles(paths, pattern='*.txt'):
+    # The export files named by paths, directories expanded to the files
+    # in them matching pattern, in a stable order without duplicates
+    fileNames = []
+    for path in paths:
+        if os.path.isdir(path):
+            fileNames.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            fileNames.append(path)
+    seen = set()
+    return [fileName for fileName in fileNames
+            if not (fileName in seen or seen.add(fileName))]
+
+
+def runChat(task):
+    # Pool worker: loads one export, runs the queries on it and renders
+    # its charts to chartsDir if one is given. With tablesDir the query
+    # results are written there as tableFormat tables (see waexport),
+    # named in the returned dict instead of included, and exportStore
+    # adds the messages and activity tables. texts ('csv' or 'files')
+    # streams every member's texts to outDir with
+    # writeMessagesSeperatedByUsers. Never raises; a failure is reported
+    # in the returned dict instead so the rest of the batch goes on.
+    (fileName, querySpecs, chatOptions, chartsDir, renderWorkers, tablesDir,
+     tableFormat, exportStore, outDir, texts) = task
+    chatOptions = dict(chatOptions)
+    stream = chatOptions.pop('stream', False)
+    started = time.time()
+    result = {'file': fileName, 'status': 'ok', 'queries': dict()}
+    # The breakdown methods print their notes; keep them with the result
+    stdout = sys.stdout
+    sys.stdout = notes = StringIO()
+    try:
+        if stream:
+            from wastream import StreamingChat
+            keywords, substring = streamKeywords(querySpecs)
+            chat = StreamingChat.fromFile(
+                fileName, keywords, substring,
+                chatOptions.get('keepUnicode', False))
+            messages, members = len(chat), chat.members
+        else:
+            from wachat import WAChat
+            chat = WAChat(fileName, **chatOptions)
+            messages, members = len(chat.store), chat.store.members
+        result['loadSeconds'] = time.time() - started
+        result['messages'] = messages
+        result['members'] = len(members)
+        result['linesRead'] = chat.parser.linesRead
+        result['bytesRead'] = chat.parser.bytesRead
+        if tablesDir is not None:
+            import waexport
+            tableNames = tableFileNames(querySpecs, tableFormat)
+            if not os.path.isdir(tablesDir):
+                os.makedirs(tablesDir)
+        for spec in querySpecs:
+            name, args, kwargs = parseQuery(spec)
+            answer = getattr(chat, name)(*args, **kwargs)
+            if tablesDir is not None:
+                waexport.writeResult(answer,
+                                     os.path.join(tablesDir, tableNames[spec]),
+                                     waexport.QUERY_COLUMNS[name])
+                answer = tableNames[spec]
+            result['queries'][spec] = answer
+        if exportStore:
+            result['tables'] = {
+                'messages': waexport.writeMessages(
+                    chat.store, os.path.join(tablesDir,
+                                             'messages.' + tableFormat)),
+                'activity': waexport.writeActivity(
+                    chat.store.activityCube(), chat.store.members,
+                    os.path.join(tablesDir, 'activity.' + tableFormat))}
+        if chartsDir is not None:
+            import waplot
+            result['charts'] = [
+                os.path.basename(chart) for chart in
+                waplot.renderAll(chat, chartsDir, renderWorkers)]
+        if texts is not None:
+            textsName = TEXTS_NAMES[texts]
+            if not os.path.isdir(outDir):
+                os.makedirs(outDir)
+            chat.writeMessagesSeperatedByUsers(
+                os.path.join(outDir, textsName), texts == 'files')
+            result['texts'] = textsName
+        if getattr(chat, 'profiler', None) is not None:
+            result['profile'] = chat.profileStats()
+    except Exception:
+        result['status'] = 'error'
+        result['error'] = traceback.format_exc()
+    finally:
+        sys.stdout = stdout
+    result['notes'] = notes.getvalue()
+    result['seconds'] = time.time() - started
+    return result
+
+
+def runBatch(fileNames, querySpecs, jobs=1, chatOptions=None,
+             progress=None, chartsDirs=None, renderWorkers=1,
+             tablesDirs=None, tableFormat='csv', exportStore=False,
+             outDirs=None, texts=None):
+    # Yields the runChat result of every file as it completes, using a
+    # pool of jobs processes (each handling a single chat, so the memory
+    # of a large one goes back to the system) or this process for
+    # jobs=1. progress(done, total, result) is called after each file.
+    # chartsDirs and tablesDirs map files to the directory their charts
+    # and tables go to, outDirs to the one for the other files of a chat.
+    chartsDirs = chartsDirs or {}
+    tablesDirs = tablesDirs or {}
+    outDirs = outDirs or {}
+    tasks = [(fileName, list(querySpecs), chatOptions or {},
+              chartsDirs.get(fileName), renderWorkers,
+              tablesDirs.get(fileName), tableFormat, exportStore,
+              outDirs.get(fileName), texts)
+             for fileName in fileNames]
+    if jobs > 1:
+        pool = Pool(jobs, maxtasksperchild=1)
+        results = pool.imap_unordered(runChat, tasks)
+    else:
+        pool = None
+        results = (runChat(task) for task in tasks)
+    try:
+        for done, result in enumerate(results, 1):
+            if progress is not None:
+                progress(done, len(tasks), result)
+            yield result
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+
+def summarize(results, seconds):
+    # Combined summary of a batch: totals, throughput and the status of
+    # every chat
+    succeeded = [result for result in results if result['status'] == 'ok']
+    totalMessages = sum(result['messages'] for result in succeeded)
+    totalLines = sum(result['linesRead'] for result in succeeded)
+    return {'files': len(results),
+            'succeeded': len(succeeded),
+            'failed': len(results) - len(succeeded),
+            'messages': totalMessages,
+            'linesRead': totalLines,
+            'bytesRead': sum(result['bytesRead'] for result in succeeded),
+            'seconds': seconds,
+            'linesPerSecond': totalLines / seconds if seconds else 0.0,
+            'chats': [dict((key, result.get(key))
+                           for key in ('file', 'output', 'status', 'messages',
+                                       'members', 'seconds', 'error'))
+                      for result in sorted(results,
+                                           key=lambda result: result['file'])]}
+
+
+def outputNames(fileNames):
+    # {export: result file name}, named after the export and made unique
+    # within the batch in file order
+    names = dict()
+    usedNames = set([os.path.splitext(SUMMARY_NAME)[0]])
+    for fileName in fileNames:
+        name = os.path.splitext(os.path.basename(fileName))[0] or 'chat'
+        names[fileName] = uniqueFileName(name, usedNames) + '.json'
+    return names
+
+
+def tableFileNames(querySpecs, tableFormat):
+    # {query spec: table file name}, the spec made a file name and unique
+    # among the specs, the messages and activity tables and the texts
+    names = dict()
+    usedNames = set(['messages', 'activity', 'texts'])
+    for spec in querySpecs:
+        if spec not in names:
+            names[spec] = '%s.%s' % (uniqueFileName(spec, usedNames),
+                                     tableFormat)
+    return names
+
+
+def writeResult(result, fileName):
+    with open(fileName, 'w') as outfile:
+        json.dump(result, outfile)
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+# Reproducible benchmarks for WAChat on synthetic WhatsApp exports.
+#
+#   python wabench.py --sizes 10000 100000 1000000 --out bench.json
+#   python wabench.py --sizes 10000 --out new.json --compare bench.json
+#
+# Every export is generated in a process of its own and every size is
+# measured in another fresh one, so the reported peak memory (ru_maxrss)
+# belongs to WAChat alone.
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+from waparse import WADateFormat
+
+DEFAULT_SIZES = [10000, 100000, 1000000, 10000000]
+# Messages generateExport draws at a time
+GENERATE_BATCH = 100000
+WORDS = ['hello', 'the', 'cat', 'dog', 'ok', 'yes', 'no', 'lol', 'see',
+         'you', 'tomorrow', 'what', 'time', 'dinner', 'party', 'game',
+         'haha', 'thanks', 'where', 'are', 'we', 'meeting', 'today']
+NON_ASCII_WORDS = [u'café', u'José', u'naïve', u'über', u'señor', u'😂',
+                   u'ñandú', u'crème', u'déjà', u'vu']
+NAMES = ['Alice', 'Bob', 'Carl', 'Dana', 'Emma', 'Frank', 'Gina', 'Hugo',
+         'Iris', 'Jack', 'Kim', 'Liam', 'Maya', 'Nils', 'Olga', 'Paul']
+# The keyword timed with getMemberDailyFrequencies
+KEYWORD = 'cat'
+
+
+def generateExport(fileName, numberOfLines, members=16, years=4,
+                   messagesPerDay=None, multiLineRate=0.03,
+                   nonAsciiRate=0.05, firstDate=datetime(2012, 1, 1),
+                   seed=0):
+    # Writes a synthetic export of numberOfLines lines in the WADateFormat
+    # layout. Messages are spread over `years` years, or over as many
+    # days as messagesPerDay implies. multiLineRate of the messages get
+    # continuation lines, nonAsciiRate of the words are non-ASCII and a
+    # few group events ("X added Y") are mixed in.
+    random.seed(seed)
+    np.random.seed(seed)
+    memberNames = [NAMES[i % len(NAMES)] +
+                   ('' if i < len(NAMES) else ' %d' % (i // len(NAMES)))
+                   for i in range(members)]
+    memberNames[-1] = u'Zoë Müller'.encode('utf-8')
+    nonAscii = [word.encode('utf-8') for word in NON_ASCII_WORDS]
+    if messagesPerDay:
+        spanSeconds = int(numberOfLines * 86400.0 / messagesPerDay)
+    else:
+        spanSeconds = int(years * 365.25 * 86400)
+    offsets = np.sort(np.random.randint(0, max(spanSeconds, 1),
+                                        size=numberOfLines))
+    # A few talkative members, like in real groups
+    weights = 1.0 / np.arange(1, members + 1)
+    speakers = np.random.choice(members, size=numberOfLines,
+                                p=weights / weights.sum())
+
+    def messages():
+        # (offset, speaker) pairs, a batch of python ints at a time
+        for low in range(0, numberOfLines, GENERATE_BATCH):
+            high = low + GENERATE_BATCH
+            for message in zip(offsets[low:high].tolist(),
+                               speakers[low:high].tolist()):
+                yield message
+
+    prefixCache = dict()
+    written = 0
+    with open(fileName, 'wb') as outfile:
+        for offset, speaker in messages():
+            if written >= numberOfLines:
+                break
+            prefix = prefixCache.get(offset)
+            if prefix is None:
+                if len(prefixCache) > 100000:
+                    prefixCache.clear()
+                prefix = (firstDate + timedelta(seconds=offset)).strftime(
+                    WADateFormat)
+                prefixCache[offset] = prefix
+            roll = random.random()
+            if roll < 0.005:
+                outfile.write('%s: %s added %s\n'
+                              % (prefix, memberNames[speaker],
+                                 random.choice(memberNames)))
+                written += 1
+                continue
+            words = [random.choice(nonAscii) if random.random() < nonAsciiRate
+                     else random.choice(WORDS)
+                     for _ in range(random.randint(1, 12))]
+            outfile.write('%s: %s: %s\n' % (prefix, memberNames[speaker],
+                                            ' '.join(words)))
+            written += 1
+            if roll > 1 - multiLineRate and written < numberOfLines:
+                outfile.write('%s\n' % ' '.join(random.sample(WORDS, 4)))
+                written += 1
+    return fileName
+
+
+def _timed(timings, name, function, *args, **kwargs):
+    started = time.time()
+    result = function(*args, **kwargs)
+    timings[name] = time.time() - started
+    return result
+
+
+def generateTask(task):
+    # Pool worker: writes the export of one size, returning its file name
+    # and how long that took
+    numberOfLines, workDir, generatorOptions = task
+    fileName = os.path.join(workDir, 'bench_%d.txt' % numberOfLines)
+    started = time.time()
+    generateExport(fileName, numberOfLines, **generatorOptions)
+    return fileName, time.time() - started
+
+
+def runBenchmark(task):
+    # Pool worker: times the WAChat operations on an export. Runs in a
+    # fresh process (maxtasksperchild=1) that did nothing else.
+    numberOfLines, fileName, keepFiles = task
+    from wachat import WAChat
+    # The breakdown methods print notes; keep them out of the report
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    timings = dict()
+    try:
+        chat = _timed(timings, 'init', WAChat, fileName, queryCacheEntries=0)
+        middle = chat.messageList[len(chat.messageList) // 2].date
+        _timed(timings, 'getMembers', chat.getMembers)
+        _timed(timings, 'getMembers_givenYear_monthlyInfo',
+               chat.getMembers_givenYear_monthlyInfo, middle.year)
+        _timed(timings, 'getMembers_givenYearAndMonth_dailyInfo',
+               chat.getMembers_givenYearAndMonth_dailyInfo, middle.year,
+               middle.month)
+        _timed(timings, 'getMembers_givenYearAndMonthAndDay_hourlyInfo',
+               chat.getMembers_givenYearAndMonthAndDay_hourlyInfo,
+               middle.year, middle.month, middle.day)
+        _timed(timings, 'getMemberAllYearsOverMonthFrequencies',
+               chat.getMemberAllYearsOverMonthFrequencies)
+        _timed(timings, 'getMemberDailyFrequencies',
+               chat.getMemberDailyFrequencies, KEYWORD)
+        _timed(timings, 'getMessagesSeperatedByUsers',
+               chat.getMessagesSeperatedByUsers, fromYear=middle.year - 10,
+               untilYear=middle.year + 10)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        if not keepFiles:
+            os.remove(fileName)
+    return {'lines': numberOfLines,
+            'messages': len(chat.store),
+            'fileBytes': chat.parser.bytesRead,
+            'linesPerSecond': chat.parser.linesPerSecond(),
+            'seconds': timings,
+            # kilobytes on Linux
+            'peakRss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+
+def runSuite(sizes, workDir, keepFiles=False, generatorOptions=None):
+    pool = Pool(1, maxtasksperchild=1)
+    try:
+        results = []
+        for size in sizes:
+            fileName, generateSeconds = pool.apply(
+                generateTask, ((size, workDir, generatorOptions or {}),))
+            result = pool.apply(runBenchmark,
+                                ((size, fileName, keepFiles),))
+            result['generateSeconds'] = generateSeconds
+            results.append(result)
+            sys.stderr.write("%9d lines: init %.2fs, peak rss %d\n"
+                             % (result['lines'], result['seconds']['init'],
+                                result['peakRss']))
+    finally:
+        pool.close()
+        pool.join()
+    return {'meta': {'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'platform': platform.platform(),
+                     'date': datetime.now().isoformat(),
+                     'generator': generatorOptions or {}},
+            'results': results}
+
+
+def compare(current, baseline, threshold=1.2):
+    # Lines comparing each timing with the baseline run of the same size;
+    # ratios above threshold are marked as regressions
+    baselineBySize = dict((result['lines'], result)
+                          for result in baseline['results'])
+    report = []
+    for result in current['results']:
+        old = baselineBySize.get(result['lines'])
+        if old is None:
+            continue
+        for name in sorted(result['seconds']):
+            if name not in old['seconds'] or not old['seconds'][name]:
+                continue
+            ratio = result['seconds'][name] / old['seconds'][name]
+            report.append("%9d %-48s %8.3fs %8.3fs %6.2fx%s"
+                          % (result['lines'], name, old['seconds'][name],
+                             result['seconds'][name], ratio,
+                             '  REGRESSION' if ratio > threshold else ''))
+        report.append("%9d %-48s %8d  %8d  %6.2fx"
+                      % (result['lines'], 'peakRss', old['peakRss'],
+                         result['peakRss'],
+                         float(result['peakRss']) / old['peakRss']))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", default=None,
+                        help="earlier --out file to compare against")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    parser.add_argument("--workdir", default=None)
+    parser.add_argument("--keep-files", dest="keepFiles",
+                        action="store_true")
+    parser.add_argument("--members", type=int, default=16)
+    parser.add_argument("--years", type=float, default=4)
+    parser.add_argument("--messages-per-day", dest="messagesPerDay",
+                        type=float, default=None)
+    parser.add_argument("--multi-line-rate", dest="multiLineRate",
+                        type=float, default=0.03)
+    parser.add_argument("--non-ascii-rate", dest="nonAsciiRate",
+                        type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generatorOptions = {'members': args.members, 'years': args.years,
+                        'messagesPerDay': args.messagesPerDay,
+                        'multiLineRate': args.multiLineRate,
+                        'nonAsciiRate': args.nonAsciiRate,
+                        'seed': args.seed}
+    workDir = args.workdir or tempfile.mkdtemp(prefix='wabench')
+    if not os.path.isdir(workDir):
+        os.makedirs(workDir)
+    results = runSuite(args.sizes, workDir, args.keepFiles,
+                       generatorOptions)
+    if not args.workdir and not args.keepFiles:
+        os.rmdir(workDir)
+    with open(args.out, 'w') as outfile:
+        json.dump(results, outfile, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as infile:
+            baseline = json.load(infile)
+        for line in compare(results, baseline, args.threshold):
+            print line
+
+
+if __name__ == "__main__":
+    main()
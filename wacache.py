@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import sys
+import numpy as np
+
+
+def approximateSize(value):
+    # Rough memory footprint in bytes of a query result (nested dicts,
+    # lists and numbers, or numpy arrays)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            size += approximateSize(key) + approximateSize(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += approximateSize(item)
+    return size
+
+
+def copyResult(value):
+    # Copy of the dict/list nesting of a result, so callers may modify
+    # what they get back without touching the cached value
+    if isinstance(value, dict):
+        return dict((key, copyResult(item)) for key, item in value.iteritems())
+    if isinstance(value, list):
+        return [copyResult(item) for item in value]
+    return value
+
+
+class LRUCache(object):
+    # Least recently used cache bounded by number of entries and,
+    # optionally, by the approximateSize of the cached values
+
+    def __init__(self, maxEntries=256, maxBytes=None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries[key] = entry
+        return entry[0]
+
+    def put(self, key, value):
+        size = approximateSize(value) if self.maxBytes is not None else 0
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        if self.maxBytes is not None and size > self.maxBytes:
+            return
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while (len(self._entries) > self.maxEntries or
+               (self.maxBytes is not None and self.bytes > self.maxBytes)):
+            _, (_, evictedSize) = self._entries.popitem(last=False)
+            self.bytes -= evictedSize
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.bytes,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
@@ -1,14 +1,19 @@
-from collections import defaultdict, namedtuple
-from datetime import datetime
-import unicodedata
-import re
+import calendar
+import csv
+import os
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-import matplotlib.patches as mpatches
-
-Message = namedtuple("Message", ["date", "user", "text"])
-WADateFormat = '%m/%d/%y, %I:%M:%S %p'
+from wastore import (Message, MessageStoreBuilder, MessageListView,
+                     SECONDS_PER_DAY, dateToTimestamp, normalizeFrame)
+from waparse import ChatParser, WADateFormat, partialLine
+import wasnapshot
+from wakeyword import KeywordIndex
+from wacache import LRUCache, copyResult
+from wacube import YEAR_AXIS, MONTH_AXIS, DAY_AXIS, HOUR_AXIS
+from waprofile import Profiler, profiledQuery, stage
+import waplot
+from waanalytics import ConversationAnalytics
+from wafiles import uniqueFileName
+from wavocab import VocabularyIndex
 
 
 def isMessageInFrame(message, fromHour, untilHour, fromDay, untilDay,
@@ -22,49 +27,311 @@ def isMessageInFrame(message, fromHour, untilHour, fromDay, untilDay,
 
 class WAChat(object):
 
-    def __init__(self, whatsappFileName):
-        self.messageList = []
-        with open(whatsappFileName, 'r') as infile:
-            pattern = re.compile("([0-9]+)/([0-9]+)/([0-9]+)")
-            for line in infile:
-                line = line.decode("utf-8-sig").encode("utf-8")
-                if not pattern.match(line):
-                    continue
-                splitLine = line.strip().split(": ")
-                if len(splitLine) >= 3:
-                    date = datetime.strptime(splitLine[0], WADateFormat)
-                    user = (unicodedata
-                            .normalize('NFKD', unicode(splitLine[1], "utf-8"))
-                            .encode("ascii", "ignore"))
-                    if user == "ERROR":
-                        continue
-                    text = (unicodedata
-                            .normalize('NFKD', unicode("".join(splitLine[2:]),
-                                       "utf-8"))
-                            .encode("ascii", "ignore"))
-                    self.messageList.append(Message(date, user, text))
-
+    def __init__(self, whatsappFileName, workers=1, cacheDir=None,
+                 queryCacheEntries=256, queryCacheBytes=None, profile=False,
+                 keepUnicode=False):
+        # workers > 1 parses the export in that many processes.
+        # With cacheDir the parsed chat is kept there as a memory mapped
+        # snapshot, reused as long as the export does not change.
+        # Query results are memoized in queryCache, an LRUCache bounded by
+        # queryCacheEntries results and optionally queryCacheBytes.
+        # parser.linesPerSecond() reports how fast the export was read.
+        # profile=True times and counts the loading stages and queries in
+        # a waprofile.Profiler, see profileStats().
+        # keepUnicode=True keeps user names and texts in UTF-8 instead of
+        # stripping them to ASCII
+        self.fileName = whatsappFileName
+        self.keepUnicode = keepUnicode
+        self.workers = workers
+        self.cacheDir = cacheDir
+        self.profiler = Profiler() if profile else None
+        self.queryCache = LRUCache(queryCacheEntries, queryCacheBytes)
+        self._queryCacheStore = None
+        # Messages added by append(), which the export file does not have
+        self.appendedMessages = 0
+        self._load()
+
+    def _cachedQuery(self, key, compute):
+        # compute() memoized under key. Everything cached is dropped as
+        # soon as the store is replaced or extended.
+        storeState = (self.store, self.store.version)
+        if (self._queryCacheStore is None or
+                self._queryCacheStore[0] is not storeState[0] or
+                self._queryCacheStore[1] != storeState[1]):
+            self.queryCache.clear()
+            self._queryCacheStore = storeState
+        result = self.queryCache.get(key)
+        if result is None:
+            result = compute()
+            self.queryCache.put(key, result)
+        return copyResult(result)
+
+    def _load(self):
+        # A snapshot of an older version of the export is brought up to
+        # date with refresh(), which falls back to a full parse if needed
+        self.parser = ChatParser(self.profiler, self.keepUnicode)
+        if self.cacheDir:
+            with stage(self.profiler, 'snapshotLoad'):
+                loaded = wasnapshot.loadSnapshot(self.fileName,
+                                                 self.cacheDir,
+                                                 validate=False)
+            if loaded is not None:
+                self.store, header = loaded
+                self.store.profiler = self.profiler
+                # Without the ingest state (a snapshot saveSnapshot wrote
+                # for another caller) there is nothing to refresh from
+                self.ingestState = header.get('extra')
+                if (self.ingestState and
+                        self.ingestState.get('keepUnicode', False) ==
+                        self.keepUnicode):
+                    if not wasnapshot.revalidate(
+                            wasnapshot.snapshotPath(self.fileName,
+                                                    self.cacheDir),
+                            header, self.fileName):
+                        self.refresh()
+                    return
+        self._rebuild()
+
+    def _rebuild(self):
+        self.parser = ChatParser(self.profiler, self.keepUnicode)
+        self.store, self.ingestState = self._parse()
+        self.appendedMessages = 0
+        self._saveSnapshot()
+
+    def _saveSnapshot(self):
+        # The read hash of ingestState doubles as the snapshot's content
+        # hash when the whole export was read. A store holding appended
+        # messages is not what the export parses to, so it is not saved:
+        # the snapshot stays at the last state that matched the file.
+        if self.cacheDir and not self.appendedMessages:
+            with stage(self.profiler, 'snapshotSave'):
+                wasnapshot.saveSnapshot(
+                    self.store, self.fileName, self.cacheDir,
+                    self.ingestState, (self.ingestState['offset'] +
+                                       self.ingestState['tailBytes'],
+                                       self.ingestState['readHash']))
+
+    def _parse(self):
+        with stage(self.profiler, 'parse'):
+            if self.workers > 1:
+                builder = self.parser.parseFileParallel(
+                    self.fileName, MessageStoreBuilder(), self.workers)
+            else:
+                builder = self.parser.parseFile(self.fileName,
+                                                MessageStoreBuilder())
+        with stage(self.profiler, 'build'):
+            store = builder.build()
+        store.profiler = self.profiler
+        tail = partialLine(self.fileName, self.parser.bytesRead)
+        offset = self.parser.bytesRead - len(tail)
+        return store, self._ingestState(
+            store, offset, wasnapshot.fileDigest(self.fileName, offset), tail)
+
+    def _ingestState(self, store, offset, prefixDigest, tail):
+        # Where refresh() picks up: how many bytes of whole lines of the
+        # export have been read and their hash (prefixDigest, the SHA-1
+        # object of those bytes), the partial line read after them (tail,
+        # the last line without its newline), the timestamp of the last
+        # message and how the texts were normalized. refresh() reads the
+        # partial line again, replacing the messages it gave.
+        readDigest = prefixDigest
+        if tail:
+            readDigest = prefixDigest.copy()
+            readDigest.update(tail)
+        return {'offset': offset,
+                'keepUnicode': self.keepUnicode,
+                'prefixHash': prefixDigest.hexdigest(),
+                'tailBytes': len(tail),
+                'tailMessages': int(bool(tail) and
+                                    self.parser.parseLine(tail) is not None),
+                'readHash': readDigest.hexdigest(),
+                'lastTimestamp': (int(store.timestamps[-1]) if len(store)
+                                  else None)}
+
+    def append(self, lines):
+        # Adds the messages found in more export lines to the chat and
+        # returns how many there were. They are kept in memory only: the
+        # snapshot and refresh() follow the export file, so a refresh()
+        # that has to reload it in full drops them again, and no snapshot
+        # is saved while the chat has them. The last timestamp is updated,
+        # so refresh() still checks the order of what the export adds
+        # against every message of the chat.
+        newMessages = self.store.extend(self.parser.parseInto(
+            lines, MessageStoreBuilder()))
+        self.appendedMessages += newMessages
+        if newMessages:
+            lastTimestamp = int(self.store.timestamps[-newMessages:].max())
+            if self.ingestState['lastTimestamp'] is not None:
+                lastTimestamp = max(lastTimestamp,
+                                    self.ingestState['lastTimestamp'])
+            self.ingestState = dict(self.ingestState,
+                                    lastTimestamp=lastTimestamp)
+        return newMessages
+
+    def refresh(self):
+        # Brings the chat up to date with a re-export of the same file,
+        # parsing only what was appended since the last load. When the
+        # bytes read before differ, or the new messages predate the last
+        # one, the export is not a continuation and gets reloaded in full.
+        # Returns (number of new messages, whether it was reloaded).
+        # The export is hashed once: the bytes read before, checked against
+        # prefixHash, then, continuing that hash, the ones appended. A
+        # partial last line is parsed again from its start, its messages
+        # taking the place of the ones it gave before.
+        offset = self.ingestState['offset']
+        lastTimestamp = self.ingestState['lastTimestamp']
+        tailMessages = self.ingestState['tailMessages']
+        if os.path.getsize(self.fileName) < offset:
+            self._rebuild()
+            return len(self.store), True
+        prefixDigest = wasnapshot.fileDigest(self.fileName, offset)
+        if (prefixDigest.hexdigest() != self.ingestState['prefixHash'] or
+                # Messages of the partial line are no longer the last ones
+                (tailMessages and self.appendedMessages)):
+            self._rebuild()
+            return len(self.store), True
+
+        bytesBefore = self.parser.bytesRead
+        builder = self.parser.parseFile(self.fileName, MessageStoreBuilder(),
+                                        offset)
+        if (lastTimestamp is not None and len(builder.timestamps) and
+                min(builder.timestamps) < lastTimestamp):
+            self._rebuild()
+            return len(self.store), True
+
+        self.store.truncate(len(self.store) - tailMessages)
+        newMessages = self.store.extend(builder) - tailMessages
+        bytesRead = self.parser.bytesRead - bytesBefore
+        tail = partialLine(self.fileName, offset + bytesRead)
+        bytesRead -= len(tail)
+        self.ingestState = self._ingestState(
+            self.store, offset + bytesRead,
+            wasnapshot.fileDigest(self.fileName, bytesRead, offset,
+                                  prefixDigest.copy()), tail)
+        self._saveSnapshot()
+        return newMessages, False
+
+    def profileStats(self):
+        # Structured report of a chat made with profile=True: the
+        # Profiler's stages, counters and per query method calls/scans,
+        # plus parse throughput and query cache statistics. None without
+        # profiling.
+        if self.profiler is None:
+            return None
+        stats = self.profiler.stats()
+        stats['linesPerSecond'] = self.parser.linesPerSecond()
+        stats['queryCache'] = self.queryCache.stats()
+        return stats
+
+    @property
+    def messageList(self):
+        # Lazy compatibility view over the columnar store, Message tuples
+        # are only built for the entries that get accessed
+        return MessageListView(self.store)
+
+    @profiledQuery
     def getMessagesSeperatedByUsers(self, fromHour=0, untilHour=23, fromDay=1,
                                     untilDay=31, fromMonth=1, untilMonth=12,
                                     fromYear=2009, untilYear=2020):
-        messageSeparated = defaultdict(str)
-        for message in self.messageList:
-            if (isMessageInFrame(message, fromHour, untilHour, fromDay,
-                                 untilDay, fromMonth, untilMonth, fromYear,
-                                 untilYear)):
-                messageSeparated[message.user] += ' ' + message.text
-        return dict(messageSeparated)
-
-
+        # Each member's texts in the frame, every one preceded by a space.
+        # Texts are collected per member and joined once.
+        getText = self.store.getText
+        messageSeparated = dict()
+        for memberName, indices in self._messagesByUser(
+                fromHour, untilHour, fromDay, untilDay, fromMonth,
+                untilMonth, fromYear, untilYear):
+            messageSeparated[memberName] = ''.join(
+                [' ' + getText(i) for i in indices])
+        return messageSeparated
+
+    @profiledQuery
+    def writeMessagesSeperatedByUsers(self, outPath, perMemberFiles=False,
+                                      fromHour=0, untilHour=23, fromDay=1,
+                                      untilDay=31, fromMonth=1,
+                                      untilMonth=12, fromYear=2009,
+                                      untilYear=2020):
+        # Streams what getMessagesSeperatedByUsers returns to disk without
+        # holding any member's text in memory: either a CSV at outPath with
+        # a (name, text) row per member, or with perMemberFiles one
+        # <name>.txt per member in the directory outPath.
+        # Returns the number of members written.
+        getText = self.store.getText
+        usedFileNames = set()
+        if perMemberFiles:
+            if not os.path.isdir(outPath):
+                os.makedirs(outPath)
+        else:
+            outfile = open(outPath, 'wb')
+            csv.writer(outfile).writerow(['name', 'text'])
+        numberOfMembers = 0
+        try:
+            for memberName, indices in self._messagesByUser(
+                    fromHour, untilHour, fromDay, untilDay, fromMonth,
+                    untilMonth, fromYear, untilYear):
+                numberOfMembers += 1
+                if perMemberFiles:
+                    fileName = uniqueFileName(memberName, usedFileNames)
+                    with open(os.path.join(outPath, fileName + '.txt'),
+                              'wb') as memberFile:
+                        for i in indices:
+                            memberFile.write(' ' + getText(i))
+                else:
+                    # A quoted CSV field written piece by piece, with
+                    # quotes doubled as csv.writer would
+                    outfile.write('"%s","' % memberName.replace('"', '""'))
+                    for i in indices:
+                        outfile.write(' ' + getText(i).replace('"', '""'))
+                    outfile.write('"\r\n')
+        finally:
+            if not perMemberFiles:
+                outfile.close()
+        return numberOfMembers
+
+    def _messagesByUser(self, fromHour, untilHour, fromDay, untilDay,
+                        fromMonth, untilMonth, fromYear, untilYear):
+        # (memberName, message indices in store order) for every member
+        # with messages in the frame
+        indices = self.store.frameIndices(fromHour, untilHour, fromDay,
+                                          untilDay, fromMonth, untilMonth,
+                                          fromYear, untilYear)
+        userCodes = self.store.userCodes[indices]
+        order = np.argsort(userCodes, kind='mergesort')
+        indices = indices[order]
+        userCodes = userCodes[order]
+        bounds = np.flatnonzero(np.diff(userCodes)) + 1
+        for memberIndices in np.split(indices, bounds):
+            if len(memberIndices):
+                yield (self.store.getUser(memberIndices[0]),
+                       memberIndices)
+
+    @profiledQuery
     def getMembers(self, fromHour=0, untilHour=23, fromDay=1, untilDay=31,
                    fromMonth=1, untilMonth=12, fromYear=2009, untilYear=2020):
-        members = defaultdict(int)
-        for message in self.messageList:
-            if (isMessageInFrame(message, fromHour, untilHour, fromDay,
-                                 untilDay, fromMonth, untilMonth, fromYear,
-                                 untilYear)):
-                members[message.user] += 1
-        return dict(members)
+        frame = normalizeFrame(fromHour, untilHour, fromDay, untilDay,
+                               fromMonth, untilMonth, fromYear, untilYear)
+        if frame is None:
+            return dict()
+        if self.store.holdsEverything(*frame):
+            # Unfiltered: one count over the member codes does
+            compute = self.store.memberCounts
+        else:
+            def compute():
+                return self.store.memberDict(
+                    self.store.activityCube().total(frame))
+        return self._cachedQuery(('getMembers',) + frame, compute)
+
+    @profiledQuery
+    def getMembersBetween(self, start, end):
+        # Number of messages per member for start <= date < end, with
+        # start and end datetimes, answered from the time index
+        return self.store.memberCounts(
+            self.store.indicesBetween(dateToTimestamp(start),
+                                      dateToTimestamp(end)))
+
+    def conversationAnalytics(self, start=None, end=None):
+        # waanalytics.ConversationAnalytics (sessions, reply latencies,
+        # who replies after whom) of the messages with start <= date < end
+        return ConversationAnalytics(self.store, start, end)
 
     def plotMembersSpokenLines(self, fromHour=0, untilHour=23, fromDay=1,
                                untilDay=31, fromMonth=1, untilMonth=12,
@@ -72,44 +339,17 @@ class WAChat(object):
                                dataRepresntIn="total",
                                yAxisTitle='Number of messages',
                                plotTitle='Number of messages sent by each \
-                               member'):
-        peopleList = self.getMembers(fromHour, untilHour, fromDay, untilDay,
-                                     fromMonth, untilMonth, fromYear,
-                                     untilYear).keys()
-        linesList = self.getMembers(fromHour, untilHour, fromDay, untilDay,
-                                    fromMonth, untilMonth, fromYear,
-                                    untilYear).values()
-        sumlinesList = sum(linesList)
-        if dataRepresntIn == "p":
-            linesList = [float(i)/sumlinesList for i in linesList]
-        ind = np.arange(len(peopleList))
-        width = 0.75
-        fig, ax = plt.subplots()
-        rects1 = ax.bar(ind+width/2.0, linesList, width, color='r')
-        ax.set_ylabel(yAxisTitle)
-        ax.set_title(plotTitle)
-        ax.set_xticks(ind+width)
-        ax.set_xticklabels(peopleList, rotation="vertical")
-        axes = plt.gca()
-        axes.set_ylim([0, 1.1 * max(linesList)])
-
-        def autolabel(rects):
-            for rect in rects:
-                height = rect.get_height()
-                if dataRepresntIn == "p":
-                    ax.text(rect.get_x()+rect.get_width()/2.,
-                            height + 0.01 * max(linesList), '%.1f%%'
-                            % (height * 100.0), ha='center', va='bottom')
-                else:
-                    ax.text(rect.get_x()+rect.get_width()/2.,
-                            height + 0.01 * max(linesList), '%d' % int(height),
-                            ha='center', va='bottom')
-
-        autolabel(rects1)
-        plt.subplots_adjust(bottom=0.25)
-        plt.show()
-
-    def getMemberDailyFrequencies(self, keyword=None):
+                               member', outFile=None):
+        # outFile saves the chart there (Agg backend) instead of showing it
+        plt = waplot.pyplot(headless=outFile is not None)
+        fig = waplot.drawMembersSpokenLines(
+            plt, self.getMembers(fromHour, untilHour, fromDay, untilDay,
+                                 fromMonth, untilMonth, fromYear, untilYear),
+            dataRepresntIn, yAxisTitle, plotTitle)
+        waplot.finish(plt, fig, outFile)
+
+    @profiledQuery
+    def getMemberDailyFrequencies(self, keyword=None, substring=True):
         # starting from first day messages was sent until the last day,
         # for each member, a dictionary of arrays (each sized number of days)
         # gets created. if keyword is specified, when it is seen in a message
@@ -117,29 +357,91 @@ class WAChat(object):
         # that day, if keyword is not specified, it simply counts the number
         # of messages sent by user on the timeline from start until end of the
         # chat
-
-        firstMessageDate = self.messageList[0].date
-        lastMessageDate = self.messageList[-1].date
-        numberOfDays = (lastMessageDate - firstMessageDate).days + 1
-        membersByWord = dict()
-
-        for key in self.getMembers():
-            membersByWord[key] = [0]*numberOfDays
+        # substring=False only matches keyword as whole words
 
         if keyword:
-            keyword = keyword.lower()
-
-        for message in self.messageList:
-            saidWord = 0
-            if keyword:
-                saidWord = message.text.lower().count(keyword)
-
-            if saidWord or not keyword:
-                messageDay = (message.date - firstMessageDate).days
-                membersByWord[message.user][messageDay] += 1
+            return self._cachedQuery(
+                ('getMemberDailyFrequencies', keyword.lower(),
+                 bool(substring)),
+                lambda: self._memberDailyCounts(
+                    self.keywordIndex().messages(keyword, substring)))
+        return self._cachedQuery(('getMemberDailyFrequencies', None),
+                                 self._memberDailyCounts)
+
+    @profiledQuery
+    def getKeywordsDailyFrequencies(self, keywords, substring=True):
+        # getMemberDailyFrequencies for many keywords at once:
+        # {keyword: {member: [count per day]}}, all answered from the
+        # keyword index, which finds the substring ones in a single pass.
+        # A single keyword may be given as a plain string.
+        if isinstance(keywords, basestring):
+            keywords = [keywords]
+        if substring:
+            self.keywordIndex().substringMessagesMany(keywords)
+        return dict((keyword,
+                     self.getMemberDailyFrequencies(keyword, substring))
+                    for keyword in keywords)
+
+    def keywordIndex(self):
+        # KeywordIndex of the current store, rebuilt after it changes
+        index = getattr(self, '_keywordIndex', None)
+        if (index is None or index.store is not self.store or
+                index.version != self.store.version):
+            index = self._keywordIndex = KeywordIndex(self.store)
+        return index
+
+    def vocabulary(self, topK=None):
+        # VocabularyIndex (top words and bigrams per member and month) of
+        # the current store, tokenized in self.workers processes and
+        # rebuilt after the store changes. topK bounds every member and
+        # month to an approximate summary of its topK most used terms.
+        index = getattr(self, '_vocabulary', None)
+        if (index is None or index.store is not self.store or
+                index.version != self.store.version or index.topK != topK):
+            index = self._vocabulary = VocabularyIndex(self.store,
+                                                       self.workers, topK)
+        return index
+
+    @profiledQuery
+    def getTopWords(self, n=20, memberName=None, bigrams=False, fromMonth=1,
+                    untilMonth=12, fromYear=2009, untilYear=2020):
+        # [(word, count)] of the n words (or bigrams) used most in the
+        # frame, by memberName or by everyone
+        vocabulary = self.vocabulary()
+        top = vocabulary.topBigrams if bigrams else vocabulary.topWords
+        return self._cachedQuery(
+            ('getTopWords', n, memberName, bool(bigrams), fromMonth,
+             untilMonth, fromYear, untilYear),
+            lambda: top(n, memberName, fromMonth, untilMonth, fromYear,
+                        untilYear))
+
+    def _memberDailyCounts(self, indices=None):
+        # {member: [messages per day since the first message]}, counting
+        # only the given message indices if any
+        # Days are 24 hour steps from the first message of the export,
+        # extended to the earlier steps messages dated before it fall in
+        store = self.store
+        timestamps = store.timestamps
+        messageDays = (timestamps - timestamps[0]) // SECONDS_PER_DAY
+        firstDay = int(messageDays.min())
+        numberOfDays = int(messageDays.max()) - firstDay + 1
+        messageDays -= firstDay
+        userCodes = store.userCodes
+        if indices is not None:
+            messageDays = messageDays[indices]
+            userCodes = userCodes[indices]
+        numberOfMembers = len(store.members)
+        counts = np.bincount(userCodes.astype(np.int64) * numberOfDays +
+                             messageDays,
+                             minlength=numberOfMembers * numberOfDays)
+        counts = counts.reshape(numberOfMembers, numberOfDays)
 
+        membersByWord = dict()
+        for key in self.getMembers():
+            membersByWord[key] = counts[store.memberCodes[key]].tolist()
         return membersByWord
 
+    @profiledQuery
     def getMemberHourlyFrequencies(self):
         # A dictionary of arrays (each sized number of hours
         # in a day) gets created. For each hour it simply counts
@@ -147,19 +449,17 @@ class WAChat(object):
         # hour.
         # So in the end for each member we have a list of
         # number of messages in each hour
+        return self._cachedQuery(('getMemberHourlyFrequencies',),
+                                 self._memberHourlyFrequencies)
 
+    def _memberHourlyFrequencies(self):
         memberHour = dict()
-        numberOfHoursPerDay = 24
-
+        counts = self._activityCounts(keepAxes=(HOUR_AXIS,))
         for key in self.getMembers():
-            memberHour[key] = [0] * numberOfHoursPerDay
-
-        for i in range(numberOfHoursPerDay):
-            hourTalk = self.getMembers(fromHour=i, untilHour=i)
-            for key in hourTalk:
-                memberHour[key][i] = hourTalk[key]
+            memberHour[key] = counts[self.store.memberCodes[key]].tolist()
         return memberHour
 
+    @profiledQuery
     def getMemberMonthlyFrequencies(self):
         # A dictionary of arrays (each sized number of month
         # in a year) gets created. For each month it simply counts
@@ -167,19 +467,17 @@ class WAChat(object):
         # month.
         # So in the end for each member we have a list of
         # number of messages in each month
+        return self._cachedQuery(('getMemberMonthlyFrequencies',),
+                                 self._memberMonthlyFrequencies)
 
+    def _memberMonthlyFrequencies(self):
         memberMonth = dict()
-        numberOfMonthPerYear = 12
-
+        counts = self._activityCounts(keepAxes=(MONTH_AXIS,))
         for key in self.getMembers():
-            memberMonth[key] = [0] * numberOfMonthPerYear
-
-        for i in range(1, numberOfMonthPerYear + 1):
-            monthTalk = self.getMembers(fromMonth=i, untilMonth=i)
-            for key in monthTalk:
-                memberMonth[key][i - 1] = monthTalk[key]
+            memberMonth[key] = counts[self.store.memberCodes[key]].tolist()
         return memberMonth
 
+    @profiledQuery
     def statisticalGroupInfo(self, statInfo):
         # Get some statistical numbers regarding data
         # statInfo can be avg for average and ... (room for improvement)
@@ -191,98 +489,26 @@ class WAChat(object):
             sumTalks = sum(talks)
             return sumTalks / float(len(peopleList))
 
-    def plotOverHoursMemberSpokenLines(self, memberName=None):
+    def plotOverHoursMemberSpokenLines(self, memberName=None, outFile=None):
         # if memberName is specified, for the given member it plots
         # the spoken lines vs hours. If the member is not specified
         # it plots the same thing for the entire group.
+        # outFile saves the chart there (Agg backend) instead of showing it
 
+        hourly = self.getMemberHourlyFrequencies()
         if memberName:
-            memberHourInfo = self.getMemberHourlyFrequencies()[memberName]
-            N = len(memberHourInfo)
-            toPlotData = memberHourInfo
-            plotTitle = "What hour does %s talk? [Seattle Time]" % memberName
-
+            toPlotData = hourly[memberName]
         else:
-            peopleList = self.getMembers().keys()
             groupHourInfo = np.array([0] * 24)
-            for memberName in peopleList:
-                memberHourInfo = self.getMemberHourlyFrequencies()[memberName]
+            for memberHourInfo in hourly.values():
                 groupHourInfo += np.array(memberHourInfo)
             toPlotData = groupHourInfo
-            N = len(groupHourInfo)
-            plotTitle = "What hour our group talk? [Seattle Time]"
-
-        theta = np.linspace(0.0, 2 * np.pi, N, endpoint=False)
-        avg = sum(toPlotData)/float(len(toPlotData))
-        radii = [x / avg for x in toPlotData]
-        width = [(2-0.75)*np.pi/float(N)]*N
-        fig = plt.figure(1, figsize=(8, 8), dpi=90)
-        # Polar Plot
-        ax = fig.add_subplot(211, polar=True)
-        bars = ax.bar(theta, radii, width=width, bottom=0)
-        ax.set_rmax(1.1 * max(radii))
-        # Set the major tick locations to create a clock
-        ax.xaxis.set_major_locator(ticker.MultipleLocator(np.pi/12))
-        # ax.yaxis.set_major_locator(ticker.MultipleLocator(0.5))
-        ax.set_xticklabels(['This does not get printed']+range(24))
-        ax.set_yticklabels([])
-
-        for i, r, bar in zip(range(N), radii, bars):
-            if i/12 == 0:
-                bar.set_facecolor("yellow")
-                bar.set_alpha(0.5)
-            else:
-                bar.set_facecolor("black")
-                bar.set_alpha(0.5)
-        ax.set_theta_zero_location("N")
-        ax.set_theta_direction(-1)
-        classes = ['AM', 'PM']
-        class_colours = ['yellow', 'gray']
-        recs = []
-        for i in range(0, len(class_colours)):
-            recs.append(mpatches.Rectangle((0, 0), 1, 1,
-                        fc=class_colours[i]))
-        plt.legend(recs, classes, bbox_to_anchor=(1.4, 1.15))
-
-        # Regular Histagram Plot on the side
-        ax = fig.add_subplot(212)
-
-        hourList = ['0-1', '1-2', '2-3', '3-4', '4-5', '5-6', '6-7', '7-8',
-                    '8-9', '9-10', '10-11', '11-12', '12-13', '13-14',
-                    '14-15', '15-16', '16-17', '17-18', '18-19', '19-20',
-                    '20-21', '21-22', '22-23', '23-0']
-
-        ind = np.arange(len(hourList))
-        width = 0.85
-        rectsbars = ax.bar(ind+width/2.0, toPlotData, width)
-        for i, bar in zip(range(24), rectsbars):
-            if i/12 == 0:
-                bar.set_facecolor("yellow")
-                bar.set_alpha(0.5)
-            else:
-                bar.set_facecolor("black")
-                bar.set_alpha(0.5)
-        # ax.set_ylabel(yAxisTitle)
-        # ax.set_title(plotTitle)
-        ax.set_xticks(ind+width)
-        ax.set_xticklabels(hourList, rotation="vertical")
-        axes = plt.gca()
-        axes.set_ylim([0, 1.1 * max(toPlotData)])
-
-        def autolabel(rects, toPlotData):
-            for rect in rects:
-                height = rect.get_height()
-                ax.text(rect.get_x()+rect.get_width()/2.0,
-                        height + 0.02 * max(toPlotData),
-                        '%d' % int(height),
-                        ha='center', va='bottom')
-        autolabel(rectsbars, toPlotData)
-        plt.subplots_adjust(bottom=0.25)
-
-        fig.suptitle(plotTitle, fontsize=20, y=1)
-
-        plt.show()
+        plt = waplot.pyplot(headless=outFile is not None)
+        fig = waplot.drawOverHours(plt, toPlotData,
+                                   waplot.overHoursTitle(memberName))
+        waplot.finish(plt, fig, outFile)
 
+    @profiledQuery
     def getMemberAllYearsOverMonthFrequencies(self, memberName=None):
         # For each existing year (startDate to endDate) for given
         # member finds the number of spoken lines for each month.
@@ -297,36 +523,52 @@ class WAChat(object):
         else:
             peopleList = self.getMembers().keys()
 
+        counts = self._activityCounts(keepAxes=(YEAR_AXIS, MONTH_AXIS),
+                                      fromYear=firstMessageDate.year,
+                                      untilYear=lastMessageDate.year)
+
         infoDic = dict()
         for memberName in peopleList:
+            memberCounts = self._memberBuckets(counts, memberName)
             infoDic[memberName] = dict()
             for year in range(firstMessageDate.year + 1, lastMessageDate.year):
-                infoDic[memberName][year] = dict()
-                for month in range(1, 12 + 1):
-                    infoDic[memberName][year][month] = self.getMembers(
-                        fromMonth=month,
-                        untilMonth=month,
-                        fromYear=year,
-                        untilYear=year).get(memberName, 0)
+                infoDic[memberName][year] = self._bucketInfo(
+                    memberCounts[year - firstMessageDate.year], 1,
+                    range(1, 12 + 1))
             # Dealing with first year
-            infoDic[memberName][firstMessageDate.year] = dict()
-            for month in range(firstMessageDate.month, 12 + 1):
-                infoDic[memberName][firstMessageDate.year][month] = self.getMembers(
-                    fromMonth=month,
-                    untilMonth=month,
-                    fromYear=firstMessageDate.year,
-                    untilYear=firstMessageDate.year).get(memberName, 0)
+            infoDic[memberName][firstMessageDate.year] = self._bucketInfo(
+                memberCounts[0], 1, range(firstMessageDate.month, 12 + 1))
             # Dealing with last year
-            infoDic[memberName][lastMessageDate.year] = dict()
-            for month in range(1, lastMessageDate.month + 1):
-                infoDic[memberName][lastMessageDate.year][month] = self.getMembers(
-                    fromMonth=month,
-                    untilMonth=month,
-                    fromYear=lastMessageDate.year,
-                    untilYear=lastMessageDate.year).get(memberName, 0)
+            infoDic[memberName][lastMessageDate.year] = self._bucketInfo(
+                memberCounts[-1], 1, range(1, lastMessageDate.month + 1))
 
         return infoDic
 
+    def _activityCounts(self, keepAxes=(), fromHour=0, untilHour=23,
+                        fromDay=1, untilDay=31, fromMonth=1, untilMonth=12,
+                        fromYear=2009, untilYear=2020):
+        # Per-member message counts in a (non-empty) frame, read from the
+        # activity cube and summed over every calendar axis but keepAxes
+        return self.store.activityCube().total(
+            normalizeFrame(fromHour, untilHour, fromDay, untilDay, fromMonth,
+                           untilMonth, fromYear, untilYear), keepAxes)
+
+    def _memberBuckets(self, counts, memberName):
+        # Row of a per-member counts array for one member, all zeros for
+        # names that never wrote in the chat
+        code = self.store.memberCodes.get(memberName)
+        if code is None:
+            return np.zeros(counts.shape[1:], dtype=counts.dtype)
+        return counts[code]
+
+    def _bucketInfo(self, bucketCounts, low, buckets):
+        # {bucket: count} for the requested buckets of a counts row whose
+        # first entry corresponds to bucket value low
+        bucketCounts = bucketCounts.tolist()
+        return dict((bucket, bucketCounts[bucket - low])
+                    for bucket in buckets)
+
+    @profiledQuery
     def getMembers_givenYear_monthlyInfo(self, year, memberName=None):
         # Give this function a specific year
         # and it gives
@@ -338,7 +580,6 @@ class WAChat(object):
         firstMessageDate = self.messageList[0].date
         lastMessageDate = self.messageList[-1].date
 
-        # Not accounting for the leap years
         firstMonth = 1
         finalMonth = 12
 
@@ -353,17 +594,16 @@ class WAChat(object):
         elif year == firstMessageDate.year and firstMessageDate.month != 1:
             print "Note: The month you are asking for is left-incomplete"
             firstMonth = firstMessageDate.month
+        counts = self._activityCounts(keepAxes=(MONTH_AXIS,),
+                                      fromYear=year, untilYear=year)
         infoDic = dict()
         for memberName in peopleList:
-            infoDic[memberName] = dict()
-            for month in range(firstMonth, finalMonth + 1):
-                infoDic[memberName][month] = self.getMembers(
-                    fromMonth=month,
-                    untilMonth=month,
-                    fromYear=year,
-                    untilYear=year).get(memberName, 0)
+            infoDic[memberName] = self._bucketInfo(
+                self._memberBuckets(counts, memberName), 1,
+                range(firstMonth, finalMonth + 1))
         return infoDic
 
+    @profiledQuery
     def getMembers_givenYearAndMonth_dailyInfo(self, year, month,
                                                memberName=None):
         # Give this function a specific month (1-12) of a specific year
@@ -376,10 +616,8 @@ class WAChat(object):
         firstMessageDate = self.messageList[0].date
         lastMessageDate = self.messageList[-1].date
 
-        monthDays = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
-        # Not accounting for the leap years
         firstDay = 1
-        finalDay = monthDays[month-1]
+        finalDay = calendar.monthrange(year, month)[1]
 
         if year > lastMessageDate.year or year < firstMessageDate.year:
             print "Please enter a valid year which the group data provides!\n"
@@ -400,19 +638,17 @@ class WAChat(object):
         elif year == firstMessageDate.year and month == firstMessageDate.month:
             print "Note: The month you are asking might be left-incomplete"
             firstDay = firstMessageDate.day
+        counts = self._activityCounts(keepAxes=(DAY_AXIS,),
+                                      fromMonth=month, untilMonth=month,
+                                      fromYear=year, untilYear=year)
         infoDic = dict()
         for memberName in peopleList:
-            infoDic[memberName] = dict()
-            for day in range(firstDay, finalDay + 1):
-                infoDic[memberName][day] = self.getMembers(
-                    fromMonth=month,
-                    untilMonth=month,
-                    fromYear=year,
-                    untilYear=year,
-                    fromDay=day,
-                    untilDay=day).get(memberName, 0)
+            infoDic[memberName] = self._bucketInfo(
+                self._memberBuckets(counts, memberName), 1,
+                range(firstDay, finalDay + 1))
         return infoDic
 
+    @profiledQuery
     def getMembers_givenYearAndMonthAndDay_hourlyInfo(self, year, month, day,
                                                       memberName=None):
         # Give this function a specific day of a specific month (1-12) of a
@@ -425,15 +661,12 @@ class WAChat(object):
             peopleList = self.getMembers().keys()
         firstMessageDate = self.messageList[0].date
         lastMessageDate = self.messageList[-1].date
-        print "We do not deal with leap days so no result for Feb 29!!! sorry\n"
         print "Note: The results are based on the timezone of the downloader"
         #
-        monthDays = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
-        if day < 1 or day > monthDays[month-1]:
+        if day < 1 or day > calendar.monthrange(year, month)[1]:
             print 'Your date is not a valid Date pffff'
             return
 
-        # Not accounting for the leap years
         firstHour = 0
         finalHour = 24
 
@@ -468,46 +701,22 @@ class WAChat(object):
                 print "Note: The day you are asking might be left-incomplete"
                 firstHour = firstMessageDate.hour
 
+        counts = self._activityCounts(keepAxes=(HOUR_AXIS,),
+                                      fromMonth=month, untilMonth=month,
+                                      fromYear=year, untilYear=year,
+                                      fromDay=day, untilDay=day)
         infoDic = dict()
         for memberName in peopleList:
-            infoDic[memberName] = dict()
-            for hour in range(firstHour, finalHour):
-                infoDic[memberName][hour] = self.getMembers(
-                    fromMonth=month,
-                    untilMonth=month,
-                    fromYear=year,
-                    untilYear=year,
-                    fromDay=day,
-                    untilDay=day,
-                    fromHour=hour,
-                    untilHour=hour).get(memberName, 0)
+            infoDic[memberName] = self._bucketInfo(
+                self._memberBuckets(counts, memberName), 0,
+                range(firstHour, finalHour))
         return infoDic
 
-    def plotGivenYearOverMonthFrequencies(self, memberName=None):
-
-        monthNames = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5,
-                      'Jun': 6, 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10,
-                      'Nov': 11, 'Dec': 12}
+    def plotGivenYearOverMonthFrequencies(self, memberName=None,
+                                          outFile=None):
+        # outFile saves the chart there (Agg backend) instead of showing it
         toPlotData = self.getMemberAllYearsOverMonthFrequencies(
             memberName)[memberName]
-        fig, ax = plt.subplots()
-        numColors = 0
-        for year in toPlotData:
-            numColors += 1
-            monthList = toPlotData[year].keys()
-            monthValues = toPlotData[year].values()
-            ax.plot(np.array(monthList), np.array(monthValues), label=year,
-                    linewidth=3)
-        cm = plt.get_cmap('gist_rainbow')
-        ax.set_color_cycle([cm(1. * i / numColors) for i in range(numColors)])
-        plt.xticks(monthNames.values(), monthNames.keys(),
-                   rotation='vertical', fontsize=18)
-        plt.yticks(fontsize=18)
-        ax.margins(0.1)
-        ax.grid(b=True, which='both', color='r', linestyle='--')
-        # plt.subplots_adjust(bottom=0.15)
-        plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
-        plotTitle = "%s" % memberName
-        fig.suptitle(plotTitle, fontsize=20, y=1)
-
-        plt.show()
+        plt = waplot.pyplot(headless=outFile is not None)
+        fig = waplot.drawYearOverMonths(plt, toPlotData, memberName)
+        waplot.finish(plt, fig, outFile)
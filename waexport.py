@@ -0,0 +1,437 @@
+# Flat columnar tables of a chat, for tools that should not go through
+# WAChat (or re-read nested JSON) to get at its numbers:
+#
+#   writeMessages(chat.store, 'messages.npz')    timestamp, member, text
+#   writeActivity(chat.store.activityCube(), chat.store.members,
+#                 'activity.csv')   member, year, month, day, hour, count
+#   writeResult(chat.getMemberHourlyFrequencies(), 'hours.parquet',
+#               QUERY_COLUMNS['getMemberHourlyFrequencies'])
+#   columns = loadTable('hours.parquet')
+#
+# A table goes through as chunks, OrderedDicts of equally long columns
+# with at most CHUNK_ROWS rows, so writing and reading hold one chunk at a
+# time. Numeric columns are int64 or float64 arrays, text columns object
+# arrays of str. The format follows the file extension: .csv, .npz or,
+# when pyarrow is installed, .parquet.
+from collections import OrderedDict
+from StringIO import StringIO
+import csv
+import os
+import zipfile
+import numpy as np
+
+CHUNK_ROWS = 65536
+FORMATS = ('csv', 'npz', 'parquet')
+# Column names of the tables writeResult makes of WAChat query results:
+# one per level of nesting (dict keys, list positions), then the values
+QUERY_COLUMNS = {
+    'getMembers': ('member', 'count'),
+    # day: 24 hour steps since the first message of the export, starting
+    # from the earliest step any message (even an out of order one) is in
+    'getMemberDailyFrequencies': ('member', 'day', 'count'),
+    'getKeywordsDailyFrequencies': ('keyword', 'member', 'day', 'count'),
+    'getMemberHourlyFrequencies': ('member', 'hour', 'count'),
+    # monthIndex: 0 for January
+    'getMemberMonthlyFrequencies': ('member', 'monthIndex', 'count'),
+    'getMemberAllYearsOverMonthFrequencies': ('member', 'year', 'month',
+                                              'count'),
+    'getMembers_givenYear_monthlyInfo': ('member', 'month', 'count'),
+    'getMembers_givenYearAndMonth_dailyInfo': ('member', 'day', 'count'),
+    'getMembers_givenYearAndMonthAndDay_hourlyInfo': ('member', 'hour',
+                                                      'count'),
+    'getMessagesSeperatedByUsers': ('member', 'text'),
+    'statisticalGroupInfo': ('value',),
+    # rank: 0 for the most used term
+    'getTopWords': ('rank', 'term', 'count'),
+}
+# Entries of an .npz table besides the column chunks
+_NPZ_COLUMNS = '__columns__'
+_NPZ_ROWS = '__rows__'
+
+
+def fileFormat(fileName):
+    # 'csv', 'npz' or 'parquet' from the extension of fileName
+    extension = os.path.splitext(fileName)[1].lstrip('.').lower()
+    if extension not in FORMATS:
+        raise ValueError("unknown table format %r, expected one of %s"
+                         % (extension, ', '.join(FORMATS)))
+    return extension
+
+
+def importPyarrow():
+    # (pyarrow, pyarrow.parquet), or an ImportError saying Parquet tables
+    # need it
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet tables need pyarrow (pip install "
+                          "pyarrow)")
+    return pyarrow, pyarrow.parquet
+
+
+def _column(values):
+    # values as an int64, float64 or object (str) array
+    array = np.asarray(values)
+    if array.dtype.kind in 'biu':
+        return array.astype(np.int64)
+    if array.dtype.kind == 'f':
+        return array.astype(np.float64)
+    result = np.empty(len(array), dtype=object)
+    result[:] = [value if isinstance(value, str)
+                 else unicode(value).encode('utf-8')
+                 for value in array.tolist()]
+    return result
+
+
+def _strings(array):
+    # An object array of str, for columns given as python lists
+    result = np.empty(len(array), dtype=object)
+    result[:] = array
+    return result
+
+
+class _CSVWriter(object):
+
+    def __init__(self, fileName, columns):
+        self.outfile = open(fileName, 'wb')
+        self.writer = csv.writer(self.outfile)
+        self.writer.writerow(columns)
+
+    def write(self, chunk):
+        self.writer.writerows(zip(*[column.tolist()
+                                    for column in chunk.values()]))
+
+    def close(self):
+        self.outfile.close()
+
+
+class _NPZWriter(object):
+    # An uncompressed .npz, np.load()-able, holding one <column>.<chunk>
+    # array per chunk of a numeric column. Text columns are stored as the
+    # MessageStore stores texts: <column>.<chunk>.data with the bytes back
+    # to back and <column>.<chunk>.offsets with their boundaries.
+
+    def __init__(self, fileName, columns):
+        self.zipFile = zipfile.ZipFile(fileName, 'w', zipfile.ZIP_STORED,
+                                       allowZip64=True)
+        self.columns = columns
+        self.rows = []
+        self._add(_NPZ_COLUMNS, np.array(columns))
+
+    def _add(self, name, array):
+        buf = StringIO()
+        np.lib.format.write_array(buf, np.ascontiguousarray(array))
+        self.zipFile.writestr(name + '.npy', buf.getvalue())
+
+    def write(self, chunk):
+        number = len(self.rows)
+        for name, column in chunk.iteritems():
+            entry = '%s.%d' % (name, number)
+            if column.dtype.kind == 'O':
+                lengths = np.fromiter((len(value) for value in column),
+                                      dtype=np.int64, count=len(column))
+                offsets = np.zeros(len(column) + 1, dtype=np.int64)
+                np.cumsum(lengths, out=offsets[1:])
+                self._add(entry + '.data',
+                          np.frombuffer(''.join(column.tolist()),
+                                        dtype=np.uint8))
+                self._add(entry + '.offsets', offsets)
+            else:
+                self._add(entry, column)
+        self.rows.append(len(chunk.values()[0]))
+
+    def close(self):
+        self._add(_NPZ_ROWS, np.array(self.rows, dtype=np.int64))
+        self.zipFile.close()
+
+
+class _ParquetWriter(object):
+    # One row group per chunk
+
+    def __init__(self, fileName, columns):
+        self.pa, self.pq = importPyarrow()
+        self.fileName = fileName
+        self.columns = columns
+        self.writer = None
+
+    def write(self, chunk):
+        if not len(chunk.values()[0]):
+            # Nothing to infer the column types from
+            return
+        table = self.pa.Table.from_arrays(
+            [self.pa.array(column.tolist() if column.dtype.kind == 'O'
+                           else column) for column in chunk.values()],
+            names=list(chunk.keys()))
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.fileName, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is None:
+            self.pq.write_table(self.pa.Table.from_arrays(
+                [self.pa.array([]) for _ in self.columns],
+                names=list(self.columns)), self.fileName)
+        else:
+            self.writer.close()
+
+
+WRITERS = {'csv': _CSVWriter, 'npz': _NPZWriter, 'parquet': _ParquetWriter}
+
+
+def writeTable(fileName, columns, chunks):
+    # Writes the chunks, each an OrderedDict of the given columns, as one
+    # table and returns its number of rows. The table is written to a
+    # temporary file renamed into place, so readers never see half of it.
+    writerClass = WRITERS[fileFormat(fileName)]
+    columns = list(columns)
+    tmpName = "%s.tmp%d" % (fileName, os.getpid())
+    writer = writerClass(tmpName, columns)
+    rows = 0
+    try:
+        try:
+            for chunk in chunks:
+                if list(chunk.keys()) != columns:
+                    raise ValueError("chunk columns %s, expected %s"
+                                     % (list(chunk.keys()), columns))
+                writer.write(chunk)
+                rows += len(chunk.values()[0])
+        finally:
+            writer.close()
+    except BaseException:
+        os.remove(tmpName)
+        raise
+    os.rename(tmpName, fileName)
+    return rows
+
+
+def messageChunks(store, chunkRows=CHUNK_ROWS):
+    # timestamp (epoch seconds of the chat's local clock), member, text
+    # of every message of a MessageStore, in store order
+    members = _strings(store.members)
+    for low in range(0, len(store), chunkRows):
+        high = min(low + chunkRows, len(store))
+        offsets = store.textOffsets[low:high + 1]
+        textBuffer = store.textBuffer[offsets[0]:offsets[-1]].tostring()
+        offsets = (offsets - offsets[0]).tolist()
+        yield OrderedDict((
+            ('timestamp', store.timestamps[low:high].astype(np.int64)),
+            ('member', members[store.userCodes[low:high]]),
+            ('text', _strings([textBuffer[offsets[i]:offsets[i + 1]]
+                               for i in range(high - low)]))))
+
+
+def activityChunks(cube, members, chunkRows=CHUNK_ROWS):
+    # member, year, month, day, hour, count of every nonzero cell of an
+    # ActivityCube whose member codes index members. The cube is searched
+    # a member and year at a time, so at most about chunkRows cells are
+    # held besides it.
+    columns = ('member', 'year', 'month', 'day', 'hour', 'count')
+    members = _strings(members)
+    buffered = []
+    bufferedRows = 0
+    for code in range(cube.counts.shape[0]):
+        for yearIndex, year in enumerate(cube.years.tolist()):
+            cells = cube.counts[code, yearIndex]
+            months, days, hours = np.nonzero(cells)
+            if not len(months):
+                continue
+            rows = len(months)
+            buffered.append([
+                members[np.repeat(code, rows)],
+                np.repeat(np.int64(year), rows),
+                months.astype(np.int64) + 1,
+                days.astype(np.int64) + 1,
+                hours.astype(np.int64),
+                cells[months, days, hours].astype(np.int64)])
+            bufferedRows += rows
+            if bufferedRows >= chunkRows:
+                yield _joinBlocks(columns, buffered)
+                buffered = []
+                bufferedRows = 0
+    if buffered:
+        yield _joinBlocks(columns, buffered)
+
+
+def _blocks(value, path):
+    # (keys along the way, value columns) runs of rows of a nested query
+    # result: dict keys and list positions are keys, a list of numbers is
+    # a run with its positions as the last key, a tuple is a row of
+    # several values, None (no answer, e.g. a year outside the chat) no
+    # row at all and anything else a row of one
+    if value is None:
+        return
+    if isinstance(value, dict):
+        for key in sorted(value):
+            for block in _blocks(value[key], path + (key,)):
+                yield block
+    elif isinstance(value, list):
+        if value and all(isinstance(item, (int, long, float, np.number))
+                         and not isinstance(item, bool) for item in value):
+            yield (path + (np.arange(len(value)),), (_column(value),))
+        else:
+            for position, item in enumerate(value):
+                for block in _blocks(item, path + (position,)):
+                    yield block
+    elif isinstance(value, tuple):
+        yield path, tuple(_column([item]) for item in value)
+    else:
+        yield path, (_column([value]),)
+
+
+def resultColumns(result):
+    # Generated column names of result's table when it has none in
+    # QUERY_COLUMNS: key0, key1, ... then value (or value0, value1, ...)
+    for keys, values in _blocks(result, ()):
+        names = ['key%d' % level for level in range(len(keys))]
+        if len(values) == 1:
+            return tuple(names + ['value'])
+        return tuple(names + ['value%d' % i for i in range(len(values))])
+    return ('value',)
+
+
+def resultChunks(result, columns, chunkRows=CHUNK_ROWS):
+    # Chunks of the table of a (JSON-like, nested) WAChat query result
+    buffered = []
+    bufferedRows = 0
+    for keys, values in _blocks(result, ()):
+        if len(keys) + len(values) != len(columns):
+            raise ValueError("result does not fit columns %s"
+                             % ', '.join(columns))
+        rows = len(values[0])
+        buffered.append(
+            [key if isinstance(key, np.ndarray)
+             else _column([key] * rows) for key in keys] + list(values))
+        bufferedRows += rows
+        if bufferedRows >= chunkRows:
+            yield _joinBlocks(columns, buffered)
+            buffered = []
+            bufferedRows = 0
+    if buffered:
+        yield _joinBlocks(columns, buffered)
+
+
+def _joinBlocks(columns, blocks):
+    return OrderedDict((name, _joinColumn([block[i] for block in blocks]))
+                       for i, name in enumerate(columns))
+
+
+def _joinColumn(parts):
+    # Concatenation of column parts, as text if they are of mixed kinds
+    kinds = set(part.dtype.kind for part in parts)
+    if len(kinds) > 1 and 'O' in kinds:
+        parts = [part if part.dtype.kind == 'O'
+                 else _strings([str(value) for value in part.tolist()])
+                 for part in parts]
+    return np.concatenate(parts)
+
+
+def writeMessages(store, fileName, chunkRows=CHUNK_ROWS):
+    return writeTable(fileName, ('timestamp', 'member', 'text'),
+                      messageChunks(store, chunkRows))
+
+
+def writeActivity(cube, members, fileName, chunkRows=CHUNK_ROWS):
+    return writeTable(fileName, ('member', 'year', 'month', 'day', 'hour',
+                                 'count'),
+                      activityChunks(cube, members, chunkRows))
+
+
+def writeResult(result, fileName, columns=None, chunkRows=CHUNK_ROWS):
+    # Writes a query result as a table, with columns named after the
+    # query in QUERY_COLUMNS or else by resultColumns
+    if columns is None:
+        columns = resultColumns(result)
+    return writeTable(fileName, columns,
+                      resultChunks(result, columns, chunkRows))
+
+
+def _csvColumn(values):
+    # int64 or float64 array of CSV fields if they all read back as the
+    # same text, object array of them otherwise
+    for dtype in (np.int64, np.float64):
+        try:
+            column = np.array(values, dtype=dtype)
+        except (ValueError, OverflowError):
+            continue
+        if [repr(value) for value in column.tolist()] == values:
+            return column
+    return _strings(values)
+
+
+def _readCSV(fileName, chunkRows):
+    with open(fileName, 'rb') as infile:
+        reader = csv.reader(infile)
+        columns = next(reader)
+        while True:
+            rows = [row for _, row in zip(range(chunkRows), reader)]
+            if not rows:
+                return
+            yield OrderedDict((name, _csvColumn(list(values)))
+                              for name, values in zip(columns, zip(*rows)))
+
+
+def _readNPZ(fileName):
+    data = np.load(fileName)
+    try:
+        columns = data[_NPZ_COLUMNS].tolist()
+        for number, rows in enumerate(data[_NPZ_ROWS].tolist()):
+            chunk = OrderedDict()
+            for name in columns:
+                entry = '%s.%d' % (name, number)
+                if entry in data:
+                    chunk[name] = data[entry]
+                    continue
+                textBuffer = data[entry + '.data'].tostring()
+                offsets = data[entry + '.offsets'].tolist()
+                chunk[name] = _strings([textBuffer[offsets[i]:offsets[i + 1]]
+                                        for i in range(rows)])
+            yield chunk
+    finally:
+        data.close()
+
+
+def _readParquet(fileName):
+    pq = importPyarrow()[1]
+    parquetFile = pq.ParquetFile(fileName)
+    for group in range(parquetFile.num_row_groups):
+        table = parquetFile.read_row_group(group)
+        chunk = OrderedDict()
+        for name in table.schema.names:
+            values = table.column(name).to_pylist()
+            column = np.array(values)
+            chunk[name] = (column if column.dtype.kind in 'if'
+                           else _strings(values))
+        yield chunk
+
+
+def readChunks(fileName, chunkRows=CHUNK_ROWS):
+    # The chunks of a table written by writeTable (or any CSV with a
+    # header row). .npz and .parquet chunks are the ones written; CSV is
+    # read chunkRows rows at a time, a column being numeric in a chunk
+    # when all its fields there are numbers written the way repr writes
+    # them.
+    kind = fileFormat(fileName)
+    if kind == 'csv':
+        return _readCSV(fileName, chunkRows)
+    if kind == 'npz':
+        return _readNPZ(fileName)
+    return _readParquet(fileName)
+
+
+def loadTable(fileName):
+    # OrderedDict of the whole columns of a table
+    chunks = list(readChunks(fileName))
+    if not chunks:
+        if fileFormat(fileName) == 'csv':
+            with open(fileName, 'rb') as infile:
+                columns = next(csv.reader(infile), [])
+        elif fileFormat(fileName) == 'npz':
+            with np.load(fileName) as data:
+                columns = data[_NPZ_COLUMNS].tolist()
+        else:
+            columns = importPyarrow()[1].read_schema(fileName).names
+        return OrderedDict((name, np.zeros(0, dtype=object))
+                           for name in columns)
+    return OrderedDict((name, _joinColumn([chunk[name] for chunk in chunks]))
+                       for name in chunks[0])
@@ -0,0 +1,15 @@
+import re
+
+
+def uniqueFileName(name, usedNames):
+    # name made safe as a file name (runs of anything but letters, digits,
+    # '.', '-' and '_' become '_') and unique among usedNames with a -2,
+    # -3, ... suffix. The result is added to usedNames.
+    fileName = re.sub(r'[^\w.-]+', '_', name) or '_'
+    candidate = fileName
+    suffix = 1
+    while candidate in usedNames:
+        suffix += 1
+        candidate = '%s-%d' % (fileName, suffix)
+    usedNames.add(candidate)
+    return candidate
@@ -0,0 +1,177 @@
+from collections import defaultdict
+from array import array
+import re
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Texts never contain a newline (the export is read line by line), so it
+# separates messages in the lowered buffer without creating false matches
+MESSAGE_SEPARATOR = '\n'
+
+
+def _int64(values):
+    # int64 array of an array('l')
+    if not values:
+        return np.zeros(0, dtype=np.int64)
+    return np.frombuffer(values, dtype=np.int_).astype(np.int64, copy=False)
+
+
+def _triePattern(keywords):
+    # Regex matching the longest of keywords starting at a position, with
+    # the alternatives factored into a trie so that a position is checked
+    # one character at a time instead of once per keyword
+    root = dict()
+    for keyword in keywords:
+        node = root
+        for char in keyword:
+            node = node.setdefault(char, dict())
+        node[''] = None
+
+    def pattern(node):
+        branches = [re.escape(char) + pattern(child)
+                    for char, child in sorted(node.iteritems()) if char]
+        if not branches:
+            return ''
+        body = (branches[0] if len(branches) == 1
+                else '(?:%s)' % '|'.join(branches))
+        # Greedy, so longer keywords win over their prefixes
+        return '(?:%s)?' % body if '' in node else body
+    return pattern(root)
+
+
+class KeywordIndex(object):
+    # Lowercase keyword lookups over a MessageStore, answering with the
+    # sorted ids of the messages that contain a keyword.
+    #   substring mode: same as "keyword in text.lower()", i.e. the
+    #       semantics of the old per-message count(); scans one lowered
+    #       copy of every text instead of lowering each message per query
+    #   token mode: whole words, from an inverted term -> message ids index
+    # Both are built on first use and results are kept per keyword.
+
+    def __init__(self, store):
+        self.store = store
+        self.version = store.version
+        self._lowerText = None
+        self._starts = None
+        self._terms = None
+        self._substringCache = dict()
+
+    def lowerText(self):
+        # Every text lowered, joined by MESSAGE_SEPARATOR; message i starts
+        # at self._starts[i]
+        if self._lowerText is None:
+            store = self.store
+            if store.profiler is not None:
+                store.profiler.scan('lowerText', len(store))
+            separators = store.textOffsets[1:-1]
+            joined = np.insert(np.asarray(store.textBuffer), separators,
+                               ord(MESSAGE_SEPARATOR))
+            self._lowerText = joined.tostring().lower()
+            self._starts = store.textOffsets[:-1] + np.arange(len(store))
+        return self._lowerText
+
+    def substringMessages(self, keyword):
+        keyword = keyword.lower()
+        messages = self._substringCache.get(keyword)
+        if messages is None:
+            lowerText = self.lowerText()
+            if not keyword or MESSAGE_SEPARATOR in keyword:
+                messages = np.zeros(0, dtype=np.int64)
+            else:
+                if self.store.profiler is not None:
+                    self.store.profiler.scan('substring', len(self.store))
+                positions = np.fromiter(
+                    (match.start() for match
+                     in re.finditer(re.escape(keyword), lowerText)),
+                    dtype=np.int64)
+                messages = np.unique(np.searchsorted(self._starts, positions,
+                                                     side='right') - 1)
+            self._substringCache[keyword] = messages
+        return messages
+
+    def substringMessagesMany(self, keywords):
+        # {keyword: substringMessages(keyword)}, the keywords not answered
+        # yet found in one pass over lowerText(): a lookahead on a trie of
+        # them yields the longest keyword at every position, which implies
+        # its prefixes among the keywords, and one searchsorted maps all
+        # the positions to messages
+        lowered = dict((keyword, keyword.lower()) for keyword in keywords)
+        missing = sorted(set(keyword for keyword in lowered.itervalues()
+                             if keyword not in self._substringCache and
+                             keyword and MESSAGE_SEPARATOR not in keyword))
+        if len(missing) > 1:
+            lowerText = self.lowerText()
+            if self.store.profiler is not None:
+                self.store.profiler.scan('substring', len(self.store))
+            ids = dict((keyword, i) for i, keyword in enumerate(missing))
+            starts = array('l')
+            longest = array('l')
+            finditer = re.compile('(?=(%s))'
+                                  % _triePattern(missing)).finditer
+            for match in finditer(lowerText):
+                starts.append(match.start())
+                longest.append(ids[match.group(1)])
+            # Every match also stands for the keywords that are prefixes
+            # of the one matched (itself included), listed back to back
+            implied = [[ids[keyword[:end]]
+                        for end in range(1, len(keyword) + 1)
+                        if keyword[:end] in ids] for keyword in missing]
+            impliedCounts = np.array([len(prefixes) for prefixes in implied],
+                                     dtype=np.int64)
+            impliedStarts = np.cumsum(impliedCounts) - impliedCounts
+            impliedIds = np.array(sum(implied, []), dtype=np.int64)
+            longest = _int64(longest)
+            counts = impliedCounts[longest]
+            firsts = np.repeat(np.cumsum(counts) - counts, counts)
+            keywordIds = impliedIds[np.repeat(impliedStarts[longest], counts)
+                                    + np.arange(len(firsts)) - firsts]
+            messages = np.repeat(
+                np.searchsorted(self._starts, _int64(starts),
+                                side='right') - 1, counts)
+            # Distinct keyword id * number of messages + message id values,
+            # sorted by keyword and then message
+            size = len(self.store)
+            keys = np.unique(keywordIds * size + messages)
+            bounds = np.searchsorted(keys,
+                                     np.arange(len(missing) + 1) * size)
+            for i, keyword in enumerate(missing):
+                self._substringCache[keyword] = (
+                    keys[bounds[i]:bounds[i + 1]] - i * size)
+        return dict((keyword, self.substringMessages(keyword))
+                    for keyword in keywords)
+
+    def _buildTerms(self):
+        if self.store.profiler is not None:
+            self.store.profiler.scan('terms', len(self.store))
+        postings = defaultdict(lambda: array('l'))
+        findall = TOKEN_PATTERN.findall
+        for i, text in enumerate(self.lowerText().split(MESSAGE_SEPARATOR)):
+            for term in set(findall(text)):
+                postings[term].append(i)
+        self._terms = dict((term, np.array(ids, dtype=np.int64))
+                           for term, ids in postings.iteritems())
+
+    def termMessages(self, keyword):
+        # Messages containing every word of keyword
+        if self._terms is None:
+            self._buildTerms()
+        messages = None
+        for term in set(TOKEN_PATTERN.findall(keyword.lower())):
+            ids = self._terms.get(term, np.zeros(0, dtype=np.int64))
+            messages = (ids if messages is None
+                        else np.intersect1d(messages, ids,
+                                            assume_unique=True))
+        if messages is None:
+            return np.zeros(0, dtype=np.int64)
+        return messages
+
+    def messages(self, keyword, substring=True):
+        if substring:
+            return self.substringMessages(keyword)
+        return self.termMessages(keyword)
+
+    def terms(self):
+        # The full term -> message ids index
+        if self._terms is None:
+            self._buildTerms()
+        return self._terms
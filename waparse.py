@@ -0,0 +1,477 @@
+from datetime import datetime, date
+from itertools import compress, islice
+from multiprocessing import Pool
+from operator import add
+import calendar
+import codecs
+import os
+import time
+import unicodedata
+import re
+from timeit import default_timer as clock
+from waprofile import Profiler, stage
+from wastore import MessageStoreBuilder, dateToTimestamp, SECONDS_PER_HOUR
+
+WADateFormat = '%m/%d/%y, %I:%M:%S %p'
+DATE_PATTERN = re.compile("([0-9]+)/([0-9]+)/([0-9]+)")
+SEPARATOR = ": "
+# Upper bound on the bytes a worker holds at once in parallel parsing
+CHUNK_BYTES = 32 * 1024 * 1024
+NON_ASCII = re.compile('[\x80-\xff]')
+# str.translate deleting these leaves the non-ASCII bytes, which is a
+# faster test on a large string than searching NON_ASCII
+ASCII = ''.join(chr(code) for code in range(128))
+# A message line of a block of the export, matched as parseLine reads it:
+# the prefix up to the first ': ' (split into '3/20/16, 9' and '05:12 PM'
+# when it is in the WADateFormat layout, whole otherwise), the
+# user up to the next ': ' and a text that is not blank, without the
+# whitespace the line ends with
+MESSAGE_PATTERN = re.compile(r'^(?:\xef\xbb\xbf)?'
+                             r'(?:([0-9][0-9]?/[0-9][0-9]?/[0-9][0-9], '
+                             r'[0-9][0-9]?):([0-9][0-9]:[0-9][0-9] [AP]M)|'
+                             r'([0-9][^\n]*?))'
+                             r': ([^\n]*?): ([^\n]*\S)[ \t\r\x0b\x0c]*$',
+                             re.M)
+# Bytes parseFile reads and parses at a time, and lines parseInto joins
+BLOCK_BYTES = 4 * 1024 * 1024
+BLOCK_LINES = 65536
+# Bytes partialLine reads at a time, going back from the end
+TAIL_BLOCK_BYTES = 4096
+# Raw user names a Normalizer remembers before starting over
+MAX_CACHED_USERS = 65536
+
+
+def _smallInt(field, low, high):
+    # int(field) when field is a 1-2 digit number in [low, high], else None
+    if 0 < len(field) <= 2 and field.isdigit():
+        value = int(field)
+        if low <= value <= high:
+            return value
+    return None
+
+
+def _cachedMap(cache, keys, decode):
+    # [cache.get(key) for key in keys], first adding to the cache what
+    # decode() makes of the keys it is missing (unless that is None)
+    values = map(cache.get, keys)
+    if None in values and decode is not None:
+        for key in set(keys).difference(cache):
+            value = decode(key)
+            if value is not None:
+                cache[key] = value
+        values = map(cache.get, keys)
+    return values
+
+
+class TimestampDecoder(object):
+    # Decodes the WADateFormat prefix ('3/20/16, 9:05:12 PM') straight to
+    # epoch seconds. The date and the time of day are memoized separately
+    # (thousands of lines share a day, there are only 86400 clock values);
+    # anything it does not recognise is left to datetime.strptime by
+    # returning None.
+
+    def __init__(self):
+        self.dayCache = dict()
+        self.clockCache = dict()
+        # decodeMany's caches of the prefix parts
+        self.hourCache = dict()
+        self.minuteCache = dict()
+        self.fallbacks = 0
+
+    def _decodeDay(self, datePart):
+        fields = datePart.split('/')
+        if len(fields) != 3 or len(fields[2]) != 2:
+            return None
+        month = _smallInt(fields[0], 1, 12)
+        day = _smallInt(fields[1], 1, 31)
+        year = _smallInt(fields[2], 0, 99)
+        if month is None or day is None or year is None:
+            return None
+        # Same pivot as strptime's %y
+        year += 1900 if year >= 69 else 2000
+        try:
+            date(year, month, day)
+        except ValueError:
+            return None
+        return calendar.timegm((year, month, day, 0, 0, 0, 0, 0, 0))
+
+    def _decodeClock(self, clockPart):
+        # '9:05:12 PM' -> seconds since midnight
+        fields = clockPart.split(' ')
+        if len(fields) != 2:
+            return None
+        clock, meridiem = fields
+        meridiem = meridiem.upper()
+        if meridiem != 'AM' and meridiem != 'PM':
+            return None
+        clock = clock.split(':')
+        if len(clock) != 3:
+            return None
+        hour = _smallInt(clock[0], 1, 12)
+        minute = _smallInt(clock[1], 0, 59)
+        second = _smallInt(clock[2], 0, 59)
+        if hour is None or minute is None or second is None:
+            return None
+        hour %= 12
+        if meridiem == 'PM':
+            hour += 12
+        return hour * SECONDS_PER_HOUR + minute * 60 + second
+
+    def decode(self, prefix):
+        comma = prefix.find(', ')
+        if comma < 0:
+            return None
+        datePart = prefix[:comma]
+        dayStart = self.dayCache.get(datePart)
+        if dayStart is None:
+            dayStart = self._decodeDay(datePart)
+            if dayStart is None:
+                return None
+            self.dayCache[datePart] = dayStart
+        clockPart = prefix[comma + 2:]
+        secondOfDay = self.clockCache.get(clockPart)
+        if secondOfDay is None:
+            secondOfDay = self._decodeClock(clockPart)
+            if secondOfDay is None:
+                return None
+            self.clockCache[clockPart] = secondOfDay
+        return dayStart + secondOfDay
+
+    def _decodeHour(self, hourPart):
+        # '3/20/16, 9' -> epoch seconds of 9 AM that day
+        datePart, _, hour = hourPart.partition(', ')
+        dayStart = self.dayCache.get(datePart)
+        if dayStart is None:
+            dayStart = self._decodeDay(datePart)
+            if dayStart is None:
+                return None
+            self.dayCache[datePart] = dayStart
+        hour = _smallInt(hour, 1, 12)
+        if hour is None:
+            return None
+        return dayStart + hour % 12 * SECONDS_PER_HOUR
+
+    def _decodeMinute(self, minutePart):
+        # '05:12 PM' -> seconds from 12 AM to 12:05:12 PM
+        clock, _, meridiem = minutePart.partition(' ')
+        minute, _, second = clock.partition(':')
+        minute = _smallInt(minute, 0, 59)
+        second = _smallInt(second, 0, 59)
+        if minute is None or second is None:
+            return None
+        return ((12 * SECONDS_PER_HOUR if meridiem == 'PM' else 0) +
+                minute * 60 + second)
+
+    def decodeMany(self, hourParts, minuteParts):
+        # decode() for the columns of many prefixes split the way
+        # MESSAGE_PATTERN does ('3/20/16, 9' and '05:12 PM'); the entries
+        # it does not recognise are None. Every distinct part is decoded
+        # once, the rest are dict lookups mapped over the columns.
+        hours = _cachedMap(self.hourCache, hourParts, self._decodeHour)
+        minutes = _cachedMap(self.minuteCache, minuteParts,
+                             self._decodeMinute)
+        if None in hours or None in minutes:
+            return [None if hour is None or minute is None else hour + minute
+                    for hour, minute in zip(hours, minutes)]
+        return map(add, hours, minutes)
+
+    def decodeOrParse(self, prefix):
+        timestamp = self.decode(prefix)
+        if timestamp is None:
+            self.fallbacks += 1
+            timestamp = dateToTimestamp(datetime.strptime(prefix,
+                                                          WADateFormat))
+        return timestamp
+
+
+class Normalizer(object):
+    # Turns the raw UTF-8 user and text fields of a line into what the
+    # store keeps. By default that is the NFKD decomposition stripped to
+    # ASCII, skipping the decode/normalize/encode round trip for fields
+    # that are ASCII already (which it leaves unchanged); keepUnicode=True
+    # keeps the fields as the export has them, UTF-8 encoded.
+    # User names are normalized once per distinct raw name and interned,
+    # so every message of a member shares one string.
+
+    def __init__(self, keepUnicode=False):
+        self.keepUnicode = keepUnicode
+        self.users = dict()
+
+    def user(self, raw):
+        user = self.users.get(raw)
+        if user is None:
+            if len(self.users) >= MAX_CACHED_USERS:
+                self.users.clear()
+            user = self.users[raw] = intern(self.text(raw))
+        return user
+
+    def text(self, raw):
+        if self.keepUnicode or NON_ASCII.search(raw) is None:
+            return raw
+        return (unicodedata.normalize('NFKD', unicode(raw, "utf-8"))
+                .encode("ascii", "ignore"))
+
+
+class ChatParser(object):
+    # Turns the lines of a WhatsApp export into (timestamp, user, text)
+    # records, keeping track of how fast it goes. parseLine reads a single
+    # line; parseInto, parseBlock and parseFile get the same records out
+    # of whole blocks of lines at once (_parseBlock). A
+    # waprofile.Profiler is told the time every stage took over each
+    # block and what happened to its lines.
+    # keepUnicode is passed on to the Normalizer of user names and texts.
+
+    def __init__(self, profiler=None, keepUnicode=False):
+        self.decoder = TimestampDecoder()
+        self.normalizer = Normalizer(keepUnicode)
+        self.profiler = profiler
+        self.linesRead = 0
+        self.bytesRead = 0
+        self.secondsSpent = 0.0
+
+    def parseLine(self, line):
+        # Returns (timestamp, user, text), or None for lines that are not
+        # messages (continuation lines, group events, ERROR users)
+        if line.startswith(codecs.BOM_UTF8):
+            line = line[len(codecs.BOM_UTF8):]
+        if not line[:1].isdigit():
+            return None
+        line = line.strip()
+        first = line.find(SEPARATOR)
+        if first < 0:
+            return None
+        second = line.find(SEPARATOR, first + len(SEPARATOR))
+        if second < 0:
+            return None
+        prefix = line[:first]
+        timestamp = self.decoder.decode(prefix)
+        if timestamp is None:
+            if not DATE_PATTERN.match(line):
+                return None
+            timestamp = self.decoder.decodeOrParse(prefix)
+        rawUser = line[first + len(SEPARATOR):second]
+        # Normalizer.user without the call for names seen before
+        user = self.normalizer.users.get(rawUser)
+        if user is None:
+            user = self.normalizer.user(rawUser)
+        if user == "ERROR":
+            return None
+        # Further ': ' inside the text are dropped, as "".join(split) did
+        text = self.normalizer.text(line[second + len(SEPARATOR):]
+                                    .replace(SEPARATOR, ""))
+        return timestamp, user, text
+
+    def parseInto(self, lines, builder):
+        # Lines are parsed BLOCK_LINES at a time, joined into a block for
+        # _parseBlock; the '\n' the join puts after a line ending in one
+        # only adds an empty line
+        started = time.time()
+        lines = iter(lines)
+        while True:
+            with stage(self.profiler, 'io'):
+                batch = list(islice(lines, BLOCK_LINES))
+            if not batch:
+                break
+            data = '\n'.join(batch)
+            self.linesRead += len(batch)
+            self.bytesRead += len(data) - len(batch) + 1
+            self._parseBlock(data, builder, len(batch))
+        self.secondsSpent += time.time() - started
+        return builder
+
+    def parseBlock(self, data, builder):
+        # parseInto for the lines of a string of whole lines, such as a
+        # block of the export file
+        started = time.time()
+        lines = data.count('\n') + (not data.endswith('\n'))
+        self.linesRead += lines
+        self.bytesRead += len(data)
+        self._parseBlock(data, builder, lines)
+        self.secondsSpent += time.time() - started
+        return builder
+
+    def _parseBlock(self, data, builder, lines):
+        # What parseLine does to every line of data, with the per-line
+        # work done by MESSAGE_PATTERN and by maps over cached dict lookups.
+        # Only timestamps, users and texts never seen before (and ERROR
+        # users) are handled one message at a time. data has that many
+        # lines, for the profiler's counters.
+        profiler = self.profiler
+        fallbacks = self.decoder.fallbacks
+        errors = kept = 0
+        with stage(profiler, 'prefix'):
+            matches = MESSAGE_PATTERN.findall(data)
+            if matches:
+                hourParts, minuteParts, prefixes, rawUsers, texts = zip(
+                    *matches)
+                timestamps = self.decoder.decodeMany(hourParts, minuteParts)
+        keep = None
+        if matches:
+            with stage(profiler, 'strptime'):
+                for i in _valueIndices(timestamps, None):
+                    prefix = prefixes[i]
+                    if hourParts[i]:
+                        prefix = '%s:%s' % (hourParts[i], minuteParts[i])
+                    elif not DATE_PATTERN.match(prefix):
+                        keep = keep or [True] * len(matches)
+                        keep[i] = False
+                        timestamps[i] = 0
+                        continue
+                    timestamps[i] = self.decoder.decodeOrParse(prefix)
+
+            with stage(profiler, 'normalize'):
+                normalizer = self.normalizer
+                users = _cachedMap(normalizer.users, rawUsers,
+                                   normalizer.user)
+                # Only None if the Normalizer started over meanwhile
+                for i in _valueIndices(users, None):
+                    users[i] = normalizer.user(rawUsers[i])
+                if "ERROR" in users:
+                    keep = keep or [True] * len(matches)
+                    for i in _valueIndices(users, "ERROR"):
+                        keep[i] = False
+                        errors += 1
+
+                # Further ': ' inside the texts are dropped, as
+                # "".join(split) did. NFKD cannot reorder or combine
+                # anything across the '\n' separating the texts, so they
+                # are normalized all at once.
+                joined = '\n'.join(texts).replace(SEPARATOR, "")
+                if (not normalizer.keepUnicode and
+                        joined.translate(None, ASCII)):
+                    joined = (unicodedata.normalize('NFKD',
+                                                    unicode(joined, "utf-8"))
+                              .encode("ascii", "ignore"))
+                texts = joined.split('\n')
+
+            with stage(profiler, 'append'):
+                if keep is not None:
+                    timestamps = list(compress(timestamps, keep))
+                    users = list(compress(users, keep))
+                    texts = list(compress(texts, keep))
+                builder.appendColumns(timestamps, users, texts)
+            kept = len(timestamps)
+        if profiler is not None:
+            profiler.count('linesRead', lines)
+            profiler.count('linesSkipped', lines - kept - errors)
+            profiler.count('errorUsersDropped', errors)
+            profiler.count('messagesKept', kept)
+            profiler.count('strptimeFallbacks',
+                           self.decoder.fallbacks - fallbacks)
+
+    def parseFile(self, fileName, builder, offset=0):
+        # offset skips that many bytes, used to pick up where an earlier
+        # parse of the same export stopped
+        with open(fileName, 'r') as infile:
+            infile.seek(offset)
+            while True:
+                with stage(self.profiler, 'io'):
+                    data = infile.read(BLOCK_BYTES)
+                    if data and not data.endswith('\n'):
+                        data += infile.readline()
+                if not data:
+                    return builder
+                self.parseBlock(data, builder)
+
+    def parseFileParallel(self, fileName, builder, workers,
+                          chunkBytes=CHUNK_BYTES):
+        # Same result as parseFile, with line aligned byte ranges of the
+        # file parsed in a pool of worker processes and appended to the
+        # builder in file order
+        started = time.time()
+        numberOfChunks = max(workers,
+                             os.path.getsize(fileName) // chunkBytes + 1)
+        profile = self.profiler is not None
+        keepUnicode = self.normalizer.keepUnicode
+        tasks = [(fileName, start, end, profile, keepUnicode)
+                 for start, end in chunkRanges(fileName, numberOfChunks)]
+        self.bytesRead += sum(task[2] - task[1] for task in tasks)
+        pool = Pool(workers)
+        try:
+            for (chunkBuilder, linesRead, fallbacks,
+                 profile) in pool.imap(_parseChunk, tasks):
+                builder.extend(chunkBuilder)
+                self.linesRead += linesRead
+                self.decoder.fallbacks += fallbacks
+                if profile is not None:
+                    # Stage times of the workers add up, so with several
+                    # workers they exceed the wall time of the parse
+                    self.profiler.merge(profile)
+        finally:
+            pool.close()
+            pool.join()
+        self.secondsSpent += time.time() - started
+        return builder
+
+    def linesPerSecond(self):
+        if not self.secondsSpent:
+            return 0.0
+        return self.linesRead / self.secondsSpent
+
+
+def _valueIndices(values, value):
+    # Indices of value in the list values, found by list.index
+    i = -1
+    try:
+        while True:
+            i = values.index(value, i + 1)
+            yield i
+    except ValueError:
+        return
+
+
+def chunkRanges(fileName, numberOfChunks):
+    # Splits the file into at most numberOfChunks (start, end) byte ranges
+    # that each begin at the start of a line
+    size = os.path.getsize(fileName)
+    boundaries = [0]
+    with open(fileName, 'rb') as infile:
+        for i in range(1, numberOfChunks):
+            split = size * i // numberOfChunks
+            if split == 0:
+                continue
+            # Looking from one byte earlier keeps a split that already
+            # sits on a line start where it is
+            infile.seek(split - 1)
+            infile.readline()
+            boundary = min(infile.tell(), size)
+            if boundary > boundaries[-1]:
+                boundaries.append(boundary)
+    if size > boundaries[-1]:
+        boundaries.append(size)
+    return zip(boundaries[:-1], boundaries[1:])
+
+
+def partialLine(fileName, end):
+    # The bytes of the file before end that follow its last '\n': the
+    # last line when the export does not end with a newline, or one still
+    # being written. '' when end is at the start of a line.
+    tail = ''
+    with open(fileName, 'rb') as infile:
+        while end > 0:
+            start = max(end - TAIL_BLOCK_BYTES, 0)
+            infile.seek(start)
+            block = infile.read(end - start)
+            newline = block.rfind('\n')
+            if newline >= 0:
+                return block[newline + 1:] + tail
+            tail = block + tail
+            end = start
+    return tail
+
+
+def _parseChunk(task):
+    # Pool worker: parses one byte range into its own builder, profiling
+    # it when the parent parser has a profiler
+    fileName, start, end, profile, keepUnicode = task
+    profiler = Profiler() if profile else None
+    started = clock()
+    with open(fileName, 'rb') as infile:
+        infile.seek(start)
+        data = infile.read(end - start)
+    if profiler is not None:
+        profiler.add('io', clock() - started)
+    parser = ChatParser(profiler, keepUnicode)
+    builder = parser.parseBlock(data, MessageStoreBuilder())
+    return (builder, parser.linesRead, parser.decoder.fallbacks,
+            profiler.stats() if profiler is not None else None)
@@ -0,0 +1,235 @@
+from multiprocessing import Pool
+import os
+import sys
+import numpy as np
+from wafiles import uniqueFileName
+
+# File format of the charts renderAll writes
+DEFAULT_FORMAT = 'png'
+
+
+def pyplot(headless=False):
+    # matplotlib.pyplot, imported on first use so that computing numbers
+    # never needs it. headless selects the Agg backend, as long as pyplot
+    # was not loaded with another one already.
+    if headless and 'matplotlib.pyplot' not in sys.modules:
+        import matplotlib
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def finish(plt, fig, outFile=None):
+    # Shows the figure, or with outFile saves it there and closes it
+    if outFile is None:
+        plt.show()
+    else:
+        fig.savefig(outFile, bbox_inches='tight')
+        plt.close(fig)
+
+
+def drawMembersSpokenLines(plt, members, dataRepresntIn="total",
+                           yAxisTitle='Number of messages',
+                           plotTitle='Number of messages sent by each member'):
+    # Bar chart of {member: number of messages}
+    peopleList = members.keys()
+    linesList = members.values()
+    sumlinesList = sum(linesList)
+    if dataRepresntIn == "p":
+        linesList = [float(i)/sumlinesList for i in linesList]
+    ind = np.arange(len(peopleList))
+    width = 0.75
+    fig, ax = plt.subplots()
+    rects1 = ax.bar(ind+width/2.0, linesList, width, color='r')
+    ax.set_ylabel(yAxisTitle)
+    ax.set_title(plotTitle)
+    ax.set_xticks(ind+width)
+    ax.set_xticklabels(peopleList, rotation="vertical")
+    axes = plt.gca()
+    axes.set_ylim([0, 1.1 * max(linesList)])
+
+    def autolabel(rects):
+        for rect in rects:
+            height = rect.get_height()
+            if dataRepresntIn == "p":
+                ax.text(rect.get_x()+rect.get_width()/2.,
+                        height + 0.01 * max(linesList), '%.1f%%'
+                        % (height * 100.0), ha='center', va='bottom')
+            else:
+                ax.text(rect.get_x()+rect.get_width()/2.,
+                        height + 0.01 * max(linesList), '%d' % int(height),
+                        ha='center', va='bottom')
+
+    autolabel(rects1)
+    plt.subplots_adjust(bottom=0.25)
+    return fig
+
+
+def drawOverHours(plt, toPlotData, plotTitle):
+    # Polar clock and histogram of the 24 hourly message counts
+    import matplotlib.ticker as ticker
+    import matplotlib.patches as mpatches
+    N = len(toPlotData)
+    theta = np.linspace(0.0, 2 * np.pi, N, endpoint=False)
+    avg = sum(toPlotData)/float(len(toPlotData))
+    radii = [x / avg for x in toPlotData]
+    width = [(2-0.75)*np.pi/float(N)]*N
+    fig = plt.figure(1, figsize=(8, 8), dpi=90)
+    # Polar Plot
+    ax = fig.add_subplot(211, polar=True)
+    bars = ax.bar(theta, radii, width=width, bottom=0)
+    ax.set_rmax(1.1 * max(radii))
+    # Set the major tick locations to create a clock
+    ax.xaxis.set_major_locator(ticker.MultipleLocator(np.pi/12))
+    # ax.yaxis.set_major_locator(ticker.MultipleLocator(0.5))
+    ax.set_xticklabels(['This does not get printed']+range(24))
+    ax.set_yticklabels([])
+
+    for i, r, bar in zip(range(N), radii, bars):
+        if i/12 == 0:
+            bar.set_facecolor("yellow")
+            bar.set_alpha(0.5)
+        else:
+            bar.set_facecolor("black")
+            bar.set_alpha(0.5)
+    ax.set_theta_zero_location("N")
+    ax.set_theta_direction(-1)
+    classes = ['AM', 'PM']
+    class_colours = ['yellow', 'gray']
+    recs = []
+    for i in range(0, len(class_colours)):
+        recs.append(mpatches.Rectangle((0, 0), 1, 1,
+                    fc=class_colours[i]))
+    plt.legend(recs, classes, bbox_to_anchor=(1.4, 1.15))
+
+    # Regular Histagram Plot on the side
+    ax = fig.add_subplot(212)
+
+    hourList = ['0-1', '1-2', '2-3', '3-4', '4-5', '5-6', '6-7', '7-8',
+                '8-9', '9-10', '10-11', '11-12', '12-13', '13-14',
+                '14-15', '15-16', '16-17', '17-18', '18-19', '19-20',
+                '20-21', '21-22', '22-23', '23-0']
+
+    ind = np.arange(len(hourList))
+    width = 0.85
+    rectsbars = ax.bar(ind+width/2.0, toPlotData, width)
+    for i, bar in zip(range(24), rectsbars):
+        if i/12 == 0:
+            bar.set_facecolor("yellow")
+            bar.set_alpha(0.5)
+        else:
+            bar.set_facecolor("black")
+            bar.set_alpha(0.5)
+    # ax.set_ylabel(yAxisTitle)
+    # ax.set_title(plotTitle)
+    ax.set_xticks(ind+width)
+    ax.set_xticklabels(hourList, rotation="vertical")
+    axes = plt.gca()
+    axes.set_ylim([0, 1.1 * max(toPlotData)])
+
+    def autolabel(rects, toPlotData):
+        for rect in rects:
+            height = rect.get_height()
+            ax.text(rect.get_x()+rect.get_width()/2.0,
+                    height + 0.02 * max(toPlotData),
+                    '%d' % int(height),
+                    ha='center', va='bottom')
+    autolabel(rectsbars, toPlotData)
+    plt.subplots_adjust(bottom=0.25)
+
+    fig.suptitle(plotTitle, fontsize=20, y=1)
+    return fig
+
+
+def overHoursTitle(memberName=None):
+    if memberName:
+        return "What hour does %s talk? [Seattle Time]" % memberName
+    return "What hour our group talk? [Seattle Time]"
+
+
+def drawYearOverMonths(plt, toPlotData, memberName):
+    # One line per year of {year: {month: number of messages}}
+    monthNames = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5,
+                  'Jun': 6, 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10,
+                  'Nov': 11, 'Dec': 12}
+    fig, ax = plt.subplots()
+    # One color per year; the cycle only applies to lines plotted after it
+    # is set (set_color_cycle is gone from matplotlib 2.0 on)
+    numColors = len(toPlotData)
+    cm = plt.get_cmap('gist_rainbow')
+    if numColors:
+        ax.set_prop_cycle(color=[cm(1. * i / numColors)
+                                 for i in range(numColors)])
+    for year in toPlotData:
+        monthList = toPlotData[year].keys()
+        monthValues = toPlotData[year].values()
+        ax.plot(np.array(monthList), np.array(monthValues), label=year,
+                linewidth=3)
+    plt.xticks(monthNames.values(), monthNames.keys(),
+               rotation='vertical', fontsize=18)
+    plt.yticks(fontsize=18)
+    ax.margins(0.1)
+    ax.grid(True, which='both', color='r', linestyle='--')
+    # plt.subplots_adjust(bottom=0.15)
+    plt.legend(bbox_to_anchor=(0.9, 1), loc=2, borderaxespad=0.)
+    plotTitle = "%s" % memberName
+    fig.suptitle(plotTitle, fontsize=20, y=1)
+    return fig
+
+
+DRAWERS = {'members': drawMembersSpokenLines,
+           'hours': drawOverHours,
+           'months': drawYearOverMonths}
+
+
+def renderChart(task):
+    # Pool worker (or plain call): draws one chart into its file
+    kind, args, outFile = task
+    plt = pyplot(headless=True)
+    finish(plt, DRAWERS[kind](plt, *args), outFile)
+    return outFile
+
+
+def chartTasks(chat, outDir, fileFormat=DEFAULT_FORMAT):
+    # (kind, drawer arguments, file) for every chart of the chat: the
+    # members bar chart, the group's and each member's hours, and each
+    # member's months over the years. The aggregates are computed once
+    # for all of them.
+    members = chat.getMembers()
+    hourly = chat.getMemberHourlyFrequencies()
+    monthly = chat.getMemberAllYearsOverMonthFrequencies()
+    usedNames = set()
+
+    def path(name):
+        return os.path.join(outDir, '%s.%s' % (uniqueFileName(name, usedNames),
+                                               fileFormat))
+
+    tasks = [('members', (members,), path('members'))]
+    groupHours = np.zeros(24, dtype=np.int64)
+    for memberCounts in hourly.values():
+        groupHours += np.array(memberCounts)
+    tasks.append(('hours', (groupHours.tolist(), overHoursTitle()),
+                  path('hours')))
+    for memberName in sorted(members):
+        tasks.append(('hours', (hourly[memberName],
+                                overHoursTitle(memberName)),
+                      path('hours_' + memberName)))
+        tasks.append(('months', (monthly[memberName], memberName),
+                      path('months_' + memberName)))
+    return tasks
+
+
+def renderAll(chat, outDir, workers=1, fileFormat=DEFAULT_FORMAT):
+    # Writes every chart of chartTasks to outDir, drawing them in a pool
+    # of workers processes when workers > 1. Returns the files written.
+    if not os.path.isdir(outDir):
+        os.makedirs(outDir)
+    tasks = chartTasks(chat, outDir, fileFormat)
+    if workers > 1:
+        pool = Pool(workers)
+        try:
+            return pool.map(renderChart, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return [renderChart(task) for task in tasks]
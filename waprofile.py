@@ -0,0 +1,153 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from timeit import default_timer as clock
+
+# Stages of reading an export, in the order a line goes through them
+PARSE_STAGES = ('io', 'prefix', 'strptime', 'normalize', 'append')
+
+
+class Profiler(object):
+    # Opt-in instrumentation shared by WAChat, its ChatParser and its
+    # MessageStore. Everything that reports to it checks for None first,
+    # so without a profiler the only cost is that check.
+    #   stages   wall seconds per stage ('io', 'prefix', 'strptime',
+    #            'normalize', 'append' while parsing, plus coarse ones such
+    #            as 'parse', 'build', 'snapshotLoad')
+    #   counters linesRead, linesSkipped (not a message line: continuation
+    #            lines, group events), errorUsersDropped, messagesKept,
+    #            strptimeFallbacks
+    #   queries  per query method: calls, inclusive seconds and the scans
+    #            over the store it triggered, by kind
+
+    def __init__(self):
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+        self.queries = dict()
+        self._queryStack = []
+
+    def add(self, stage, seconds):
+        self.stages[stage] += seconds
+
+    def count(self, counter, n=1):
+        self.counters[counter] += n
+
+    @contextmanager
+    def stage(self, name):
+        started = clock()
+        try:
+            yield
+        finally:
+            self.stages[name] += clock() - started
+
+    def _queryStats(self, name):
+        stats = self.queries.get(name)
+        if stats is None:
+            stats = self.queries[name] = {'calls': 0, 'seconds': 0.0,
+                                          'scans': defaultdict(int),
+                                          'messagesScanned': 0}
+        return stats
+
+    @contextmanager
+    def query(self, name):
+        # Times one call of a query method; scans reported while it runs
+        # are attributed to the innermost query
+        stats = self._queryStats(name)
+        stats['calls'] += 1
+        self._queryStack.append(name)
+        started = clock()
+        try:
+            yield
+        finally:
+            stats['seconds'] += clock() - started
+            self._queryStack.pop()
+
+    def scan(self, kind, messages):
+        # A pass of kind over `messages` entries of the store columns
+        name = self._queryStack[-1] if self._queryStack else '(load)'
+        stats = self._queryStats(name)
+        stats['scans'][kind] += 1
+        stats['messagesScanned'] += messages
+
+    def merge(self, stats):
+        # Adds the stats() of another profiler, e.g. of a parse worker
+        for stage, seconds in stats['stages'].iteritems():
+            self.stages[stage] += seconds
+        for counter, n in stats['counters'].iteritems():
+            self.counters[counter] += n
+        for name, other in stats['queries'].iteritems():
+            mine = self._queryStats(name)
+            mine['calls'] += other['calls']
+            mine['seconds'] += other['seconds']
+            mine['messagesScanned'] += other['messagesScanned']
+            for kind, n in other['scans'].iteritems():
+                mine['scans'][kind] += n
+
+    def reset(self):
+        self.__init__()
+
+    def stats(self):
+        # Plain dicts, ready for json.dump
+        return {'stages': dict(self.stages),
+                'counters': dict(self.counters),
+                'queries': dict((name, dict(stats, scans=dict(stats['scans'])))
+                                for name, stats in self.queries.iteritems())}
+
+    def report(self):
+        return formatReport(self.stats())
+
+
+def formatReport(stats):
+    # Human readable lines of Profiler.stats()
+    lines = ['stage                          seconds']
+    stages = stats['stages']
+    for stage in ([stage for stage in PARSE_STAGES if stage in stages] +
+                  sorted(stage for stage in stages
+                         if stage not in PARSE_STAGES)):
+        lines.append('  %-26s %10.3f' % (stage, stages[stage]))
+    lines.append('counter')
+    for counter, n in sorted(stats['counters'].items()):
+        lines.append('  %-26s %10d' % (counter, n))
+    lines.append('%-48s %8s %10s  %s'
+                 % ('query', 'calls', 'seconds', 'scans'))
+    for name, query in sorted(stats['queries'].items()):
+        scans = ', '.join('%s=%d' % item
+                          for item in sorted(query['scans'].items()))
+        lines.append('  %-46s %8d %10.3f  %s'
+                     % (name, query['calls'], query['seconds'],
+                        scans or '-'))
+    return lines
+
+
+class _NullStage(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excInfo):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+def stage(profiler, name):
+    # profiler.stage(name), or a context manager doing nothing without a
+    # profiler
+    if profiler is None:
+        return NULL_STAGE
+    return profiler.stage(name)
+
+
+def profiledQuery(method):
+    # Decorator for query methods of objects with a profiler attribute:
+    # calls are timed and counted under the method name when it is set
+    name = method.__name__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.profiler is None:
+            return method(self, *args, **kwargs)
+        with self.profiler.query(name):
+            return method(self, *args, **kwargs)
+    return wrapper
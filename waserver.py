@@ -0,0 +1,296 @@
+# Long running query service keeping parsed chats in memory:
+#
+#   python waserver.py exports/a.txt exports/b.txt --port 8765
+#   curl 'localhost:8765/chats'
+#   curl 'localhost:8765/chats/a/getMembers_givenYear_monthlyInfo?year=2016'
+#   curl 'localhost:8765/chats/a/getMemberDailyFrequencies?keyword=cat'
+#
+# Every request gets a JSON object back, with the query's result under
+# "result". Chats are reloaded (incrementally when possible) when their
+# export changes.
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from StringIO import StringIO
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+import urlparse
+from wabatch import QUERIES, isNumericParameter, queryValue
+from wachat import WAChat
+
+DEFAULT_PORT = 8765
+# Seconds between checks of the export files for changes; a change is
+# reloaded at the first check that finds it finished
+RELOAD_INTERVAL = 2.0
+
+
+class _ThreadStdout(object):
+    # Stands in for sys.stdout so that what a query prints (the notes of
+    # the breakdown methods) is collected for the thread running it
+    # instead of interleaving on the console
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        buf = getattr(self.local, 'buf', None)
+        (buf if buf is not None else self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def capture(self):
+        self.local.buf = StringIO()
+
+    def release(self):
+        buf, self.local.buf = self.local.buf, None
+        return buf.getvalue()
+
+
+class ResidentChat(object):
+    # A WAChat kept in memory, with a lock serializing what runs on it
+    # (WAChat's caches are not thread safe) and the state of its export
+    # file at the last (re)load
+
+    def __init__(self, name, fileName, chatOptions):
+        self.name = name
+        self.fileName = fileName
+        self.lock = threading.Lock()
+        self.fileState = self._fileState()
+        # A changed state of the export seen at the last check, waiting
+        # to stay the same for one more
+        self.changingState = None
+        self.chat = WAChat(fileName, **chatOptions)
+        self.loadedAt = time.time()
+        self.reloads = 0
+
+    def _fileState(self):
+        stat = os.stat(self.fileName)
+        return stat.st_size, stat.st_mtime
+
+    def refreshIfChanged(self):
+        # Returns refresh()'s (new messages, rebuilt) or None if the
+        # export did not change. A change is only picked up once size and
+        # mtime stayed the same from one check to the next, so an export
+        # still being written is not read halfway.
+        try:
+            fileState = self._fileState()
+        except OSError:
+            # Being replaced; look again next time
+            return None
+        if fileState == self.fileState:
+            self.changingState = None
+            return None
+        if fileState != self.changingState:
+            self.changingState = fileState
+            return None
+        self.changingState = None
+        with self.lock:
+            result = self.chat.refresh()
+            self.fileState = fileState
+            self.loadedAt = time.time()
+            self.reloads += 1
+        return result
+
+    def query(self, name, kwargs):
+        with self.lock:
+            return getattr(self.chat, name)(**kwargs)
+
+    def info(self):
+        return {'file': self.fileName,
+                'messages': len(self.chat.store),
+                'members': len(self.chat.store.members),
+                'loadedAt': self.loadedAt,
+                'reloads': self.reloads}
+
+
+class ChatRegistry(object):
+    # The chats a server answers for, by name, and the thread watching
+    # their exports
+
+    def __init__(self, chatOptions=None):
+        self.chatOptions = chatOptions or {}
+        self.chats = dict()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def add(self, fileName, name=None):
+        if name is None:
+            name = os.path.splitext(os.path.basename(fileName))[0]
+        if name in self.chats:
+            raise ValueError("two chats named %r" % name)
+        self.chats[name] = ResidentChat(name, fileName, self.chatOptions)
+        return name
+
+    def refreshChanged(self):
+        for chat in self.chats.values():
+            try:
+                result = chat.refreshIfChanged()
+            except Exception:
+                sys.stderr.write("reloading %s failed:\n%s"
+                                 % (chat.fileName, traceback.format_exc()))
+                continue
+            if result is not None:
+                sys.stderr.write("reloaded %s: %d new messages%s\n"
+                                 % (chat.name, result[0],
+                                    ' (full reload)' if result[1] else ''))
+
+    def watch(self, interval=RELOAD_INTERVAL):
+        def run():
+            while not self._stop.wait(interval):
+                self.refreshChanged()
+        self._watcher = threading.Thread(target=run, name='export-watcher')
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    # GET /chats                     -> {name: chat info}
+    # GET /chats/<name>              -> chat info
+    # GET /chats/<name>/<query>?k=v  -> result of the WAChat query called
+    #                                   with keyword arguments k=v (numbers
+    #                                   are converted for the parameters
+    #                                   wabatch.NUMERIC_PARAMETER matches,
+    #                                   a|b is a list)
+
+    def _send(self, status, body):
+        data = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        registry = self.server.registry
+        url = urlparse.urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        if not parts or parts[0] != 'chats' or len(parts) > 3:
+            return self._send(404, {'error': 'no such resource'})
+        if len(parts) == 1:
+            return self._send(200, dict((name, chat.info()) for name, chat
+                                        in registry.chats.iteritems()))
+        chat = registry.chats.get(parts[1])
+        if chat is None:
+            return self._send(404, {'error': 'no chat %r' % parts[1]})
+        if len(parts) == 2:
+            return self._send(200, chat.info())
+        query = parts[2]
+        if query not in QUERIES:
+            return self._send(404, {'error': 'no query %r' % query,
+                                    'queries': QUERIES})
+        kwargs = dict((key, queryValue(value, isNumericParameter(key)))
+                      for key, value in urlparse.parse_qsl(url.query))
+        stdout = sys.stdout
+        capturing = isinstance(stdout, _ThreadStdout)
+        if capturing:
+            stdout.capture()
+        started = time.time()
+        try:
+            result = chat.query(query, kwargs)
+        except (TypeError, ValueError, KeyError) as error:
+            status, body = 400, {'error': '%s: %s' % (type(error).__name__,
+                                                      error)}
+        except Exception:
+            status, body = 500, {'error': traceback.format_exc()}
+        else:
+            status, body = 200, {'chat': chat.name, 'query': query,
+                                 'arguments': kwargs, 'result': result}
+        finally:
+            notes = stdout.release() if capturing else ''
+        body['notes'] = notes
+        body['seconds'] = time.time() - started
+        self._send(status, body)
+
+    def log_message(self, format, *args):
+        # Unix socket clients have no (host, port)
+        client = (self.client_address[0]
+                  if isinstance(self.client_address, tuple) else 'unix')
+        sys.stderr.write("%s - - [%s] %s\n"
+                         % (client, self.log_date_time_string(),
+                            format % args))
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        UnixStreamServer.server_bind(self)
+        # What BaseHTTPRequestHandler expects from an HTTPServer
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def makeServer(registry, host='127.0.0.1', port=DEFAULT_PORT,
+               socketPath=None):
+    # Threaded HTTP server answering for registry, on host:port or, with
+    # socketPath, on a Unix socket
+    if socketPath is not None:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server = ThreadingUnixHTTPServer(socketPath, QueryHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), QueryHandler)
+    server.registry = registry
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("fileNames", nargs="+", metavar="export")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", dest="socketPath", default=None,
+                        help="serve on this Unix socket instead of TCP")
+    parser.add_argument("--reload-interval", dest="reloadInterval",
+                        type=float, default=RELOAD_INTERVAL,
+                        help="seconds between checks for changed exports")
+    parser.add_argument("--cache-dir", dest="cacheDir", default=None,
+                        help="directory for parsed chat snapshots")
+    parser.add_argument("--keep-unicode", dest="keepUnicode",
+                        action="store_true")
+    args = parser.parse_args()
+
+    registry = ChatRegistry({'cacheDir': args.cacheDir,
+                             'keepUnicode': args.keepUnicode})
+    for fileName in args.fileNames:
+        started = time.time()
+        name = registry.add(fileName)
+        sys.stderr.write("loaded %s as %r in %.2fs\n"
+                         % (fileName, name, time.time() - started))
+    registry.watch(args.reloadInterval)
+    sys.stdout = _ThreadStdout(sys.stdout)
+    server = makeServer(registry, args.host, args.port, args.socketPath)
+    sys.stderr.write("serving %d chats on %s\n"
+                     % (len(registry.chats),
+                        args.socketPath or '%s:%d' % (args.host, args.port)))
+    # Shut down cleanly (removing the socket) on kill as well as Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        registry.stop()
+        server.server_close()
+        if args.socketPath is not None and os.path.exists(args.socketPath):
+            os.remove(args.socketPath)
+
+
+if __name__ == "__main__":
+    main()
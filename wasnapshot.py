@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from wastore import MessageStore
+
+# Bump whenever the on-disk layout or the parsing rules change, so old
+# snapshots are rebuilt instead of silently reused. 2: the header's extra
+# holds WAChat's ingest state and the activity cube is saved with the
+# derived arrays. 3: the cube only has the years with messages.
+SNAPSHOT_VERSION = 3
+HEADER_NAME = 'header.json'
+COLUMNS = ('timestamps', 'userCodes', 'textBuffer', 'textOffsets')
+HASH_BLOCK_BYTES = 1024 * 1024
+
+
+def fileDigest(fileName, length=None, start=0, digest=None):
+    # hashlib SHA-1 object fed with length bytes of the file from start
+    # (all the rest without length). digest continues a running hash,
+    # e.g. a copy() of the one of the bytes before start.
+    if digest is None:
+        digest = hashlib.sha1()
+    with open(fileName, 'rb') as infile:
+        infile.seek(start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            blockSize = (HASH_BLOCK_BYTES if remaining is None
+                         else min(remaining, HASH_BLOCK_BYTES))
+            block = infile.read(blockSize)
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest
+
+
+def fileHash(fileName, length=None):
+    # SHA-1 of the file, or of its first length bytes
+    return fileDigest(fileName, length).hexdigest()
+
+
+def sourceKey(fileName):
+    # What a snapshot remembers about the export it was built from
+    info = os.stat(fileName)
+    return {'path': os.path.abspath(fileName),
+            'size': info.st_size,
+            'mtime': info.st_mtime}
+
+
+def snapshotPath(fileName, cacheDir):
+    # One snapshot directory per source path inside cacheDir
+    pathHash = hashlib.sha1(os.path.abspath(fileName)).hexdigest()[:16]
+    return os.path.join(cacheDir,
+                        "%s-%s" % (os.path.basename(fileName), pathHash))
+
+
+def readHeader(path):
+    try:
+        with open(os.path.join(path, HEADER_NAME)) as infile:
+            return json.load(infile)
+    except (IOError, ValueError):
+        return None
+
+
+def writeHeader(path, header):
+    tmpName = os.path.join(path, "%s.tmp%d" % (HEADER_NAME, os.getpid()))
+    with open(tmpName, 'w') as outfile:
+        json.dump(header, outfile)
+    os.rename(tmpName, os.path.join(path, HEADER_NAME))
+
+
+def revalidate(path, header, fileName):
+    # isValid for the snapshot at path; when only the content hash
+    # matched, the new mtime is written to its header so the next load
+    # does not hash the export again
+    if not isValid(header, fileName):
+        return False
+    mtime = os.stat(fileName).st_mtime
+    if header['mtime'] != mtime:
+        header['mtime'] = mtime
+        try:
+            writeHeader(path, header)
+        except (IOError, OSError):
+            pass
+    return True
+
+
+def isValid(header, fileName):
+    # Size and path must match; a changed mtime is forgiven when the
+    # content hash still matches (e.g. the file was copied or touched)
+    if header is None or header.get('version') != SNAPSHOT_VERSION:
+        return False
+    key = sourceKey(fileName)
+    if header['path'] != key['path'] or header['size'] != key['size']:
+        return False
+    if header['mtime'] == key['mtime']:
+        return True
+    return header['hash'] == fileHash(fileName)
+
+
+def saveSnapshot(store, fileName, cacheDir, extra=None, knownHash=None):
+    # Writes the store columns and derived arrays as .npy files next to a
+    # small JSON header. The snapshot is assembled in a temporary
+    # directory and renamed into place so readers never see half of it.
+    # knownHash is an optional (length, SHA-1) of the first length bytes
+    # of the export, saving a pass over it when that is all of it.
+    if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+    path = snapshotPath(fileName, cacheDir)
+    tmpPath = "%s.tmp%d" % (path, os.getpid())
+    if os.path.exists(tmpPath):
+        shutil.rmtree(tmpPath)
+    os.makedirs(tmpPath)
+    arrays = dict((name, getattr(store, name)) for name in COLUMNS)
+    derived = store.derivedArrays()
+    arrays.update(derived)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmpPath, name + '.npy'), values)
+    header = sourceKey(fileName)
+    if knownHash is not None and knownHash[0] == header['size']:
+        contentHash = knownHash[1]
+    else:
+        contentHash = fileHash(fileName)
+    header.update({'version': SNAPSHOT_VERSION,
+                   'hash': contentHash,
+                   'members': [name.decode('utf-8') for name in store.members],
+                   'derived': sorted(derived),
+                   'extra': extra or {}})
+    writeHeader(tmpPath, header)
+    # Another process sharing cacheDir may be saving the same export at
+    # the same time. The old snapshot is moved aside first so that only
+    # the rename into place can collide, and whoever loses that race
+    # drops its copy and keeps the winner's, which is just as good.
+    stalePath = None
+    if os.path.exists(path):
+        stalePath = "%s.old%d" % (path, os.getpid())
+        try:
+            os.rename(path, stalePath)
+        except OSError:
+            stalePath = None
+    try:
+        os.rename(tmpPath, path)
+    except OSError:
+        shutil.rmtree(tmpPath, ignore_errors=True)
+    if stalePath is not None:
+        shutil.rmtree(stalePath, ignore_errors=True)
+    return path
+
+
+def loadSnapshot(fileName, cacheDir, validate=True):
+    # (store, header) for the cached MessageStore of fileName with every
+    # array memory mapped read only, or None if there is no valid snapshot.
+    # validate=False also returns snapshots of an older version of the
+    # export, for callers that bring them up to date themselves.
+    path = snapshotPath(fileName, cacheDir)
+    header = readHeader(path)
+    if (header is None or header.get('version') != SNAPSHOT_VERSION or
+            header['path'] != os.path.abspath(fileName)):
+        return None
+    if validate and not revalidate(path, header, fileName):
+        return None
+
+    def load(name):
+        return np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+
+    columns = [load(name) for name in COLUMNS]
+    derived = dict((name, load(name)) for name in header['derived'])
+    members = [name.encode('utf-8') for name in header['members']]
+    return MessageStore(columns[0], columns[1], members, columns[2],
+                        columns[3], derived=derived), header
@@ -0,0 +1,483 @@
+from collections import namedtuple, Sequence
+from datetime import datetime, timedelta, MINYEAR, MAXYEAR
+from array import array
+import calendar
+import numpy as np
+from wacube import ActivityCube
+
+Message = namedtuple("Message", ["date", "user", "text"])
+
+EPOCH = datetime(1970, 1, 1)
+SECONDS_PER_DAY = 86400
+SECONDS_PER_HOUR = 3600
+FIELD_LIMITS = {'hour': (0, 23), 'day': (1, 31), 'month': (1, 12)}
+CALENDAR_FIELDS = ('year', 'month', 'day', 'hour')
+
+# array('l') is 64 bit on the platforms we run on; fall back to doubles
+# (exact for any realistic epoch second) where it is not.
+_TIMESTAMP_TYPECODE = 'l' if array('l').itemsize == 8 else 'd'
+
+
+def dateToTimestamp(date):
+    # Chat dates are naive local times of the downloader, so they are
+    # stored as seconds since 1970-01-01 of that same naive clock.
+    return calendar.timegm(date.timetuple())
+
+
+def timestampToDate(timestamp):
+    return EPOCH + timedelta(seconds=int(timestamp))
+
+
+def _timestamp(year, month=1, day=1, hour=0):
+    return calendar.timegm((year, month, day, hour, 0, 0, 0, 0, 0))
+
+
+def _frameSpan(fromHour, untilHour, fromDay, untilDay, fromMonth, untilMonth,
+               fromYear, untilYear):
+    # Splits an isMessageInFrame style frame into the contiguous time span
+    # [start, end) it is contained in and the per-field (name, low, high)
+    # filters still needed inside that span. Returns None for empty frames.
+    fromYear = max(fromYear, MINYEAR)
+    untilYear = min(untilYear, MAXYEAR - 1)
+    fromMonth = max(fromMonth, 1)
+    untilMonth = min(untilMonth, 12)
+    fromHour = max(fromHour, 0)
+    untilHour = min(untilHour, 23)
+    if fromYear > untilYear or fromMonth > untilMonth or fromHour > untilHour:
+        return None
+    start = _timestamp(fromYear)
+    end = _timestamp(untilYear + 1)
+    residual = [('month', fromMonth, untilMonth),
+                ('day', fromDay, untilDay),
+                ('hour', fromHour, untilHour)]
+    if fromYear == untilYear:
+        year = fromYear
+        start = _timestamp(year, fromMonth)
+        end = (_timestamp(year + 1) if untilMonth == 12
+               else _timestamp(year, untilMonth + 1))
+        residual.pop(0)
+        if fromMonth == untilMonth:
+            month = fromMonth
+            fromDay = max(fromDay, 1)
+            untilDay = min(untilDay, calendar.monthrange(year, month)[1])
+            if fromDay > untilDay:
+                return None
+            start = _timestamp(year, month, fromDay)
+            end = _timestamp(year, month, untilDay) + SECONDS_PER_DAY
+            residual.pop(0)
+            if fromDay == untilDay:
+                start += fromHour * SECONDS_PER_HOUR
+                end = start + (untilHour - fromHour + 1) * SECONDS_PER_HOUR
+                residual.pop(0)
+    # Drop filters that let every value through
+    residual = [(name, low, high) for name, low, high in residual
+                if low > FIELD_LIMITS[name][0] or high < FIELD_LIMITS[name][1]]
+    return start, end, residual
+
+
+def _computeCalendarFields(timestamps):
+    # year, month, day and hour of every timestamp with numpy datetime
+    # arithmetic
+    seconds = timestamps.astype('datetime64[s]')
+    days = seconds.astype('datetime64[D]')
+    months = seconds.astype('datetime64[M]')
+    years = seconds.astype('datetime64[Y]')
+    return {'year': (years.astype(np.int64) + 1970).astype(np.int16),
+            'month': (months.astype(np.int64) % 12 + 1).astype(np.int8),
+            'day': ((days - months.astype('datetime64[D]'))
+                    .astype(np.int64) + 1).astype(np.int8),
+            'hour': (timestamps % SECONDS_PER_DAY //
+                     SECONDS_PER_HOUR).astype(np.int8)}
+
+
+def _addMembers(members, memberCodes, names):
+    # Codes of names in members, registering the unseen ones
+    codeMap = []
+    for user in names:
+        code = memberCodes.get(user)
+        if code is None:
+            code = len(members)
+            memberCodes[user] = code
+            members.append(user)
+        codeMap.append(code)
+    return codeMap
+
+
+def normalizeFrame(fromHour, untilHour, fromDay, untilDay, fromMonth,
+                   untilMonth, fromYear, untilYear):
+    # The frame with every bound clamped to the values its field can take,
+    # so equivalent frames compare equal; None if no message can match
+    frame = []
+    for low, high, (minimum, maximum) in (
+            (fromHour, untilHour, FIELD_LIMITS['hour']),
+            (fromDay, untilDay, FIELD_LIMITS['day']),
+            (fromMonth, untilMonth, FIELD_LIMITS['month']),
+            (fromYear, untilYear, (MINYEAR, MAXYEAR))):
+        low = max(int(low), minimum)
+        high = min(int(high), maximum)
+        if low > high:
+            return None
+        frame.extend((low, high))
+    return tuple(frame)
+
+
+def _bufferArray(buf):
+    # np.frombuffer refuses zero length buffers
+    if not len(buf):
+        return np.zeros(0, dtype=np.uint8)
+    return np.frombuffer(buf, dtype=np.uint8)
+
+
+def _columnArray(column, dtype):
+    # Copy of an array.array column as a numpy array of dtype, read
+    # through the buffer instead of element by element
+    if not len(column):
+        return np.zeros(0, dtype=dtype)
+    return np.frombuffer(column, dtype=column.typecode).astype(dtype)
+
+
+class MessageStoreBuilder(object):
+    # Accumulates parsed messages column by column so that no per-message
+    # Python object outlives the parse.
+
+    def __init__(self):
+        self.timestamps = array(_TIMESTAMP_TYPECODE)
+        self.userCodes = array('i')
+        self.textBuffer = bytearray()
+        self.textOffsets = array(_TIMESTAMP_TYPECODE, [0])
+        self.members = []
+        self.memberCodes = dict()
+
+    def append(self, timestamp, user, text):
+        code = self.memberCodes.get(user)
+        if code is None:
+            code = len(self.members)
+            self.memberCodes[user] = code
+            self.members.append(user)
+        self.timestamps.append(timestamp)
+        self.userCodes.append(code)
+        self.textBuffer += text
+        self.textOffsets.append(len(self.textBuffer))
+
+    def appendColumns(self, timestamps, users, texts):
+        # append() for many messages given as three parallel lists
+        codes = map(self.memberCodes.get, users)
+        if None in codes:
+            # New members get their codes in order of appearance
+            _addMembers(self.members, self.memberCodes,
+                        sorted(set(users).difference(self.memberCodes),
+                               key=users.index))
+            codes = map(self.memberCodes.get, users)
+        self.timestamps.extend(timestamps)
+        self.userCodes.extend(codes)
+        offsets = np.cumsum(map(len, texts)) + len(self.textBuffer)
+        self.textBuffer += ''.join(texts)
+        self.textOffsets.extend(offsets.tolist())
+
+    def appendMessage(self, date, user, text):
+        self.append(dateToTimestamp(date), user, text)
+
+    def extend(self, other):
+        # Appends everything another builder collected, e.g. a chunk
+        # parsed in a worker process, translating its member codes
+        codeMap = _addMembers(self.members, self.memberCodes, other.members)
+        base = len(self.textBuffer)
+        self.timestamps.extend(other.timestamps)
+        self.userCodes.extend(array('i', (codeMap[code]
+                                          for code in other.userCodes)))
+        self.textBuffer += other.textBuffer
+        self.textOffsets.extend(array(_TIMESTAMP_TYPECODE,
+                                      (base + offset for offset
+                                       in other.textOffsets[1:])))
+
+    def build(self):
+        return MessageStore(_columnArray(self.timestamps, np.int64),
+                            _columnArray(self.userCodes, np.int32),
+                            list(self.members),
+                            _bufferArray(self.textBuffer),
+                            _columnArray(self.textOffsets, np.int64))
+
+
+class MessageStore(object):
+    # Columnar message storage:
+    #   timestamps  int64 epoch seconds, one per message
+    #   userCodes   int32 index into members, one per message
+    #   members     list of member names (code -> name)
+    #   textBuffer  uint8 array holding every text back to back
+    #   textOffsets int64 array of len(messages) + 1 boundaries into
+    #               textBuffer, message i is textBuffer[off[i]:off[i+1]]
+
+    def __init__(self, timestamps, userCodes, members, textBuffer,
+                 textOffsets, derived=None):
+        # derived takes the output of derivedArrays() of an identical
+        # store (e.g. from a snapshot) so nothing is recomputed
+        self.timestamps = timestamps
+        self.userCodes = userCodes
+        self.members = members
+        self.memberCodes = dict((name, code)
+                                for code, name in enumerate(members))
+        self.textBuffer = textBuffer
+        self.textOffsets = textOffsets
+        # Bumped on every change so derived results can be invalidated
+        self.version = 0
+        # A waprofile.Profiler told about every pass over the columns
+        self.profiler = None
+        self._calendarFields = None
+        self._activityCube = None
+        if derived is None:
+            self._buildTimeIndex()
+        else:
+            self._setTimeIndex(derived.get('order'))
+            if 'year' in derived:
+                self._calendarFields = dict((name, derived[name])
+                                            for name in CALENDAR_FIELDS)
+            if 'cube' in derived:
+                self._activityCube = ActivityCube(derived['cube'],
+                                                  derived['cubeYears'])
+
+    def _buildTimeIndex(self):
+        # Exports are chronological so normally the timestamps already are
+        # the index; otherwise keep a stable argsort permutation.
+        if np.all(self.timestamps[1:] >= self.timestamps[:-1]):
+            self._setTimeIndex(None)
+        else:
+            self._setTimeIndex(np.argsort(self.timestamps, kind='mergesort'))
+
+    def _setTimeIndex(self, order):
+        self._order = order
+        if order is None:
+            self._sortedTimestamps = self.timestamps
+        else:
+            self._sortedTimestamps = self.timestamps[order]
+
+    def extend(self, builder):
+        # Appends the messages a MessageStoreBuilder collected, carrying
+        # the calendar fields and time index along instead of recomputing
+        # them for the whole store. Returns the number of new messages.
+        if not len(builder.timestamps):
+            return 0
+        codeMap = np.array(_addMembers(self.members, self.memberCodes,
+                                       builder.members), dtype=np.int32)
+        newTimestamps = np.array(builder.timestamps, dtype=np.int64)
+        newOffsets = (np.array(builder.textOffsets[1:], dtype=np.int64) +
+                      self.textOffsets[-1])
+        lastTimestamp = self.timestamps[-1] if len(self) else None
+
+        self.timestamps = np.concatenate([self.timestamps, newTimestamps])
+        self.userCodes = np.concatenate(
+            [self.userCodes,
+             codeMap[np.array(builder.userCodes, dtype=np.int64)]])
+        self.textBuffer = np.concatenate(
+            [self.textBuffer, _bufferArray(builder.textBuffer)])
+        self.textOffsets = np.concatenate([self.textOffsets, newOffsets])
+        if self._calendarFields is not None:
+            newFields = _computeCalendarFields(newTimestamps)
+            self._calendarFields = dict(
+                (name, np.concatenate([self._calendarFields[name],
+                                       newFields[name]]))
+                for name in CALENDAR_FIELDS)
+            if (self._activityCube is not None and
+                    not self._activityCube.add(self.userCodes[-len(
+                        newTimestamps):], newFields)):
+                self._activityCube = None
+        else:
+            self._activityCube = None
+        if (self._order is None and
+                np.all(newTimestamps[1:] >= newTimestamps[:-1]) and
+                (lastTimestamp is None or newTimestamps[0] >= lastTimestamp)):
+            self._setTimeIndex(None)
+        else:
+            self._buildTimeIndex()
+        self.version += 1
+        return len(newTimestamps)
+
+    def truncate(self, length):
+        # Drops the messages from length on, the ones appended last, e.g.
+        # a partly written line of the export that is about to be parsed
+        # again. The calendar fields, activity cube and time index are
+        # cut down along with the columns.
+        if length >= len(self):
+            return
+        if self._calendarFields is not None:
+            if self._activityCube is not None:
+                self._activityCube.remove(
+                    self.userCodes[length:],
+                    dict((name, values[length:]) for name, values
+                         in self._calendarFields.iteritems()))
+            self._calendarFields = dict(
+                (name, values[:length]) for name, values
+                in self._calendarFields.iteritems())
+        else:
+            self._activityCube = None
+        self.timestamps = self.timestamps[:length]
+        self.userCodes = self.userCodes[:length]
+        self.textBuffer = self.textBuffer[:self.textOffsets[length]]
+        self.textOffsets = self.textOffsets[:length + 1]
+        if self._order is None:
+            self._setTimeIndex(None)
+        else:
+            self._buildTimeIndex()
+        self.version += 1
+
+    def derivedArrays(self):
+        # Everything computed from the columns that is worth persisting
+        # next to them
+        derived = dict(self.calendarFields())
+        if self._order is not None:
+            derived['order'] = self._order
+        cube = self.activityCube()
+        derived['cube'] = cube.counts
+        derived['cubeYears'] = cube.years
+        return derived
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def getText(self, i):
+        return self.textBuffer[self.textOffsets[i]:
+                               self.textOffsets[i + 1]].tostring()
+
+    def getUser(self, i):
+        return self.members[self.userCodes[i]]
+
+    def getDate(self, i):
+        return timestampToDate(self.timestamps[i])
+
+    def getMessage(self, i):
+        return Message(self.getDate(i), self.getUser(i), self.getText(i))
+
+    def calendarFields(self):
+        # year, month, day and hour of every message, computed once and
+        # kept for all later scans
+        if self._calendarFields is None:
+            if self.profiler is not None:
+                self.profiler.scan('calendarFields', len(self))
+            self._calendarFields = _computeCalendarFields(self.timestamps)
+        return self._calendarFields
+
+    def activityCube(self):
+        # ActivityCube of the store, built on first use and kept up to
+        # date by extend()
+        if self._activityCube is None:
+            if self.profiler is not None:
+                self.profiler.scan('activityCube', len(self))
+            self._activityCube = ActivityCube.build(self)
+        return self._activityCube
+
+    def indicesBetween(self, start, end):
+        # Indices of the messages with start <= timestamp < end, found by
+        # bisection on the time index, in chronological order
+        low, high = np.searchsorted(self._sortedTimestamps, [start, end])
+        if self._order is None:
+            return np.arange(low, high)
+        return self._order[low:high]
+
+    def frameIndices(self, fromHour=0, untilHour=23, fromDay=1, untilDay=31,
+                     fromMonth=1, untilMonth=12, fromYear=2009,
+                     untilYear=2020):
+        # Store order indices of the messages isMessageInFrame accepts.
+        # The year/month/day part of the frame that is contiguous in time
+        # is located by bisection, only the remaining field ranges are
+        # checked message by message inside that span.
+        span = _frameSpan(fromHour, untilHour, fromDay, untilDay, fromMonth,
+                          untilMonth, fromYear, untilYear)
+        if span is None:
+            return np.zeros(0, dtype=np.int64)
+        start, end, residual = span
+        indices = self.indicesBetween(start, end)
+        if residual:
+            if self.profiler is not None:
+                self.profiler.scan('frameFilter', len(indices))
+            fields = self.calendarFields()
+            keep = np.ones(len(indices), dtype=bool)
+            for name, low, high in residual:
+                values = fields[name][indices]
+                keep &= values >= low
+                keep &= values <= high
+            indices = indices[keep]
+        if self._order is not None:
+            indices = np.sort(indices)
+        return indices
+
+    def holdsEverything(self, fromHour=0, untilHour=23, fromDay=1,
+                        untilDay=31, fromMonth=1, untilMonth=12,
+                        fromYear=2009, untilYear=2020):
+        # Whether every message of the store is inside the frame, so that
+        # counting them needs no calendar fields
+        span = _frameSpan(fromHour, untilHour, fromDay, untilDay, fromMonth,
+                          untilMonth, fromYear, untilYear)
+        if span is None or not len(self):
+            return not len(self)
+        start, end, residual = span
+        return (not residual and start <= self._sortedTimestamps[0] and
+                self._sortedTimestamps[-1] < end)
+
+    def countByMember(self, indices=None):
+        userCodes = (self.userCodes if indices is None
+                     else self.userCodes[indices])
+        if self.profiler is not None:
+            self.profiler.scan('countByMember', len(userCodes))
+        return np.bincount(userCodes, minlength=len(self.members))
+
+    def groupCounts(self, buckets, indices=None):
+        # Generic member x bucket aggregation done in one bincount pass.
+        # buckets is a sequence of (fieldName, low, high) with inclusive
+        # bounds over calendarFields(); the result has shape
+        # (len(members), high1 - low1 + 1, high2 - low2 + 1, ...) and
+        # messages falling outside any bucket range are not counted.
+        # indices restricts the pass to a subset, e.g. frameIndices().
+        fields = self.calendarFields()
+        keys = self.userCodes.astype(np.int64)
+        if indices is not None:
+            keys = keys[indices]
+        if self.profiler is not None:
+            self.profiler.scan('groupCounts', len(keys))
+        valid = np.ones(len(keys), dtype=bool)
+        shape = [len(self.members)]
+        for name, low, high in buckets:
+            size = max(high - low + 1, 0)
+            values = fields[name]
+            if indices is not None:
+                values = values[indices]
+            values = values.astype(np.int64) - low
+            valid &= values >= 0
+            valid &= values < size
+            keys = keys * size + values
+            shape.append(size)
+        counts = np.bincount(keys[valid], minlength=int(np.prod(shape)))
+        return counts.reshape(shape)
+
+    def memberCounts(self, indices=None):
+        # Same shape as the old defaultdict based counting: only members
+        # with at least one message in the frame show up
+        return self.memberDict(self.countByMember(indices))
+
+    def memberDict(self, counts):
+        # {member: count} for the nonzero entries of a per-member array
+        return dict((self.members[code], count)
+                    for code, count in enumerate(counts.tolist()) if count)
+
+
+class MessageListView(Sequence):
+    # Read only stand-in for the old list of Message namedtuples, building
+    # each Message on access.
+
+    def __init__(self, store):
+        self.store = store
+
+    def __len__(self):
+        return len(self.store)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.store.getMessage(i)
+                    for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("message index out of range")
+        return self.store.getMessage(index)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self.store.getMessage(i)
@@ -0,0 +1,237 @@
+from itertools import islice
+import time
+import numpy as np
+from waparse import ChatParser
+from wastore import (SECONDS_PER_DAY, _computeCalendarFields,
+                     normalizeFrame)
+from wacube import ActivityCube, MONTH_AXIS, HOUR_AXIS
+from wakeyword import TOKEN_PATTERN
+
+# Messages aggregated at once; the only per-message memory the stream holds
+BATCH_SIZE = 8192
+# The frame WAChat's methods use by default
+DEFAULT_FRAME = normalizeFrame(0, 23, 1, 31, 1, 12, 2009, 2020)
+
+
+def readLines(fileName, offset=0):
+    with open(fileName, 'r') as infile:
+        infile.seek(offset)
+        for line in infile:
+            yield line
+
+
+def parseRecords(lines, parser):
+    # (timestamp, user, text) of every message line, keeping the parser's
+    # line/byte/time statistics as parseInto does
+    parseLine = parser.parseLine
+    started = time.time()
+    try:
+        for line in lines:
+            parser.linesRead += 1
+            parser.bytesRead += len(line)
+            record = parseLine(line)
+            if record is not None:
+                yield record
+    finally:
+        parser.secondsSpent += time.time() - started
+
+
+def batches(records, size=BATCH_SIZE):
+    # Lists of up to size consecutive records
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+class _DailyCounts(object):
+    # members x days counts, growing as needed. Days are numbered in 24
+    # hour steps from the first message as WAChat.getMemberDailyFrequencies
+    # does, negative for messages dated before it (clock jumps in the
+    # export); column 0 holds day firstDay.
+
+    def __init__(self):
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+        self.firstDay = 0
+
+    def add(self, userCodes, days, numberOfMembers):
+        rows, columns = self.counts.shape
+        firstDay = self.firstDay
+        endDay = firstDay + columns
+        if len(days):
+            firstDay = min(firstDay, int(days.min()))
+            endDay = max(endDay, int(days.max()) + 1)
+        if (numberOfMembers > rows or firstDay < self.firstDay or
+                endDay > self.firstDay + columns):
+            counts = np.zeros((max(numberOfMembers, rows), endDay - firstDay),
+                              dtype=np.int64)
+            shift = self.firstDay - firstDay
+            counts[:rows, shift:shift + columns] = self.counts
+            self.counts = counts
+            self.firstDay = firstDay
+        rows, columns = self.counts.shape
+        self.counts += np.bincount(userCodes * columns + days - firstDay,
+                                   minlength=rows * columns).reshape(
+                                       rows, columns)
+
+
+class StreamingChat(object):
+    # Single pass, constant memory counterpart of WAChat for exports that
+    # do not fit in memory. Records flow through
+    #   readLines -> parseRecords -> batches -> consume
+    # and only running aggregates are kept: an ActivityCube of message
+    # counts per member and hour, and per member x day timelines of all
+    # messages and of the messages containing each of keywords. Message
+    # texts are looked at once, for the keywords, and dropped, so memory
+    # depends on the number of members, years and days, not messages.
+    # The getMember*Frequencies and getMembers answers are the same as
+    # WAChat's for the same export.
+
+    def __init__(self, keywords=(), substring=True, keepUnicode=False):
+        # keywords are the ones getMemberDailyFrequencies can be asked
+        # about later; substring=False counts them as whole words only.
+        # keepUnicode as for WAChat
+        self.members = []
+        self.memberCodes = dict()
+        self.keywords = [keyword.lower() for keyword in keywords]
+        self.substring = substring
+        self.parser = ChatParser(keepUnicode=keepUnicode)
+        self.cube = ActivityCube.empty()
+        self.daily = _DailyCounts()
+        self.keywordDaily = dict((keyword, _DailyCounts())
+                                 for keyword in self.keywords)
+        self.firstTimestamp = None
+        # Range of the day numbers of the messages, see _DailyCounts
+        self.firstDay = self.lastDay = None
+        self.messages = 0
+
+    @classmethod
+    def fromFile(cls, fileName, keywords=(), substring=True,
+                 keepUnicode=False, batchSize=BATCH_SIZE):
+        chat = cls(keywords, substring, keepUnicode)
+        chat.consumeFile(fileName, batchSize)
+        return chat
+
+    def consumeFile(self, fileName, batchSize=BATCH_SIZE):
+        for batch in batches(parseRecords(readLines(fileName), self.parser),
+                             batchSize):
+            self.consume(batch)
+        return self
+
+    def _codes(self, users):
+        codes = np.empty(len(users), dtype=np.int64)
+        memberCodes = self.memberCodes
+        for i, user in enumerate(users):
+            code = memberCodes.get(user)
+            if code is None:
+                code = memberCodes[user] = len(self.members)
+                self.members.append(user)
+            codes[i] = code
+        return codes
+
+    def _keywordMessages(self, texts):
+        # {keyword: boolean mask of the texts containing it}
+        lowered = [text.lower() for text in texts]
+        if self.substring:
+            return dict((keyword, np.fromiter((keyword in text
+                                               for text in lowered),
+                                              dtype=bool, count=len(texts)))
+                        for keyword in self.keywords)
+        words = [set(TOKEN_PATTERN.findall(text)) for text in lowered]
+        masks = dict()
+        for keyword in self.keywords:
+            terms = set(TOKEN_PATTERN.findall(keyword))
+            masks[keyword] = np.fromiter(
+                (bool(terms) and terms <= messageWords
+                 for messageWords in words), dtype=bool, count=len(texts))
+        return masks
+
+    def consume(self, records):
+        # Adds a batch of (timestamp, user, text) records to the aggregates
+        if not records:
+            return
+        timestamps, users, texts = zip(*records)
+        timestamps = np.array(timestamps, dtype=np.int64)
+        userCodes = self._codes(users)
+        if self.firstTimestamp is None:
+            self.firstTimestamp = int(timestamps[0])
+        self.messages += len(timestamps)
+
+        fields = _computeCalendarFields(timestamps)
+        self.cube.grow(len(self.members), np.unique(fields['year']))
+        self.cube.add(userCodes, fields)
+        days = (timestamps - self.firstTimestamp) // SECONDS_PER_DAY
+        firstDay, lastDay = int(days.min()), int(days.max())
+        if self.firstDay is not None:
+            firstDay = min(firstDay, self.firstDay)
+            lastDay = max(lastDay, self.lastDay)
+        self.firstDay, self.lastDay = firstDay, lastDay
+        self.daily.add(userCodes, days, len(self.members))
+        if self.keywords:
+            for keyword, mask in self._keywordMessages(texts).iteritems():
+                self.keywordDaily[keyword].add(userCodes[mask], days[mask],
+                                               len(self.members))
+
+    def __len__(self):
+        return self.messages
+
+    def getMembers(self, fromHour=0, untilHour=23, fromDay=1, untilDay=31,
+                   fromMonth=1, untilMonth=12, fromYear=2009, untilYear=2020):
+        frame = normalizeFrame(fromHour, untilHour, fromDay, untilDay,
+                               fromMonth, untilMonth, fromYear, untilYear)
+        if frame is None:
+            return dict()
+        return self._memberDict(self.cube.total(frame))
+
+    def _memberDict(self, counts):
+        return dict((self.members[code], count)
+                    for code, count in enumerate(counts.tolist()) if count)
+
+    def _perMember(self, counts):
+        # {member: counts row} for the members getMembers() lists
+        return dict((name, counts[self.memberCodes[name]].tolist())
+                    for name in self.getMembers())
+
+    def getMemberHourlyFrequencies(self):
+        return self._perMember(self.cube.total(DEFAULT_FRAME,
+                                               keepAxes=(HOUR_AXIS,)))
+
+    def getMemberMonthlyFrequencies(self):
+        return self._perMember(self.cube.total(DEFAULT_FRAME,
+                                               keepAxes=(MONTH_AXIS,)))
+
+    def _checkSubstring(self, substring):
+        if substring is not None and bool(substring) != self.substring:
+            raise ValueError("keywords were counted with substring=%s"
+                             % self.substring)
+
+    def getMemberDailyFrequencies(self, keyword=None, substring=None):
+        # Only keywords given to the constructor can be answered, the
+        # texts are gone by now
+        self._checkSubstring(substring)
+        if keyword:
+            keyword = keyword.lower()
+            if keyword not in self.keywordDaily:
+                raise KeyError("keyword %r was not counted while streaming"
+                               % keyword)
+            daily = self.keywordDaily[keyword]
+        else:
+            daily = self.daily
+        if self.firstDay is None:
+            return dict()
+        numberOfDays = self.lastDay - self.firstDay + 1
+        counts = np.zeros((len(self.members), numberOfDays), dtype=np.int64)
+        rows, columns = daily.counts.shape
+        start = daily.firstDay - self.firstDay
+        counts[:rows, start:start + columns] = daily.counts
+        return self._perMember(counts)
+
+    def getKeywordsDailyFrequencies(self, keywords, substring=None):
+        # A single keyword may be given as a plain string, as in WAChat
+        self._checkSubstring(substring)
+        if isinstance(keywords, basestring):
+            keywords = [keywords]
+        return dict((keyword, self.getMemberDailyFrequencies(keyword))
+                    for keyword in keywords)
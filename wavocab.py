@@ -0,0 +1,215 @@
+from collections import Counter
+from multiprocessing import Pool
+import heapq
+import numpy as np
+from wakeyword import TOKEN_PATTERN
+
+# Messages tokenized per task when building in parallel
+CHUNK_MESSAGES = 100000
+
+
+class TopKSummary(object):
+    # Bounded memory frequent terms summary (Misra-Gries, which is the
+    # mergeable form of space-saving): at most k terms are kept, each
+    # count is at most `error` below the term's true count, and summaries
+    # of disjoint message sets merge into a summary of their union.
+
+    def __init__(self, k):
+        self.k = k
+        self.counts = dict()
+        self.error = 0
+
+    def update(self, counts):
+        # Adds a {term: count} mapping
+        mine = self.counts
+        for term, count in counts.iteritems():
+            mine[term] = mine.get(term, 0) + count
+        self._prune()
+        return self
+
+    def merge(self, other):
+        self.error += other.error
+        return self.update(other.counts)
+
+    def _prune(self):
+        if len(self.counts) > self.k:
+            cut = heapq.nlargest(self.k + 1, self.counts.itervalues())[-1]
+            self.error += cut
+            self.counts = dict((term, count - cut) for term, count
+                               in self.counts.iteritems() if count > cut)
+
+    def mostCommon(self, n):
+        return heapq.nlargest(n, self.counts.iteritems(),
+                              key=lambda item: item[1])
+
+
+def tokenize(text):
+    # Lowercase words of a text, as KeywordIndex's token mode finds them
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _countChunk(task):
+    # Pool worker: word and bigram counts per bucket of a run of messages.
+    # With topK they go into a TopKSummary per bucket whenever more than
+    # 4 * topK terms are pending, so no bucket holds its full vocabulary
+    # (flushing less often keeps the pruning cheap).
+    textBuffer, textOffsets, buckets, topK = task
+    counts = dict()
+    summaries = dict()
+    findall = TOKEN_PATTERN.findall
+    for i, bucket in enumerate(buckets.tolist()):
+        words = findall(textBuffer[textOffsets[i]:
+                                   textOffsets[i + 1]].lower())
+        if not words:
+            continue
+        entry = counts.get(bucket)
+        if entry is None:
+            entry = counts[bucket] = (Counter(), Counter())
+            if topK is not None:
+                summaries[bucket] = (TopKSummary(topK), TopKSummary(topK))
+        entry[0].update(words)
+        entry[1].update(' '.join(pair) for pair in zip(words, words[1:]))
+        if topK is not None:
+            for pending, summary in zip(entry, summaries[bucket]):
+                if len(pending) > 4 * topK:
+                    summary.update(pending)
+                    pending.clear()
+    if topK is None:
+        return counts
+    for bucket, entry in counts.iteritems():
+        for pending, summary in zip(entry, summaries[bucket]):
+            summary.update(pending)
+    return summaries
+
+
+class VocabularyIndex(object):
+    # Word and bigram counts of a MessageStore per member and calendar
+    # month, tokenized once. Questions about any member and any frame of
+    # years and months (with isMessageInFrame's semantics) are answered
+    # by merging the counts of the buckets inside it. Building shards the
+    # messages over a pool of workers processes; with topK every bucket
+    # keeps a TopKSummary of its topK most frequent terms instead of
+    # exact counts, bounding memory for very large vocabularies.
+
+    def __init__(self, store, workers=1, topK=None,
+                 chunkMessages=CHUNK_MESSAGES):
+        self.store = store
+        self.version = store.version
+        self.topK = topK
+        fields = store.calendarFields()
+        years = fields['year']
+        self.firstYear = int(years.min()) if len(years) else 1970
+        numberOfYears = (int(years.max()) - self.firstYear + 1
+                         if len(years) else 0)
+        self.numberOfMonths = numberOfYears * 12
+        monthIndex = ((years.astype(np.int64) - self.firstYear) * 12 +
+                      fields['month'] - 1)
+        buckets = (store.userCodes.astype(np.int64) * self.numberOfMonths +
+                   monthIndex)
+        self.buckets = dict()
+        if store.profiler is not None:
+            store.profiler.scan('vocabulary', len(store))
+        self._build(buckets, workers, chunkMessages)
+
+    def _tasks(self, buckets, chunkMessages):
+        store = self.store
+        for low in range(0, len(store), chunkMessages):
+            high = min(low + chunkMessages, len(store))
+            offsets = store.textOffsets[low:high + 1]
+            yield (store.textBuffer[offsets[0]:offsets[-1]].tostring(),
+                   (offsets - offsets[0]).tolist(), buckets[low:high],
+                   self.topK)
+
+    def _build(self, buckets, workers, chunkMessages):
+        tasks = self._tasks(buckets, chunkMessages)
+        if workers > 1:
+            pool = Pool(workers)
+            try:
+                for counts in pool.imap(_countChunk, tasks):
+                    self._merge(counts)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                self._merge(_countChunk(task))
+
+    def _merge(self, counts):
+        for bucket, entry in counts.iteritems():
+            mine = self.buckets.get(bucket)
+            if mine is None:
+                self.buckets[bucket] = entry
+            elif self.topK is None:
+                mine[0].update(entry[0])
+                mine[1].update(entry[1])
+            else:
+                mine[0].merge(entry[0])
+                mine[1].merge(entry[1])
+
+    def _selectBuckets(self, memberName, fromMonth, untilMonth, fromYear,
+                       untilYear):
+        if memberName is None:
+            codes = range(len(self.store.members))
+        elif memberName in self.store.memberCodes:
+            codes = [self.store.memberCodes[memberName]]
+        else:
+            codes = []
+        months = [(year - self.firstYear) * 12 + month - 1
+                  for year in range(max(fromYear, self.firstYear),
+                                    min(untilYear, self.firstYear +
+                                        self.numberOfMonths // 12 - 1) + 1)
+                  for month in range(max(fromMonth, 1),
+                                     min(untilMonth, 12) + 1)]
+        return [code * self.numberOfMonths + month
+                for code in codes for month in months]
+
+    def _top(self, which, n, memberName, fromMonth, untilMonth, fromYear,
+             untilYear):
+        entries = [self.buckets[bucket][which] for bucket
+                   in self._selectBuckets(memberName, fromMonth, untilMonth,
+                                          fromYear, untilYear)
+                   if bucket in self.buckets]
+        if self.topK is None:
+            total = Counter()
+            for counts in entries:
+                total.update(counts)
+            return total.most_common(n)
+        total = TopKSummary(self.topK)
+        for summary in entries:
+            total.merge(summary)
+        return total.mostCommon(n)
+
+    def topWords(self, n=20, memberName=None, fromMonth=1, untilMonth=12,
+                 fromYear=2009, untilYear=2020):
+        # [(word, count)] of the n most used words in the frame, by
+        # memberName or by everyone
+        return self._top(0, n, memberName, fromMonth, untilMonth, fromYear,
+                         untilYear)
+
+    def topBigrams(self, n=20, memberName=None, fromMonth=1, untilMonth=12,
+                   fromYear=2009, untilYear=2020):
+        # Same as topWords for pairs of consecutive words ('see you')
+        return self._top(1, n, memberName, fromMonth, untilMonth, fromYear,
+                         untilYear)
+
+    def topWordsByMember(self, n=20, bigrams=False, fromMonth=1,
+                         untilMonth=12, fromYear=2009, untilYear=2020):
+        # {member: top n words (or bigrams)} in the frame
+        which = 1 if bigrams else 0
+        return dict((memberName,
+                     self._top(which, n, memberName, fromMonth, untilMonth,
+                               fromYear, untilYear))
+                    for memberName in self.store.members)
+
+    def topWordsByMonth(self, n=20, bigrams=False, memberName=None):
+        # {'YYYY-MM': top n words (or bigrams)} for every month of the
+        # chat, of memberName or of everyone
+        which = 1 if bigrams else 0
+        result = dict()
+        for monthIndex in range(self.numberOfMonths):
+            year = self.firstYear + monthIndex // 12
+            month = monthIndex % 12 + 1
+            top = self._top(which, n, memberName, month, month, year, year)
+            if top:
+                result['%d-%02d' % (year, month)] = top
+        return result